@@ -1,16 +1,61 @@
 # agents.py
+import json
+import re
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import JsonOutputParser
-from typing import Dict, List
-import json
+from langchain_core.runnables import Runnable
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
+from config import MedicalConfig
+from context_packer import ContextPacker, compact_json
+from llm_memo import MemoizedLLM, parses_as_json
+from retriever import MedicalRetriever
+
+# "column: value" lines of a rendered row whose value is a number, e.g. "troponin: 0.45" or "sodium: <135"
+NUMERIC_FIELD_PATTERN = re.compile(r"^([^:\n]+):\s*[<>]?=?\s*-?\d", re.MULTILINE)
 
 class MedicalAgents:
-    def __init__(self, llm, vector_store):
+    # State buckets filled by each data type's search results
+    DATA_TYPE_BUCKETS = {
+        "clinical": ["patient_data", "clinical_notes"],
+        "imaging": ["imaging_data"],
+        "ophthalmology": ["imaging_data"],
+        "genomic": ["genomic_data"],
+        "pathology": ["pathology_data"],
+        "cardiology": ["cardiology_data"]
+    }
+    
+    # Clinical hits with a numeric column named by any of these words (or the analyzer's lab_tests)
+    # also go to lab_results
+    LAB_KEYWORDS = ["lab", "troponin", "glucose", "creatinine", "hemoglobin", "wbc", "platelet",
+                    "potassium", "sodium", "lactate", "bnp", "hba1c", "cholesterol"]
+    
+    def __init__(self, llm, vector_store, config=None, lexical_index=None, packer=None):
         self.llm = llm
+        # JSON agents only memoize completions their parser accepts
+        self.json_llm = llm.with_validator(parses_as_json) if isinstance(llm, MemoizedLLM) else llm
         self.vector_store = vector_store
+        self.config = config or MedicalConfig()
+        self.retriever = MedicalRetriever(vector_store, self.config, lexical_index)
+        self.packer = packer or ContextPacker(self.config.LLM_MODEL, self.config.CONTEXT_MAX_DOCUMENT_TOKENS)
+    
+    def use_index(self, vector_store, lexical_index=None) -> MedicalRetriever:
+        """Search another index from the next retrieval on; returns the previous retriever for closing"""
+        retriever = self.retriever
+        self.vector_store = vector_store
+        self.retriever = MedicalRetriever(vector_store, self.config, lexical_index)
+        return retriever
     
     def query_analyzer_agent(self, state: Dict) -> Dict:
         """Analyze medical query and extract entities"""
+        chain, inputs = self._query_analyzer_chain(state)
+        return {"query_analysis": chain.invoke(inputs)}
+    
+    async def aquery_analyzer_agent(self, state: Dict) -> Dict:
+        """Async query_analyzer_agent"""
+        chain, inputs = self._query_analyzer_chain(state)
+        return {"query_analysis": await chain.ainvoke(inputs)}
+    
+    def _query_analyzer_chain(self, state: Dict) -> Tuple[Runnable, Dict]:
         prompt = ChatPromptTemplate.from_template("""
         You are a medical query analyzer. Analyze the following medical query and extract all relevant medical entities, conditions, and search criteria.
         
@@ -24,31 +69,60 @@ class MedicalAgents:
             "conditions": ["list of medical conditions"],
             "demographics": ["age, gender, etc if mentioned"],
             "exclusions": ["exclusion criteria"],
-            "data_types_needed": ["imaging", "clinical", "genomic", "pathology", "cardiology"],
+            "data_types_needed": {data_types},
             "search_terms": ["key terms for vector search"]
         }}
         
         Return only valid JSON.
         """)
         
-        chain = prompt | self.llm | JsonOutputParser()
-        analysis = chain.invoke({"query": state["query"]})
-        
-        return {"query_analysis": analysis}
+        chain = prompt | self.json_llm | JsonOutputParser()
+        # Offer every configured data type so each dataset can be requested
+        return chain, {"query": state["query"], "data_types": json.dumps(self.retriever.data_types())}
     
     def data_retrieval_agent(self, state: Dict) -> Dict:
         """Retrieve relevant data from all sources"""
         query_analysis = state.get("query_analysis", {})
-        search_terms = query_analysis.get("search_terms", [])
+        search_queries = self.search_queries(state)
         data_types_needed = query_analysis.get("data_types_needed", [])
         
-        # Combine search terms
-        search_query = " ".join(search_terms) if search_terms else state["query"]
+        # Search each requested data type separately, so one type cannot crowd out the others;
+        # hits under RETRIEVAL_MIN_SCORE never reach the analysis prompts
+        if len(search_queries) > 1:
+            # One search per term, so a single concept is not diluted by the others
+            docs_by_type = self.retriever.multi_search(search_queries, data_types_needed,
+                                                       query_embeddings=state.get("query_embeddings"))
+        else:
+            docs_by_type = self.retriever.search(search_queries[0], data_types_needed,
+                                                 query_embeddings=state.get("query_embeddings"))
+        
+        return self._organize_results(query_analysis, docs_by_type)
+    
+    async def adata_retrieval_agent(self, state: Dict) -> Dict:
+        """Async data_retrieval_agent; the index lookups run off the event loop"""
+        query_analysis = state.get("query_analysis", {})
+        search_queries = self.search_queries(state)
+        data_types_needed = query_analysis.get("data_types_needed", [])
         
-        # Perform similarity search
-        docs = self.vector_store.similarity_search(search_query, k=20)
+        if len(search_queries) > 1:
+            docs_by_type = await self.retriever.amulti_search(search_queries, data_types_needed,
+                                                              query_embeddings=state.get("query_embeddings"))
+        else:
+            docs_by_type = await self.retriever.asearch(search_queries[0], data_types_needed,
+                                                        query_embeddings=state.get("query_embeddings"))
         
-        # Organize results by data type
+        return self._organize_results(query_analysis, docs_by_type)
+    
+    def search_queries(self, state: Dict) -> List[str]:
+        """What data_retrieval_agent searches for: each search term, or the terms (or query) combined"""
+        search_terms = state.get("query_analysis", {}).get("search_terms", [])
+        if self.config.RETRIEVAL_MULTI_QUERY and len(search_terms) > 1:
+            return search_terms
+        # Combine search terms
+        return [" ".join(search_terms) if search_terms else state["query"]]
+    
+    def _organize_results(self, query_analysis: Dict, docs_by_type: Dict[str, List]) -> Dict:
+        """Organize results by data type"""
         results = {
             "patient_data": [],
             "imaging_data": [],
@@ -60,48 +134,61 @@ class MedicalAgents:
             "search_results": []
         }
         
-        for doc in docs:
-            data_type = doc.metadata.get("data_type", "unknown")
-            result_entry = {
-                "content": doc.page_content,
-                "metadata": doc.metadata,
-                "dataset": doc.metadata.get("dataset", "unknown"),
-                "relevance_score": 0.8  # Placeholder
-            }
-            
-            results["search_results"].append(result_entry)
-            
-            # Categorize by data type
-            if data_type == "clinical":
-                results["patient_data"].append(result_entry)
-                results["clinical_notes"].append(result_entry)
-            elif data_type == "imaging":
-                results["imaging_data"].append(result_entry)
-            elif data_type == "genomic":
-                results["genomic_data"].append(result_entry)
-            elif data_type == "pathology":
-                results["pathology_data"].append(result_entry)
-            elif data_type == "cardiology":
-                results["cardiology_data"].append(result_entry)
-        
+        lab_words = set(self.LAB_KEYWORDS)
+        for term in query_analysis.get("lab_tests", []):
+            lab_words.update(self._words(term))
+        
+        for data_type, docs in docs_by_type.items():
+            for doc, score in docs:
+                result_entry = {
+                    "content": doc.page_content,
+                    "metadata": doc.metadata,
+                    "dataset": doc.metadata.get("dataset", "unknown"),
+                    "relevance_score": round(score, 4)
+                }
+                
+                results["search_results"].append(result_entry)
+                for bucket in self.DATA_TYPE_BUCKETS.get(data_type, []):
+                    results[bucket].append(result_entry)
+                
+                if data_type == "clinical" and self._has_lab_values(doc.page_content, lab_words):
+                    results["lab_results"].append(result_entry)
+        
+        results["search_results"].sort(key=lambda entry: entry["relevance_score"], reverse=True)
         return results
     
+    @staticmethod
+    def _words(text: str) -> List[str]:
+        # Whole words, singular, so "Platelets" and "lab_platelet" both give "platelet"
+        return [word[:-1] if len(word) > 3 and word.endswith("s") else word
+                for word in re.findall(r"[a-z0-9]+", text.lower())]
+    
+    def _has_lab_values(self, content: str, lab_words: set) -> bool:
+        """True if a numeric column of the row is named by a lab word, so "sodium: 138" counts
+        but "medications: sodium valproate" or "available" in free text does not"""
+        return any(lab_words.intersection(self._words(column))
+                   for column in NUMERIC_FIELD_PATTERN.findall(content))
+    
     def clinical_analysis_agent(self, state: Dict) -> Dict:
         """Analyze clinical data and patient information"""
+        return self._analyze("clinical", self._clinical_analysis_chain(state))
+    
+    async def aclinical_analysis_agent(self, state: Dict) -> Dict:
+        """Async clinical_analysis_agent"""
+        return await self._aanalyze("clinical", self._clinical_analysis_chain(state))
+    
+    def _clinical_analysis_chain(self, state: Dict) -> Optional[Tuple[Runnable, Dict]]:
         patient_data = state.get("patient_data", [])
         clinical_notes = state.get("clinical_notes", [])
         
         if not patient_data and not clinical_notes:
-            return {"structured_data": {"clinical_analysis": "No clinical data found"}}
+            return None
         
         prompt = ChatPromptTemplate.from_template("""
         Analyze the following clinical data and extract structured patient information:
         
-        PATIENT DATA:
-        {patient_data}
-        
-        CLINICAL NOTES:
-        {clinical_notes}
+        PATIENT DATA AND CLINICAL NOTES:
+        {clinical_records}
         
         Extract:
         - Patient demographics
@@ -114,20 +201,26 @@ class MedicalAgents:
         Return as structured JSON.
         """)
         
-        chain = prompt | self.llm | JsonOutputParser()
-        analysis = chain.invoke({
-            "patient_data": json.dumps(patient_data, indent=2),
-            "clinical_notes": json.dumps(clinical_notes, indent=2)
-        })
-        
-        return {"structured_data": {"clinical_analysis": analysis}}
+        chain = prompt | self.json_llm | JsonOutputParser()
+        # Both buckets hold the same clinical hits; pack them once
+        return chain, {
+            "clinical_records": self.packer.pack(patient_data, clinical_notes,
+                                                 budget=self.config.ANALYSIS_CONTEXT_TOKENS)
+        }
     
     def imaging_analysis_agent(self, state: Dict) -> Dict:
         """Analyze imaging data"""
+        return self._analyze("imaging", self._imaging_analysis_chain(state))
+    
+    async def aimaging_analysis_agent(self, state: Dict) -> Dict:
+        """Async imaging_analysis_agent"""
+        return await self._aanalyze("imaging", self._imaging_analysis_chain(state))
+    
+    def _imaging_analysis_chain(self, state: Dict) -> Optional[Tuple[Runnable, Dict]]:
         imaging_data = state.get("imaging_data", [])
         
         if not imaging_data:
-            return {"structured_data": {"imaging_analysis": "No imaging data found"}}
+            return None
         
         prompt = ChatPromptTemplate.from_template("""
         Analyze the following medical imaging data:
@@ -144,17 +237,22 @@ class MedicalAgents:
         Return as structured JSON.
         """)
         
-        chain = prompt | self.llm | JsonOutputParser()
-        analysis = chain.invoke({"imaging_data": json.dumps(imaging_data, indent=2)})
-        
-        return {"structured_data": {"imaging_analysis": analysis}}
+        chain = prompt | self.json_llm | JsonOutputParser()
+        return chain, {"imaging_data": self.packer.pack(imaging_data, budget=self.config.ANALYSIS_CONTEXT_TOKENS)}
     
     def lab_analysis_agent(self, state: Dict) -> Dict:
         """Analyze lab results"""
+        return self._analyze("lab", self._lab_analysis_chain(state))
+    
+    async def alab_analysis_agent(self, state: Dict) -> Dict:
+        """Async lab_analysis_agent"""
+        return await self._aanalyze("lab", self._lab_analysis_chain(state))
+    
+    def _lab_analysis_chain(self, state: Dict) -> Optional[Tuple[Runnable, Dict]]:
         lab_results = state.get("lab_results", [])
         
         if not lab_results:
-            return {"structured_data": {"lab_analysis": "No lab data found"}}
+            return None
         
         prompt = ChatPromptTemplate.from_template("""
         Analyze the following laboratory results:
@@ -171,33 +269,152 @@ class MedicalAgents:
         Return as structured JSON.
         """)
         
-        chain = prompt | self.llm | JsonOutputParser()
-        analysis = chain.invoke({"lab_data": json.dumps(lab_results, indent=2)})
+        chain = prompt | self.json_llm | JsonOutputParser()
+        return chain, {"lab_data": self.packer.pack(lab_results, budget=self.config.ANALYSIS_CONTEXT_TOKENS)}
+    
+    def genomic_analysis_agent(self, state: Dict) -> Dict:
+        """Analyze genomic data"""
+        return self._analyze("genomic", self._genomic_analysis_chain(state))
+    
+    async def agenomic_analysis_agent(self, state: Dict) -> Dict:
+        """Async genomic_analysis_agent"""
+        return await self._aanalyze("genomic", self._genomic_analysis_chain(state))
+    
+    def _genomic_analysis_chain(self, state: Dict) -> Optional[Tuple[Runnable, Dict]]:
+        genomic_data = state.get("genomic_data", [])
+        
+        if not genomic_data:
+            return None
+        
+        prompt = ChatPromptTemplate.from_template("""
+        Analyze the following genomic data:
+        
+        GENOMIC DATA:
+        {genomic_data}
+        
+        Extract:
+        - Genes and variants
+        - Mutations and their known significance
+        - Expression patterns
+        - Associated cancer types or conditions
+        
+        Return as structured JSON.
+        """)
         
-        return {"structured_data": {"lab_analysis": analysis}}
+        chain = prompt | self.json_llm | JsonOutputParser()
+        return chain, {"genomic_data": self.packer.pack(genomic_data, budget=self.config.ANALYSIS_CONTEXT_TOKENS)}
+    
+    def pathology_analysis_agent(self, state: Dict) -> Dict:
+        """Analyze pathology data"""
+        return self._analyze("pathology", self._pathology_analysis_chain(state))
+    
+    async def apathology_analysis_agent(self, state: Dict) -> Dict:
+        """Async pathology_analysis_agent"""
+        return await self._aanalyze("pathology", self._pathology_analysis_chain(state))
+    
+    def _pathology_analysis_chain(self, state: Dict) -> Optional[Tuple[Runnable, Dict]]:
+        pathology_data = state.get("pathology_data", [])
+        
+        if not pathology_data:
+            return None
+        
+        prompt = ChatPromptTemplate.from_template("""
+        Analyze the following pathology data:
+        
+        PATHOLOGY DATA:
+        {pathology_data}
+        
+        Extract:
+        - Tissue types
+        - Diagnoses and malignancy
+        - Grade and stage
+        - Correlations with clinical data
+        
+        Return as structured JSON.
+        """)
+        
+        chain = prompt | self.json_llm | JsonOutputParser()
+        return chain, {"pathology_data": self.packer.pack(pathology_data, budget=self.config.ANALYSIS_CONTEXT_TOKENS)}
+    
+    def cardiology_analysis_agent(self, state: Dict) -> Dict:
+        """Analyze cardiology data"""
+        return self._analyze("cardiology", self._cardiology_analysis_chain(state))
+    
+    async def acardiology_analysis_agent(self, state: Dict) -> Dict:
+        """Async cardiology_analysis_agent"""
+        return await self._aanalyze("cardiology", self._cardiology_analysis_chain(state))
+    
+    def _cardiology_analysis_chain(self, state: Dict) -> Optional[Tuple[Runnable, Dict]]:
+        cardiology_data = state.get("cardiology_data", [])
+        
+        if not cardiology_data:
+            return None
+        
+        prompt = ChatPromptTemplate.from_template("""
+        Analyze the following cardiology data:
+        
+        CARDIOLOGY DATA:
+        {cardiology_data}
+        
+        Extract:
+        - Cardiac studies and modalities
+        - Heart function measurements (e.g. ejection fraction)
+        - Abnormal findings
+        - Correlations with clinical data
+        
+        Return as structured JSON.
+        """)
+        
+        chain = prompt | self.json_llm | JsonOutputParser()
+        return chain, {"cardiology_data": self.packer.pack(cardiology_data, budget=self.config.ANALYSIS_CONTEXT_TOKENS)}
     
     def data_integrator_agent(self, state: Dict) -> Dict:
         """Integrate all data and generate final response"""
-        all_data = {
-            "query_analysis": state.get("query_analysis", {}),
-            "patient_data": state.get("patient_data", []),
-            "imaging_data": state.get("imaging_data", []),
-            "lab_results": state.get("lab_results", []),
-            "clinical_notes": state.get("clinical_notes", []),
-            "genomic_data": state.get("genomic_data", []),
-            "pathology_data": state.get("pathology_data", []),
-            "cardiology_data": state.get("cardiology_data", []),
-            "structured_data": state.get("structured_data", {}),
-            "search_results": state.get("search_results", [])
-        }
+        chain, inputs = self._data_integrator_chain(state)
+        return {"final_response": chain.invoke(inputs).content}
+    
+    async def adata_integrator_agent(self, state: Dict) -> Dict:
+        """Async data_integrator_agent"""
+        chain, inputs = self._data_integrator_chain(state)
+        response = await chain.ainvoke(inputs)
+        return {"final_response": response.content}
+    
+    def data_integrator_tokens(self, state: Dict) -> Iterator[str]:
+        """Final response of data_integrator_agent, streamed as the LLM generates it"""
+        chain, inputs = self._data_integrator_chain(state)
+        for chunk in chain.stream(inputs):
+            yield chunk.content
+    
+    async def adata_integrator_tokens(self, state: Dict) -> AsyncIterator[str]:
+        chain, inputs = self._data_integrator_chain(state)
+        async for chunk in chain.astream(inputs):
+            yield chunk.content
+    
+    def _data_integrator_chain(self, state: Dict) -> Tuple[Runnable, Dict]:
+        # The query analysis (at most a quarter) and the analyses are cut to their share of the budget,
+        # so long analyses cannot squeeze the retrieved records out of the prompt
+        share = int(self.config.INTEGRATOR_CONTEXT_TOKENS * self.config.INTEGRATOR_ANALYSES_SHARE)
+        query_analysis = self.packer.truncate(compact_json(state.get("query_analysis", {})), share // 4)
+        analyses = self.packer.truncate(compact_json(state.get("structured_data", {})),
+                                        self.packer.remaining(share, query_analysis))
+        
+        # Every bucket entry is also in search_results; documents fill what the analyses leave of the budget
+        budget = self.packer.remaining(self.config.INTEGRATOR_CONTEXT_TOKENS, query_analysis, analyses)
+        documents = self.packer.pack(state.get("search_results", []), budget=budget)
         
         prompt = ChatPromptTemplate.from_template("""
         You are a medical data analyst. Based on the integrated medical data from multiple sources, provide a comprehensive response to the original query.
         
         ORIGINAL QUERY: {query}
         
-        INTEGRATED DATA ANALYSIS:
-        {all_data}
+        QUERY ANALYSIS:
+        {query_analysis}
+        
+        ANALYSES BY DATA TYPE:
+        {analyses}
+        
+        RETRIEVED RECORDS (most relevant first):
+        {documents}
         
         Provide a comprehensive response including:
         1. Summary of relevant findings across all data types
@@ -210,9 +427,22 @@ class MedicalAgents:
         """)
         
         chain = prompt | self.llm
-        response = chain.invoke({
+        return chain, {
             "query": state["query"],
-            "all_data": json.dumps(all_data, indent=2)
-        })
-        
-        return {"final_response": response.content}
+            "query_analysis": query_analysis,
+            "analyses": analyses,
+            "documents": documents
+        }
+    
+    def _analyze(self, name: str, request: Optional[Tuple[Runnable, Dict]]) -> Dict:
+        """Run an analysis chain, or report that there was no data for it"""
+        if request is None:
+            return {"structured_data": {f"{name}_analysis": f"No {name} data found"}}
+        chain, inputs = request
+        return {"structured_data": {f"{name}_analysis": chain.invoke(inputs)}}
+    
+    async def _aanalyze(self, name: str, request: Optional[Tuple[Runnable, Dict]]) -> Dict:
+        if request is None:
+            return {"structured_data": {f"{name}_analysis": f"No {name} data found"}}
+        chain, inputs = request
+        return {"structured_data": {f"{name}_analysis": await chain.ainvoke(inputs)}}
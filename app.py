@@ -1,50 +1,150 @@
 # app.py
+from langchain_openai import AzureOpenAIEmbeddings, AzureChatOpenAI
 from config import MedicalConfig
+from embedding_cache import EmbeddingCache, CachedEmbeddings
+from embedding_driver import BatchedEmbeddings
+from response_cache import ResponseCache
+from llm_memo import LLMMemo, MemoizedLLM
+from metrics import MeteredEmbeddings, MeteredLLM
+from context_packer import ContextPacker
 from data_loader import ComprehensiveMedicalDataLoader
 from vector_store import VectorStoreManager
+from sharded_store import ShardedVectorStoreManager
 from agents import MedicalAgents
 from workflow import MedicalWorkflow
 
-def initialize_system():
-    """Initialize the complete medical data exploration system"""
-    config = MedicalConfig()
+def load_or_build_vector_store(vector_manager, data_loader, config):
+    """Load the single vector store if it is current, otherwise update or rebuild it"""
+    # Fingerprint dataset files so an up-to-date index can be loaded without parsing anything
+    manifest = data_loader.build_manifest()
+    vector_store = None
     
-    # Initialize Azure components
-    embeddings = AzureOpenAIEmbeddings(
-        azure_deployment=config.EMBEDDING_MODEL,
-        openai_api_version=config.AZURE_OPENAI_API_VERSION,
-        azure_endpoint=config.AZURE_OPENAI_ENDPOINT,
-        api_key=config.AZURE_OPENAI_API_KEY
-    )
+    if vector_manager.is_index_current(manifest):
+        try:
+            vector_manager.prepare_read_only()
+            vector_store = vector_manager.load_vector_store()
+            print("✓ Loaded existing vector store")
+        except Exception as e:
+            print(f"✗ Failed to load vector store: {e}")
+    elif vector_manager.index_exists() and config.INDEX_UPDATE_MODE == "incremental":
+        print("⚠ Vector store is stale, updating changed files...")
+        try:
+            vector_store = vector_manager.update_vector_store(data_loader, manifest)
+        except Exception as e:
+            print(f"✗ Incremental update failed: {e}")
+    elif vector_manager.index_exists():
+        print("⚠ Vector store is stale, rebuilding...")
     
-    llm = AzureChatOpenAI(
-        azure_deployment=config.LLM_MODEL,
-        openai_api_version=config.AZURE_OPENAI_API_VERSION,
-        azure_endpoint=config.AZURE_OPENAI_ENDPOINT,
-        api_key=config.AZURE_OPENAI_API_KEY,
-        temperature=0.1
-    )
+    if vector_store is None:
+        print("Creating new vector store from medical datasets...")
+        vector_store = vector_manager.build_vector_store(data_loader.iter_document_batches(), manifest)
     
-    # Load data
-    print("Loading medical datasets...")
+    # Read-only loads (e.g. server workers) open what this writes
+    vector_manager.prepare_read_only()
+    return vector_store
+
+def load_index(embeddings, config):
+    """Vector store, its BM25 index and index version, each store loaded if current and otherwise updated or rebuilt"""
     data_loader = ComprehensiveMedicalDataLoader(config)
-    all_documents = data_loader.load_all_datasets()
     
-    # Create vector store
-    print("Creating vector store...")
+    if config.VECTOR_STORE_SHARDED:
+        # Each dataset shard is checked, updated or rebuilt on its own, BM25 index included
+        vector_store = ShardedVectorStoreManager(embeddings, config).prepare(data_loader)
+        return vector_store, None, vector_store.index_version()
+    
     vector_manager = VectorStoreManager(embeddings, config)
+    vector_store = load_or_build_vector_store(vector_manager, data_loader, config)
+    return vector_store, vector_manager.lexical_index, vector_manager.index_version()
+
+def open_index(embeddings, config):
+    """Vector store, its BM25 index and index version, opened read-only as load_index() left them.
+    
+    Nothing is built, updated or written; IndexNotReady is raised if the index
+    (or its snapshot) is missing or out of date.
+    """
+    if config.VECTOR_STORE_SHARDED:
+        vector_store = ShardedVectorStoreManager(embeddings, config).open()
+        return vector_store, None, vector_store.index_version()
+    
+    vector_manager = VectorStoreManager(embeddings, config)
+    vector_store = vector_manager.load_vector_store(read_only=True)
+    return vector_store, vector_manager.lexical_index, vector_manager.index_version()
+
+def response_cache_version(config, index_version: str) -> str:
+    # Cached answers are only valid for the index and model that produced them
+    return f"{config.LLM_MODEL}:{index_version}"
+
+def initialize_system(config=None, embeddings=None, llm=None, read_only=False):
+    """Initialize the complete medical data exploration system.
+    
+    embeddings and llm default to the Azure OpenAI deployments; other
+    backends (e.g. the benchmark fakes) get the same batching, metering and
+    caching layers. With read_only the index is opened with open_index()
+    instead of being loaded, updated or built.
+    """
+    config = config or MedicalConfig()
+    
+    # Initialize Azure components
+    if embeddings is None:
+        embeddings = AzureOpenAIEmbeddings(
+            azure_deployment=config.EMBEDDING_MODEL,
+            openai_api_version=config.AZURE_OPENAI_API_VERSION,
+            azure_endpoint=config.AZURE_OPENAI_ENDPOINT,
+            api_key=config.AZURE_OPENAI_API_KEY,
+            max_retries=0  # BatchedEmbeddings retries and rate-limits per batch
+        )
+    embeddings = BatchedEmbeddings(
+        embeddings,
+        batch_size=config.EMBEDDING_BATCH_SIZE,
+        max_concurrency=config.EMBEDDING_MAX_CONCURRENCY,
+        requests_per_second=config.EMBEDDING_REQUESTS_PER_SECOND,
+        max_retries=config.EMBEDDING_MAX_RETRIES
+    )
+    # Inside the cache, so only requests that reach the model are counted
+    embeddings = MeteredEmbeddings(embeddings)
+    
+    if config.USE_EMBEDDING_CACHE:
+        embeddings = CachedEmbeddings(
+            embeddings,
+            EmbeddingCache(config.EMBEDDING_CACHE_PATH, config.EMBEDDING_MODEL, config.EMBEDDING_CACHE_MAX_ENTRIES)
+        )
+    
+    if llm is None:
+        llm = AzureChatOpenAI(
+            azure_deployment=config.LLM_MODEL,
+            openai_api_version=config.AZURE_OPENAI_API_VERSION,
+            azure_endpoint=config.AZURE_OPENAI_ENDPOINT,
+            api_key=config.AZURE_OPENAI_API_KEY,
+            temperature=0.1
+        )
+    # Inside the memo, so only calls that reach the model are timed and their tokens counted
+    packer = ContextPacker(config.LLM_MODEL, config.CONTEXT_MAX_DOCUMENT_TOKENS)
+    llm = MeteredLLM(llm, packer.count_tokens)
+    
+    if config.USE_LLM_MEMO:
+        # Repeated agent sub-calls (same prompt and inputs) are answered from disk
+        llm = MemoizedLLM(
+            llm,
+            LLMMemo(config.LLM_MEMO_PATH, config.LLM_MEMO_MAX_ENTRIES, config.LLM_MEMO_TTL_SECONDS),
+            model=config.LLM_MODEL
+        )
+    
+    vector_store, lexical_index, index_version = (open_index if read_only else load_index)(embeddings, config)
     
-    # Check if vector store exists, otherwise create it
-    try:
-        vector_store = vector_manager.load_vector_store()
-        print("✓ Loaded existing vector store")
-    except:
-        print("Creating new vector store...")
-        vector_store = vector_manager.create_vector_store(all_documents)
+    response_cache = None
+    if config.USE_RESPONSE_CACHE:
+        response_cache = ResponseCache(
+            config.RESPONSE_CACHE_PATH,
+            embeddings,
+            version=response_cache_version(config, index_version),
+            similarity_threshold=config.RESPONSE_CACHE_SIMILARITY,
+            ttl_seconds=config.RESPONSE_CACHE_TTL_SECONDS,
+            max_entries=config.RESPONSE_CACHE_MAX_ENTRIES
+        )
     
     # Initialize agents and workflow
-    agents = MedicalAgents(llm, vector_store)
-    workflow = MedicalWorkflow(agents)
+    agents = MedicalAgents(llm, vector_store, config, lexical_index, packer)
+    workflow = MedicalWorkflow(agents, response_cache, config)
     
     return workflow, config
 
@@ -79,12 +179,29 @@ def main():
         
         print("\nProcessing query...")
         try:
-            result = workflow.run(query)
+            # Print each stage as it finishes and the response as it is generated
+            result_started = False
+            for event in workflow.stream(query):
+                if event["type"] == "node":
+                    if event["node"] != "data_integrator":
+                        print(f"✓ {event['node']}")
+                    continue
+                if not result_started:
+                    print("\n" + "="*80)
+                    print("RESULT:")
+                    print("="*80)
+                    result_started = True
+                if event["type"] == "token":
+                    print(event["content"], end="", flush=True)
+                elif event["type"] == "done":
+                    trace = event["trace"]
             print("\n" + "="*80)
-            print("RESULT:")
-            print("="*80)
-            print(result)
-            print("="*80)
+            print(f"Time: {trace['seconds']:.2f}s (" +
+                  ", ".join(f"{node} {seconds:.2f}s" for node, seconds in trace["nodes"].items()) + ")")
+            if workflow.response_cache is not None:
+                stats = workflow.response_cache.stats()
+                print(f"Response cache: {stats['exact_hits']} exact / {stats['semantic_hits']} semantic hits, "
+                      f"{stats['misses']} misses ({stats['hit_rate']:.1%} hit rate)")
         except Exception as e:
             print(f"Error processing query: {e}")
 
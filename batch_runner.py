@@ -0,0 +1,120 @@
+# batch_runner.py
+"""Batch query mode: answer a JSONL or CSV file of queries concurrently.
+
+    python batch_runner.py cohort.jsonl -o results.jsonl
+    python batch_runner.py cohort.csv -o results.jsonl --concurrency 16
+
+Each input row needs a "query" and may carry an "id" (default: its row
+number); ids must be unique. JSONL lines may also be bare strings. Every result is appended to
+the output as one JSON line as soon as its query finishes, so rerunning the
+same command after a crash skips the queries that already succeeded and
+retries the failed ones.
+"""
+import argparse
+import asyncio
+import csv
+import json
+import time
+from pathlib import Path
+from typing import Dict, List, Set
+
+from app import initialize_system
+
+def read_queries(path: str) -> List[Dict]:
+    """{"id", "query"} items from a JSONL or CSV file, skipping blank queries.
+
+    Raises ValueError on a repeated id, since results are resumed by id.
+    """
+    path = Path(path)
+    if path.suffix.lower() == ".csv":
+        with open(path, newline="") as f:
+            rows = list(csv.DictReader(f))
+    else:
+        with open(path) as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+
+    items = []
+    seen = set()
+    for number, row in enumerate(rows, 1):
+        if isinstance(row, str):
+            row = {"query": row}
+        query = (row.get("query") or "").strip()
+        if not query:
+            continue
+        # 0 and "" are ids too
+        item_id = str(row["id"] if row.get("id") is not None else number)
+        if item_id in seen:
+            raise ValueError(f"Duplicate id {item_id!r} on row {number} of {path}")
+        seen.add(item_id)
+        items.append({"id": item_id, "query": query})
+    return items
+
+def completed_ids(output_path: str) -> Set[str]:
+    """Ids already answered successfully in an earlier run's output"""
+    done = set()
+    if not Path(output_path).exists():
+        return done
+    with open(output_path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # Line cut short by a crash
+            if record.get("status") == "ok":
+                done.add(str(record["id"]))
+    return done
+
+async def run_batch(workflow, items: List[Dict], output_path: str, chunk_size: int, max_concurrency: int) -> Dict:
+    """Answer items not yet in output_path, appending one result line per query; returns run totals"""
+    done = completed_ids(output_path)
+    pending = [item for item in items if item["id"] not in done]
+    totals = {"queries": len(items), "skipped": len(items) - len(pending), "ok": 0, "errors": 0, "cached": 0}
+    start = time.perf_counter()
+
+    with open(output_path, "a") as out:
+        for offset in range(0, len(pending), chunk_size):
+            chunk = pending[offset:offset + chunk_size]
+            async for index, response, trace in workflow.abatch([item["query"] for item in chunk], max_concurrency):
+                record = {"id": chunk[index]["id"], "query": chunk[index]["query"]}
+                if isinstance(response, Exception):
+                    record.update(status="error", error=f"{type(response).__name__}: {response}")
+                    totals["errors"] += 1
+                else:
+                    record.update(status="ok", response=response)
+                    totals["ok"] += 1
+                    totals["cached"] += trace.cached
+                record.update(seconds=round(trace.seconds, 3), cached=trace.cached, trace=trace.to_dict())
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+            print(f"✓ {min(offset + chunk_size, len(pending))}/{len(pending)} queries "
+                  f"({totals['errors']} errors, {time.perf_counter() - start:.1f}s)")
+
+    totals["seconds"] = time.perf_counter() - start
+    return totals
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("input", help="JSONL or CSV file of queries")
+    parser.add_argument("-o", "--output", required=True, help="JSONL results file; appended to and resumed from")
+    parser.add_argument("--concurrency", type=int, help="Default: BATCH_MAX_CONCURRENCY")
+    parser.add_argument("--chunk-size", type=int, help="Default: BATCH_CHUNK_SIZE")
+    args = parser.parse_args()
+
+    try:
+        items = read_queries(args.input)
+    except ValueError as e:
+        raise SystemExit(f"✗ {e}")
+    workflow, config = initialize_system()
+    totals = asyncio.run(run_batch(
+        workflow, items, args.output,
+        chunk_size=args.chunk_size or config.BATCH_CHUNK_SIZE,
+        max_concurrency=args.concurrency or config.BATCH_MAX_CONCURRENCY
+    ))
+
+    print(f"{totals['ok']} answered ({totals['cached']} from cache), {totals['errors']} failed, "
+          f"{totals['skipped']} already done, in {totals['seconds']:.1f}s")
+    if totals["errors"]:
+        print("⚠ Rerun the same command to retry the failed queries")
+
+if __name__ == "__main__":
+    main()
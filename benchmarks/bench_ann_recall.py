@@ -0,0 +1,82 @@
+"""Recall-vs-latency report for the FAISS index types against the exact flat index.
+
+Run from the repository root:
+    python -m benchmarks.bench_ann_recall --vectors 200000 --dim 256
+"""
+import argparse
+import time
+
+import faiss
+import numpy as np
+
+from config import MedicalConfig
+from vector_store import create_faiss_index, tune_faiss_index
+
+# Search-time settings swept per index type
+SWEEPS = {
+    "ivf_flat": ("FAISS_NPROBE", [1, 4, 16, 64]),
+    "ivf_pq": ("FAISS_NPROBE", [1, 4, 16, 64]),
+    "hnsw": ("FAISS_EF_SEARCH", [16, 64, 256]),
+}
+
+def make_vectors(n: int, dim: int, clusters: int = 200, seed: int = 0) -> np.ndarray:
+    """Clustered unit vectors, closer to real embeddings than uniform noise"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, n)] + 0.3 * rng.standard_normal((n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def time_queries(index: faiss.Index, queries: np.ndarray, k: int):
+    """Search one query at a time, as the retrieval agent does; returns (labels, ms per query)"""
+    labels = np.empty((len(queries), k), dtype=np.int64)
+    start = time.perf_counter()
+    for i, query in enumerate(queries):
+        _, labels[i] = index.search(query[None, :], k)
+    return labels, (time.perf_counter() - start) * 1000 / len(queries)
+
+def recall_at_k(labels: np.ndarray, truth: np.ndarray) -> float:
+    return float(np.mean([len(set(a) & set(b)) / len(b) for a, b in zip(labels, truth)]))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--vectors", type=int, default=200_000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--nlist", type=int, default=1024)
+    parser.add_argument("--pq-m", type=int, default=32)
+    args = parser.parse_args()
+
+    vectors = make_vectors(args.vectors, args.dim)
+    queries = make_vectors(args.queries, args.dim, seed=1)
+
+    class BenchConfig(MedicalConfig):
+        FAISS_NLIST = args.nlist
+        FAISS_PQ_M = args.pq_m
+
+    flat = faiss.IndexFlatL2(args.dim)
+    flat.add(vectors)
+    truth, flat_ms = time_queries(flat, queries, args.k)
+
+    print(f"{args.vectors} vectors, dim {args.dim}, recall@{args.k} vs flat")
+    print(f"{'index':<10} {'setting':<20} {'recall':>7} {'ms/query':>9} {'build s':>8} {'index MB':>9}")
+    print(f"{'flat':<10} {'-':<20} {1.0:>7.3f} {flat_ms:>9.3f} {'-':>8} "
+          f"{faiss.serialize_index(flat).nbytes / 1e6:>9.1f}")
+
+    for index_type, (param, values) in SWEEPS.items():
+        BenchConfig.FAISS_INDEX_TYPE = index_type
+        start = time.perf_counter()
+        index = create_faiss_index(vectors[:BenchConfig.FAISS_TRAIN_SAMPLE_SIZE], BenchConfig)
+        index.add(vectors)
+        build_time = time.perf_counter() - start
+        size_mb = faiss.serialize_index(index).nbytes / 1e6
+
+        for value in values:
+            setattr(BenchConfig, param, value)
+            tune_faiss_index(index, BenchConfig)
+            labels, ms = time_queries(index, queries, args.k)
+            print(f"{index_type:<10} {f'{param}={value}':<20} {recall_at_k(labels, truth):>7.3f} "
+                  f"{ms:>9.3f} {build_time:>8.1f} {size_mb:>9.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""Compare plain and batched/concurrent embedding against the local fake server.
+
+Run from the repository root:
+    python -m benchmarks.bench_embedding_driver --docs 5000 --latency 0.05 --throttle-rate 0.05
+"""
+import argparse
+import time
+
+from langchain_openai import AzureOpenAIEmbeddings
+
+from benchmarks.fake_embedding_server import FakeEmbeddingServer
+from config import MedicalConfig
+from embedding_driver import BatchedEmbeddings
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--docs", type=int, default=5000)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--throttle-rate", type=float, default=0.05)
+    args = parser.parse_args()
+
+    config = MedicalConfig()
+    texts = [f"Clinical Data from mimic_iv\npatient_id: {i}\ntroponin: {i % 97 / 100}" for i in range(args.docs)]
+
+    with FakeEmbeddingServer(dim=256, latency=args.latency, throttle_rate=args.throttle_rate) as server:
+        def azure_embeddings(max_retries):
+            return AzureOpenAIEmbeddings(
+                azure_deployment=config.EMBEDDING_MODEL,
+                openai_api_version=config.AZURE_OPENAI_API_VERSION,
+                azure_endpoint=server.endpoint,
+                api_key="fake",
+                max_retries=max_retries
+            )
+
+        start = time.perf_counter()
+        baseline = azure_embeddings(max_retries=10).embed_documents(texts)
+        baseline_time = time.perf_counter() - start
+
+        driver = BatchedEmbeddings(
+            azure_embeddings(max_retries=0),
+            batch_size=config.EMBEDDING_BATCH_SIZE,
+            max_concurrency=config.EMBEDDING_MAX_CONCURRENCY,
+            requests_per_second=config.EMBEDDING_REQUESTS_PER_SECOND,
+            max_retries=config.EMBEDDING_MAX_RETRIES
+        )
+        start = time.perf_counter()
+        batched = driver.embed_documents(texts)
+        batched_time = time.perf_counter() - start
+
+    assert batched == baseline, "batched embeddings differ from sequential ones"
+    print(f"sequential: {args.docs / baseline_time:,.0f} docs/sec ({baseline_time:.2f}s)")
+    print(f"batched:    {args.docs / batched_time:,.0f} docs/sec ({batched_time:.2f}s)")
+    print(f"driver stats: {driver.stats()}")
+    print(f"server: {server.requests} requests, {server.throttled} throttled")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""End-to-end benchmark of ingestion, index build and queries with fake Azure backends.
+
+Runs the real loader, vector store and workflow over synthetic datasets
+shaped like DATASET_CONFIGS. The LLM and embeddings are in-process fakes
+with configurable latency, so results do not depend on Azure quota or
+network noise.
+
+Run from the repository root:
+    python -m benchmarks.bench_pipeline --rows 5000 --queries 50
+    python -m benchmarks.bench_pipeline --save-baseline   # record benchmarks/baseline.json
+    python -m benchmarks.bench_pipeline --compare         # flag regressions against it
+
+The baseline records its workload (options, store layout and index type,
+documents indexed); --compare refuses to run against a baseline recorded
+with a different one.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import resource
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+from app import initialize_system
+from benchmarks.fake_backends import FakeChatModel, FakeEmbeddings
+from benchmarks.synthetic_data import generate_datasets
+from config import MedicalConfig
+from data_loader import ComprehensiveMedicalDataLoader
+
+QUERIES = [
+    "Find patients with chest pain and abnormal cardiac findings",
+    "Show me cases of pneumonia with imaging confirmation",
+    "Patients with elevated troponin levels and cardiac history",
+    "Find brain tumor cases with MRI imaging",
+    "Cases of diabetic retinopathy with retinal images",
+    "Patients with genetic mutations and cancer history",
+    "TP53 missense mutations in BRCA samples",
+    "Lymph node biopsy slides with metastasis",
+    "Sepsis patients with high lactate and low blood pressure",
+    "Heart failure with reduced ejection fraction on echo"
+]
+
+# Metric -> (label, True if higher is better)
+METRICS = {
+    "ingest_rows_per_sec": ("ingestion rows/sec", True),
+    "build_seconds": ("index build s", False),
+    "peak_rss_mb": ("peak RSS MB", False),
+    "query_p50_ms": ("query p50 ms", False),
+    "query_p99_ms": ("query p99 ms", False),
+    "concurrent_qps": ("concurrent queries/sec", True),
+    "prompt_tokens_per_query": ("prompt tokens/query", False),
+    "integrator_prompt_tokens": ("integrator prompt tokens", False)
+}
+
+DEFAULT_BASELINE = Path(__file__).parent / "baseline.json"
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def bench_config(workdir: Path, args) -> MedicalConfig:
+    class BenchConfig(MedicalConfig):
+        DATA_BASE_PATH = workdir / "data"
+        VECTOR_STORE_PATH = str(workdir / "store")
+        VECTOR_STORE_SHARDED = args.sharded
+        EMBEDDING_REQUESTS_PER_SECOND = args.embedding_rps
+        # Every query must run the full pipeline
+        USE_RESPONSE_CACHE = False
+        USE_LLM_MEMO = False
+        USE_EMBEDDING_CACHE = False
+        RESPONSE_CACHE_PATH = str(workdir / "response_cache.sqlite")
+        LLM_MEMO_PATH = str(workdir / "llm_memo.sqlite")
+        EMBEDDING_CACHE_PATH = str(workdir / "embedding_cache.sqlite")
+        METRICS_LOG_PATH = None
+
+    return BenchConfig()
+
+def run_queries(workflow, queries: List[str]) -> List:
+    return [workflow.run_traced(query)[1] for query in queries]
+
+async def run_concurrent(workflow, queries: List[str], concurrency: int) -> float:
+    """Queries per second with up to concurrency queries in flight"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(query: str):
+        async with semaphore:
+            await workflow.arun(query)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run(query) for query in queries))
+    return len(queries) / (time.perf_counter() - start)
+
+def benchmark(args) -> Dict[str, float]:
+    workdir = Path(args.workdir) if args.workdir else Path(tempfile.mkdtemp(prefix="medical-bench-"))
+    config = bench_config(workdir, args)
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    try:
+        rows = sum(generate_datasets(config, args.rows).values())
+
+        with quiet:
+            # Parsing and rendering only
+            start = time.perf_counter()
+            documents = sum(len(batch) for batch in ComprehensiveMedicalDataLoader(config).iter_document_batches())
+            ingest_seconds = time.perf_counter() - start
+
+            # Full system start-up on an empty store: parse, embed, index
+            embeddings = FakeEmbeddings(dim=args.dim, latency=args.embedding_latency)
+            llm = FakeChatModel(latency=args.llm_latency, tokens_per_second=args.tokens_per_second,
+                                response_words=args.response_words)
+            start = time.perf_counter()
+            workflow, _ = initialize_system(config, embeddings=embeddings, llm=llm)
+            build_seconds = time.perf_counter() - start
+
+            queries = [QUERIES[i % len(QUERIES)] for i in range(args.queries)]
+            traces = run_queries(workflow, queries)
+            qps = asyncio.run(run_concurrent(workflow, queries, args.concurrency)) if args.concurrency > 1 else 0.0
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    latencies = np.array([trace.seconds * 1000 for trace in traces])
+    prompt_tokens = [sum(stats["prompt_tokens"] for stats in trace.llm.values()) for trace in traces]
+    integrator_tokens = [trace.llm.get("data_integrator", {}).get("prompt_tokens", 0) for trace in traces]
+    print(f"{rows:,} synthetic rows in {len(config.DATASET_CONFIGS)} datasets, {documents:,} documents, "
+          f"{len(traces)} queries")
+
+    return {
+        "documents": documents,
+        "ingest_rows_per_sec": documents / ingest_seconds,
+        "build_seconds": build_seconds,
+        "peak_rss_mb": peak_rss_mb(),
+        "query_p50_ms": float(np.percentile(latencies, 50)),
+        "query_p99_ms": float(np.percentile(latencies, 99)),
+        "concurrent_qps": qps,
+        "prompt_tokens_per_query": float(np.mean(prompt_tokens)),
+        "integrator_prompt_tokens": float(np.mean(integrator_tokens))
+    }
+
+def workload(args) -> Dict:
+    """What the results depend on besides the code: the workload options and the index settings they run on"""
+    options = {name: value for name, value in vars(args).items()
+               if name not in ("workdir", "baseline", "save_baseline", "compare", "tolerance", "verbose")}
+    return {
+        **options,
+        "datasets": len(MedicalConfig.DATASET_CONFIGS),
+        "vector_store_type": MedicalConfig.VECTOR_STORE_TYPE,
+        "faiss_index_type": MedicalConfig.FAISS_INDEX_TYPE,
+        "vector_store_mmap": MedicalConfig.VECTOR_STORE_MMAP
+    }
+
+def check_workload(recorded: Dict, current: Dict, path: str):
+    """Exit unless every setting in current was recorded with the same value"""
+    changed = [f"{name} {recorded.get(name)!r} -> {value!r}" for name, value in current.items()
+               if recorded.get(name) != value]
+    if changed:
+        raise SystemExit(f"✗ Baseline {path} was recorded with a different workload ({', '.join(changed)}); "
+                         f"rerun with its settings or record a new one with --save-baseline")
+
+def report(results: Dict[str, float], baseline: Dict[str, float] = None, tolerance: float = 0.1) -> int:
+    """Print results (and change against baseline); returns the number of regressions beyond tolerance"""
+    regressions = 0
+    print(f"{'metric':<26} {'value':>12}" + (f" {'baseline':>12} {'change':>8}" if baseline else ""))
+    for name, (label, higher_is_better) in METRICS.items():
+        value = results[name]
+        line = f"{label:<26} {value:>12,.1f}"
+        if baseline and baseline.get(name):
+            change = (value - baseline[name]) / baseline[name]
+            worse = -change if higher_is_better else change
+            flag = ""
+            if worse > tolerance:
+                regressions += 1
+                flag = " ✗ regression"
+            line += f" {baseline[name]:>12,.1f} {change:>+8.1%}{flag}"
+        print(line)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=5000, help="Rows per synthetic dataset")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=8, help="Queries in flight for the async run; 1 skips it")
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--embedding-latency", type=float, default=0.05, help="Seconds per embedding request")
+    parser.add_argument("--embedding-rps", type=float, default=200.0, help="Embedding requests per second ceiling")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Seconds to the first LLM token")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--response-words", type=int, default=200, help="Length of the integrator response")
+    parser.add_argument("--sharded", action=argparse.BooleanOptionalAction, default=MedicalConfig.VECTOR_STORE_SHARDED,
+                        help="Per-dataset shards instead of one vector store (default: VECTOR_STORE_SHARDED)")
+    parser.add_argument("--workdir", help="Keep the synthetic data and index here instead of a temp dir")
+    parser.add_argument("--baseline", default=str(DEFAULT_BASELINE))
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--compare", action="store_true", help="Compare against the saved baseline")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Relative change counted as a regression")
+    parser.add_argument("--verbose", action="store_true", help="Show the pipeline's own output")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        # Before the run, so a mismatch costs nothing
+        check_workload(baseline["args"], workload(args), args.baseline)
+
+    results = benchmark(args)
+    run_workload = {**workload(args), "documents": results.pop("documents")}
+    if baseline is not None:
+        check_workload(baseline["args"], run_workload, args.baseline)
+    regressions = report(results, baseline and baseline["results"], args.tolerance)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({"args": run_workload, "results": results}, f, indent=2)
+        print(f"✓ Baseline saved to {args.baseline}")
+    if regressions:
+        raise SystemExit(f"✗ {regressions} metric(s) regressed by more than {args.tolerance:.0%}")
+
+if __name__ == "__main__":
+    main()
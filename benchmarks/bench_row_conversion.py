@@ -0,0 +1,93 @@
+"""Benchmark vectorized row rendering against the row-at-a-time iterrows loop.
+
+Run from the repository root:
+    python -m benchmarks.bench_row_conversion --rows 200000
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from config import MedicalConfig
+from data_loader import ComprehensiveMedicalDataLoader
+
+def make_frame(rows: int, seed: int = 0) -> pd.DataFrame:
+    """Synthetic wide EHR-like table with mixed dtypes and missing values"""
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "hadm_id": rng.integers(10_000_000, 30_000_000, rows),
+        "patient_id": rng.integers(1, 50_000, rows),
+        "age": rng.integers(18, 95, rows).astype(float),
+        "gender": rng.choice(["M", "F"], rows),
+        "diagnosis": rng.choice(["pneumonia", "sepsis", "CHF", "AKI", None], rows),
+        "heart_rate": rng.normal(85, 15, rows).round(1),
+        "troponin": rng.exponential(0.05, rows),
+        "icd_code": rng.choice(["I21.4", "J18.9", "A41.9", "N17.9"], rows),
+        "gene": rng.choice(["TP53", "KRAS", "EGFR", None], rows),
+        "slide_id": rng.choice(["S-001", "S-002", None], rows),
+        "admitted": rng.choice([True, False], rows),
+    })
+    # Sprinkle missing values into numeric columns
+    for col in ["age", "heart_rate", "troponin"]:
+        df.loc[rng.random(rows) < 0.1, col] = np.nan
+    return df
+
+def iterrows_contents(loader, df: pd.DataFrame, kind: str, dataset_name: str, config: dict):
+    """Reference implementation: the original per-row loops"""
+    if kind == "imaging":
+        return [loader._create_imaging_content(row, dataset_name, config) for _, row in df.iterrows()]
+    if kind == "clinical":
+        return [loader._create_clinical_content(row, dataset_name) for _, row in df.iterrows()]
+    if kind == "genomic":
+        return [loader._create_genomic_content(row, dataset_name) for _, row in df.iterrows()]
+    if kind == "pathology":
+        return [loader._create_pathology_content(row, dataset_name) for _, row in df.iterrows()]
+    return [f"Data from {dataset_name}:\n" + "\n".join([f"{col}: {val}" for col, val in row.items() if pd.notna(val)])
+            for _, row in df.iterrows()]
+
+def vectorized_contents(loader, df: pd.DataFrame, kind: str, dataset_name: str, config: dict):
+    if kind == "imaging":
+        header = f"Dataset: {dataset_name}\nModality: {config['modality']}\nBody Part: {config['body_part']}"
+        return loader._render_contents(df, header)
+    if kind == "clinical":
+        return loader._render_contents(df, f"Clinical Data from {dataset_name}", loader.CLINICAL_PRIORITY_FIELDS)
+    if kind == "genomic":
+        return loader._render_contents(df, f"Genomic Data from {dataset_name}", loader.GENOMIC_PRIORITY_FIELDS)
+    if kind == "pathology":
+        return loader._render_contents(df, f"Pathology Data from {dataset_name}", loader.PATHOLOGY_PRIORITY_FIELDS)
+    return [f"Data from {dataset_name}:\n" + cells[1:] for cells in loader._render_cells(df)]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    args = parser.parse_args()
+
+    config = MedicalConfig()
+    loader = ComprehensiveMedicalDataLoader(config)
+    dataset_config = config.DATASET_CONFIGS["mimic_iv"]
+    frames = {
+        "mixed": make_frame(args.rows),
+        "numeric": make_frame(args.rows)[["hadm_id", "age", "heart_rate", "troponin"]],
+    }
+
+    print(f"{'frame':<8} {'kind':<10} {'iterrows s':>11} {'vectorized s':>13} {'speedup':>8}")
+    for frame_name, df in frames.items():
+        for kind in ["imaging", "clinical", "genomic", "pathology", "generic"]:
+            start = time.perf_counter()
+            expected = iterrows_contents(loader, df, kind, "mimic_iv", dataset_config)
+            reference_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            actual = vectorized_contents(loader, df, kind, "mimic_iv", dataset_config)
+            vectorized_time = time.perf_counter() - start
+
+            if actual != expected:
+                mismatch = next(i for i, (a, e) in enumerate(zip(actual, expected)) if a != e)
+                raise AssertionError(f"{frame_name}/{kind} row {mismatch} differs:\n{actual[mismatch]!r}\n{expected[mismatch]!r}")
+
+            print(f"{frame_name:<8} {kind:<10} {reference_time:>11.2f} {vectorized_time:>13.2f} "
+                  f"{reference_time / vectorized_time:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""In-process stand-ins for AzureChatOpenAI and AzureOpenAIEmbeddings.
+
+Both sleep for a configurable latency instead of calling Azure, so the
+real pipeline can be timed without quota or network noise:
+
+    llm = FakeChatModel(latency=0.5, tokens_per_second=50)
+    embeddings = FakeEmbeddings(dim=256, latency=0.05)
+    workflow, config = initialize_system(config, embeddings=embeddings, llm=llm)
+"""
+import asyncio
+import hashlib
+import json
+import re
+import time
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+import numpy as np
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from bm25 import tokenize
+
+def hashed_vector(text: str, dim: int) -> List[float]:
+    """Deterministic unit bag-of-words vector, so texts sharing terms are similar"""
+    vector = np.zeros(dim, dtype=np.float32)
+    for term in tokenize(text):
+        digest = hashlib.blake2b(term.encode(), digest_size=8).digest()
+        bucket = int.from_bytes(digest[:4], "little") % dim
+        vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    if not norm:
+        vector[0], norm = 1.0, 1.0
+    return (vector / norm).tolist()
+
+class FakeEmbeddings(Embeddings):
+    """Embeddings backend that sleeps latency seconds per request"""
+
+    def __init__(self, dim: int = 256, latency: float = 0.05):
+        self.dim = dim
+        self.latency = latency
+        self.requests = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.requests += 1
+        time.sleep(self.latency)
+        return [hashed_vector(text, self.dim) for text in texts]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        return [hashed_vector(text, self.dim) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+# Query words that select each data type in the fake query analysis
+DATA_TYPE_KEYWORDS = {
+    "imaging": ["imaging", "xray", "x-ray", "mri", "ct", "scan", "image", "images", "radiology", "pneumonia"],
+    "clinical": ["patients", "patient", "history", "troponin", "lab", "labs", "symptoms", "cases"],
+    "genomic": ["genetic", "gene", "mutation", "mutations", "genomic", "variant"],
+    "pathology": ["pathology", "biopsy", "tissue", "slide", "tumor"],
+    "cardiology": ["cardiac", "heart", "echo", "ejection", "chest"],
+    "ophthalmology": ["retina", "retinal", "retinopathy", "fundus", "eye"]
+}
+
+STOP_WORDS = {"find", "show", "me", "with", "and", "of", "the", "cases", "patients", "in", "for", "a"}
+
+class FakeChatModel(BaseChatModel):
+    """Chat model that answers each agent prompt with a plausible canned response.
+
+    Sleeps latency seconds before the first token, then one token per
+    1 / tokens_per_second. Token usage is reported like the Azure client.
+    """
+
+    latency: float = 0.5
+    tokens_per_second: float = 50.0
+    response_words: int = 200
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-azure-chat"
+
+    def _respond(self, messages: List[BaseMessage]) -> str:
+        prompt = "\n".join(str(message.content) for message in messages)
+        if "medical query analyzer" in prompt:
+            match = re.search(r"QUERY:\s*(.+)", prompt)
+            words = tokenize(match.group(1)) if match else []
+            data_types = [data_type for data_type, keywords in DATA_TYPE_KEYWORDS.items()
+                          if any(word in keywords for word in words)]
+            terms = [word for word in words if word not in STOP_WORDS]
+            return json.dumps({
+                "symptoms": [], "lab_tests": [word for word in terms if word in ("troponin", "glucose")],
+                "imaging_studies": [], "conditions": terms[:2], "demographics": [], "exclusions": [],
+                "data_types_needed": data_types or ["clinical"],
+                "search_terms": [" ".join(terms[i:i + 2]) for i in range(0, len(terms), 2)]
+            })
+        if "Return as structured JSON" in prompt:
+            records = prompt.count('"ref":')
+            return json.dumps({"records_reviewed": records, "findings": [f"finding {i}" for i in range(5)]})
+        return " ".join(f"word{i % 50}" for i in range(self.response_words))
+
+    def _usage(self, messages: List[BaseMessage], content: str) -> dict:
+        prompt_tokens = sum(len(str(message.content)) for message in messages) // 4
+        completion_tokens = len(content) // 4
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens}
+
+    def _generation_seconds(self, content: str) -> float:
+        return self.latency + len(content.split()) / self.tokens_per_second
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        content = self._respond(messages)
+        time.sleep(self._generation_seconds(content))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))],
+                          llm_output={"token_usage": self._usage(messages, content)})
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        content = self._respond(messages)
+        await asyncio.sleep(self._generation_seconds(content))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))],
+                          llm_output={"token_usage": self._usage(messages, content)})
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.latency)
+        for word in self._respond(messages).split(" "):
+            time.sleep(1 / self.tokens_per_second)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+                       **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.latency)
+        for word in self._respond(messages).split(" "):
+            await asyncio.sleep(1 / self.tokens_per_second)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
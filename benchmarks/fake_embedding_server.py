@@ -0,0 +1,98 @@
+"""Local HTTP stand-in for the Azure OpenAI embeddings endpoint.
+
+Returns deterministic vectors after a configurable latency and answers a
+configurable fraction of requests with 429 + Retry-After, so the embedding
+driver can be exercised without Azure quota:
+
+    with FakeEmbeddingServer(latency=0.05, throttle_rate=0.1) as server:
+        embeddings = AzureOpenAIEmbeddings(azure_endpoint=server.endpoint, ...)
+"""
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+
+import numpy as np
+
+def fake_vector(item, dim: int) -> List[float]:
+    """Deterministic unit vector for a text or token list"""
+    seed = int.from_bytes(hashlib.sha256(json.dumps(item).encode()).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dim)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+class FakeEmbeddingServer:
+    def __init__(self, dim: int = 1536, latency: float = 0.05, throttle_rate: float = 0.0,
+                 retry_after: float = 0.2, host: str = "127.0.0.1", port: int = 0):
+        self.dim = dim
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.requests = 0
+        self.throttled = 0
+        self._random = random.Random(0)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._thread = None
+
+    @property
+    def endpoint(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                with server._lock:
+                    server.requests += 1
+                    throttle = server._random.random() < server.throttle_rate
+                    if throttle:
+                        server.throttled += 1
+
+                if throttle:
+                    payload = json.dumps({"error": {"code": "429", "message": "Rate limit exceeded"}}).encode()
+                    self.send_response(429)
+                    self.send_header("Retry-After", str(server.retry_after))
+                else:
+                    time.sleep(server.latency)
+                    inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+                    payload = json.dumps({
+                        "object": "list",
+                        "model": body.get("model", "fake"),
+                        "data": [
+                            {"object": "embedding", "index": i, "embedding": fake_vector(item, server.dim)}
+                            for i, item in enumerate(inputs)
+                        ],
+                        "usage": {"prompt_tokens": 0, "total_tokens": 0}
+                    }).encode()
+                    self.send_response(200)
+
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,112 @@
+"""Synthetic datasets laid out like DATASET_CONFIGS, for benchmarks.
+
+Each configured dataset gets files of the shape its loader expects:
+- clinical: a wide EHR-style CSV
+- genomic: a TCGA-style TSV
+- pathology: a slide-level CSV
+- imaging, cardiology and ophthalmology: a metadata CSV plus a large JSON
+  annotation file
+"""
+import json
+from pathlib import Path
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+DIAGNOSES = ["pneumonia", "sepsis", "congestive heart failure", "acute kidney injury", "myocardial infarction",
+             "diabetes mellitus", "COPD exacerbation", "stroke", None]
+SYMPTOMS = ["chest pain", "shortness of breath", "fever", "cough", "syncope", "palpitations", "headache", None]
+GENES = ["TP53", "KRAS", "EGFR", "BRCA1", "BRCA2", "PIK3CA", "PTEN", "APC"]
+CANCER_TYPES = ["BRCA", "LUAD", "COAD", "GBM", "PRAD", "SKCM"]
+FINDINGS = ["normal", "consolidation", "effusion", "cardiomegaly", "nodule", "edema", "tumor", "lesion"]
+
+# Extra EHR columns, so clinical rows are as wide as real MIMIC/eICU extracts
+LAB_COLUMNS = ["troponin", "creatinine", "glucose", "hemoglobin", "wbc", "platelets", "sodium", "potassium",
+               "lactate", "bnp", "hba1c", "cholesterol", "alt", "ast", "bilirubin", "albumin", "inr", "crp"]
+VITAL_COLUMNS = ["heart_rate", "systolic_bp", "diastolic_bp", "resp_rate", "temperature", "spo2"]
+
+def clinical_frame(rows: int, rng: np.random.Generator) -> pd.DataFrame:
+    df = pd.DataFrame({
+        "patient_id": rng.integers(1, 50_000, rows),
+        "hadm_id": rng.integers(10_000_000, 30_000_000, rows),
+        "age": rng.integers(18, 95, rows).astype(float),
+        "gender": rng.choice(["M", "F"], rows),
+        "diagnosis": rng.choice(DIAGNOSES, rows),
+        "symptoms": rng.choice(SYMPTOMS, rows),
+        "medications": rng.choice(["aspirin", "heparin", "metformin", "furosemide", "vancomycin", None], rows),
+        "outcome": rng.choice(["discharged", "transferred", "expired"], rows),
+        "icd_code": rng.choice(["I21.4", "J18.9", "A41.9", "N17.9", "E11.9", "I50.9"], rows)
+    })
+    for column in LAB_COLUMNS + VITAL_COLUMNS:
+        values = rng.lognormal(0, 0.5, rows).round(2)
+        df[column] = np.where(rng.random(rows) < 0.15, np.nan, values)
+    return df
+
+def genomic_frame(rows: int, rng: np.random.Generator) -> pd.DataFrame:
+    return pd.DataFrame({
+        "sample_id": [f"TCGA-{i % 99:02d}-{i:04d}-01A" for i in range(rows)],
+        "gene": rng.choice(GENES, rows),
+        "mutation": rng.choice(["missense", "nonsense", "frameshift", "splice_site", "silent"], rows),
+        "variant": [f"p.R{position % 900}H" for position in rng.integers(1, 100_000, rows)],
+        "chromosome": rng.choice([f"chr{i}" for i in range(1, 23)] + ["chrX"], rows),
+        "position": rng.integers(1_000_000, 200_000_000, rows),
+        "expression": rng.lognormal(2, 1, rows).round(3),
+        "vaf": rng.random(rows).round(3),
+        "cancer_type": rng.choice(CANCER_TYPES, rows)
+    })
+
+def pathology_frame(rows: int, rng: np.random.Generator) -> pd.DataFrame:
+    return pd.DataFrame({
+        "slide_id": [f"S-{i:06d}" for i in range(rows)],
+        "patient_id": rng.integers(1, 50_000, rows),
+        "tissue_type": rng.choice(["lymph node", "breast", "colon", "lung", "prostate"], rows),
+        "diagnosis": rng.choice(["metastasis", "benign", "adenocarcinoma", "carcinoma in situ"], rows),
+        "malignancy": rng.choice(["malignant", "benign"], rows),
+        "grade": rng.integers(1, 4, rows),
+        "stage": rng.choice(["I", "II", "III", "IV"], rows)
+    })
+
+def imaging_frame(rows: int, rng: np.random.Generator) -> pd.DataFrame:
+    return pd.DataFrame({
+        "image_id": [f"IMG{i:08d}.png" for i in range(rows)],
+        "patient_id": rng.integers(1, 50_000, rows),
+        "finding": rng.choice(FINDINGS, rows),
+        "view": rng.choice(["PA", "AP", "lateral", "axial"], rows),
+        "patient_age": rng.integers(18, 95, rows),
+        "patient_sex": rng.choice(["M", "F"], rows),
+        "follow_up": rng.integers(0, 10, rows)
+    })
+
+def annotations(rows: int, rng: np.random.Generator) -> Dict:
+    """COCO-style annotation file, loaded as a single large document"""
+    return {
+        "images": [{"id": i, "file_name": f"IMG{i:08d}.png", "width": 1024, "height": 1024} for i in range(rows)],
+        "annotations": [
+            {"id": i, "image_id": i, "label": str(rng.choice(FINDINGS)),
+             "bbox": [int(value) for value in rng.integers(0, 900, 4)]}
+            for i in range(rows)
+        ]
+    }
+
+def generate_datasets(config, rows: int, seed: int = 0) -> Dict[str, int]:
+    """Write synthetic files for every DATASET_CONFIGS entry under DATA_BASE_PATH; returns rows per dataset"""
+    rng = np.random.default_rng(seed)
+    counts = {}
+    for name, dataset_config in config.DATASET_CONFIGS.items():
+        path = Path(config.DATA_BASE_PATH) / dataset_config["path"]
+        path.mkdir(parents=True, exist_ok=True)
+        data_type = dataset_config["data_type"]
+
+        if data_type == "clinical":
+            clinical_frame(rows, rng).to_csv(path / "admissions.csv", index=False)
+        elif data_type == "genomic":
+            genomic_frame(rows, rng).to_csv(path / "mutations.tsv", sep="\t", index=False)
+        elif data_type == "pathology":
+            pathology_frame(rows, rng).to_csv(path / "slides.csv", index=False)
+        else:
+            imaging_frame(rows, rng).to_csv(path / "metadata.csv", index=False)
+            with open(path / "annotations.json", "w") as f:
+                json.dump(annotations(max(1, rows // 10), rng), f)
+        counts[name] = rows
+    return counts
@@ -0,0 +1,129 @@
+import json
+import re
+import sqlite3
+import threading
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from langchain.schema import Document
+
+from data_loader import json_default
+
+# Words, numbers and codes; keeps "0.45", "I21.4" and "MIMIC-IV" as single terms
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[._-][a-z0-9]+)*")
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+def is_identifier_query(query: str) -> bool:
+    """True if every term contains a digit (ICD codes, lab values, patient ids).
+
+    Dense embeddings add little for such queries, so they can be answered
+    from the inverted index alone, without an embedding call.
+    """
+    terms = tokenize(query)
+    return bool(terms) and all(any(ch.isdigit() for ch in term) for term in terms)
+
+def term_coverage(query: str, text: str) -> float:
+    """Fraction of the query's distinct terms that occur in text"""
+    terms = set(tokenize(query))
+    if not terms:
+        return 0.0
+    return len(terms & set(tokenize(text))) / len(terms)
+
+class BM25Index:
+    """Inverted index over document contents, ranked with BM25.
+
+    Backed by an SQLite FTS5 table next to the vector store. Documents are
+    keyed by the same ids as in the vector store, so incremental updates
+    apply the same adds and deletes to both.
+    """
+
+    # SQLite caps the number of bound parameters per statement
+    DELETE_BATCH_SIZE = 500
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS documents (
+                rowid INTEGER PRIMARY KEY,
+                doc_id TEXT NOT NULL UNIQUE,
+                dataset TEXT,
+                content TEXT NOT NULL,
+                metadata TEXT NOT NULL
+            )
+        """)
+        # Terms are tokenized in Python; tokenchars keeps them whole inside FTS5
+        self._conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(terms, tokenize=\"unicode61 tokenchars '._-'\")"
+        )
+        self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def add(self, documents: List[Document], ids: List[str]):
+        """Index documents, replacing any already indexed under the same ids"""
+        with self._lock:
+            self._delete(ids)
+            for doc, doc_id in zip(documents, ids):
+                metadata = json.dumps(doc.metadata, default=json_default)
+                cursor = self._conn.execute(
+                    "INSERT INTO documents (doc_id, dataset, content, metadata) VALUES (?, ?, ?, ?)",
+                    (doc_id, doc.metadata.get("dataset"), doc.page_content, metadata)
+                )
+                self._conn.execute("INSERT INTO documents_fts (rowid, terms) VALUES (?, ?)",
+                                   (cursor.lastrowid, " ".join(tokenize(doc.page_content))))
+            self._conn.commit()
+
+    def delete(self, ids: List[str]):
+        with self._lock:
+            self._delete(ids)
+            self._conn.commit()
+
+    def _delete(self, ids: List[str]):
+        for start in range(0, len(ids), self.DELETE_BATCH_SIZE):
+            batch = ids[start:start + self.DELETE_BATCH_SIZE]
+            placeholders = ",".join("?" * len(batch))
+            rowids = [row[0] for row in self._conn.execute(
+                f"SELECT rowid FROM documents WHERE doc_id IN ({placeholders})", batch
+            )]
+            if rowids:
+                self._conn.executemany("DELETE FROM documents_fts WHERE rowid = ?", [(rowid,) for rowid in rowids])
+                self._conn.executemany("DELETE FROM documents WHERE rowid = ?", [(rowid,) for rowid in rowids])
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM documents_fts")
+            self._conn.execute("DELETE FROM documents")
+            self._conn.commit()
+
+    def search(self, query: str, k: int = 4, datasets: Optional[List[str]] = None) -> List[Tuple[Document, float]]:
+        """Top-k documents matching any query term, with BM25 scores (higher is better)"""
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+
+        sql = ("SELECT d.content, d.metadata, -bm25(documents_fts) FROM documents_fts "
+               "JOIN documents d ON d.rowid = documents_fts.rowid WHERE documents_fts MATCH ?")
+        params = [" OR ".join(f'"{term}"' for term in terms)]
+        if datasets is not None:
+            sql += f" AND d.dataset IN ({','.join('?' * len(datasets))})"
+            params.extend(datasets)
+        sql += " ORDER BY bm25(documents_fts) LIMIT ?"
+        params.append(k)
+
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [(Document(page_content=content, metadata=json.loads(metadata)), score)
+                for content, metadata, score in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
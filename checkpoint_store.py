@@ -0,0 +1,62 @@
+import asyncio
+import sqlite3
+import threading
+from typing import Optional
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import Checkpoint, CheckpointTuple
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+class PruningSqliteSaver(SqliteSaver):
+    """SqliteSaver that bounds how many checkpoints it keeps.
+
+    After each write only the newest keep_per_thread checkpoints of that
+    thread are kept, and only the max_threads most recently written
+    threads are kept at all. Access is serialized, so one saver can be
+    shared by concurrent requests; the async methods run the same calls
+    on the default executor.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, keep_per_thread: int = 1, max_threads: int = 100):
+        super().__init__(conn)
+        self.keep_per_thread = keep_per_thread
+        self.max_threads = max_threads
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_path(cls, path: str, keep_per_thread: int = 1, max_threads: int = 100) -> "PruningSqliteSaver":
+        return cls(sqlite3.connect(path, check_same_thread=False), keep_per_thread, max_threads)
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        with self._lock:
+            return super().get_tuple(config)
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint) -> RunnableConfig:
+        with self._lock:
+            saved = super().put(config, checkpoint)
+            self.prune(str(config["configurable"]["thread_id"]))
+        return saved
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.get_running_loop().run_in_executor(None, self.get_tuple, config)
+
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint) -> RunnableConfig:
+        return await asyncio.get_running_loop().run_in_executor(None, self.put, config, checkpoint)
+
+    def prune(self, thread_id: str):
+        """Drop old checkpoints of thread_id and checkpoints of threads beyond max_threads"""
+        with self._lock, self.cursor() as cur:
+            cur.execute(
+                "DELETE FROM checkpoints WHERE thread_id = ? AND thread_ts NOT IN "
+                "(SELECT thread_ts FROM checkpoints WHERE thread_id = ? ORDER BY thread_ts DESC LIMIT ?)",
+                (thread_id, thread_id, self.keep_per_thread)
+            )
+            cur.execute(
+                "DELETE FROM checkpoints WHERE thread_id NOT IN "
+                "(SELECT thread_id FROM checkpoints GROUP BY thread_id ORDER BY MAX(thread_ts) DESC LIMIT ?)",
+                (self.max_threads,)
+            )
+
+    def delete_thread(self, thread_id: str):
+        with self._lock, self.cursor() as cur:
+            cur.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
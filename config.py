@@ -16,6 +16,109 @@ class MedicalConfig:
     # Vector Store
     VECTOR_STORE_TYPE = "faiss"
     VECTOR_STORE_PATH = "medical_vector_store"
+    MANIFEST_FILE = "manifest.json"  # Fingerprint of the files the index was built from
+    INDEX_UPDATE_MODE = "incremental"  # "incremental" re-indexes changed files, "rebuild" re-embeds everything
+    
+    # FAISS index: "flat" (exact), "ivf_flat", "ivf_pq" or "hnsw" (approximate).
+    # Approximate indexes can only absorb appended rows; deletions trigger a rebuild.
+    FAISS_INDEX_TYPE = "flat"
+    FAISS_TRAIN_SAMPLE_SIZE = 50000  # Vectors buffered to train IVF centroids / PQ codebooks
+    FAISS_NLIST = 4096  # IVF lists (capped at sample size / 39)
+    FAISS_NPROBE = 16  # IVF lists scanned per query; higher = better recall, slower
+    FAISS_PQ_M = 64  # PQ sub-quantizers; must divide the embedding dimension
+    FAISS_PQ_NBITS = 8
+    FAISS_HNSW_M = 32  # HNSW graph degree
+    FAISS_EF_CONSTRUCTION = 200
+    FAISS_EF_SEARCH = 64  # HNSW candidate list size per query; higher = better recall, slower
+    
+    # One index per DATASET_CONFIGS key under VECTOR_STORE_PATH/SHARD_DIR, each with its own
+    # manifest; shards load on first search and are searched in parallel. Switching an existing
+    # single index to shards re-embeds every dataset
+    VECTOR_STORE_SHARDED = False
+    SHARD_DIR = "shards"
+    SHARD_SEARCH_WORKERS = 8  # Threads fanning a query out across shards
+    
+    # Serve FAISS from a memory-mapped snapshot (vectors/IVF lists + offset-indexed docstore)
+    # instead of unpickling index.pkl, so worker processes on one host share pages
+    VECTOR_STORE_MMAP = False
+    MMAP_SNAPSHOT_DIR = "mmap"
+    
+    # Retrieval
+    RETRIEVAL_K_PER_TYPE = 5  # Documents retrieved per requested data type
+    RETRIEVAL_MAX_K = 20  # Documents kept across all data types, best scores first
+    RETRIEVAL_MIN_SCORE = 0.3  # Relevance in [0, 1] (cosine similarity or query term coverage) a hit needs
+    RETRIEVAL_MODE = "hybrid"  # "vector", or "hybrid" to fuse vector and BM25 hits
+    RRF_CANDIDATES = 50  # Hits taken from each ranking before fusion
+    RRF_K = 60  # Reciprocal rank fusion damping constant
+    RETRIEVAL_MULTI_QUERY = True  # Search each analyzer search term separately and fuse the results
+    MULTI_QUERY_MAX_TERMS = 8  # Search terms used per query, in analyzer order
+    MULTI_QUERY_WORKERS = 8  # Threads running per-term searches
+    
+    # BM25 inverted index over the same documents, stored in the vector store directory
+    USE_BM25_INDEX = True
+    BM25_INDEX_FILE = "bm25.sqlite"
+    
+    # Cache of final responses in front of MedicalWorkflow.run: exact normalized-query match,
+    # then, if RESPONSE_CACHE_SIMILARITY is set, nearest cached query by embedding.
+    # Invalidated when the index or LLM changes.
+    USE_RESPONSE_CACHE = True
+    RESPONSE_CACHE_PATH = "response_cache.sqlite"
+    # Cosine similarity a cached query needs for a semantic hit, e.g. 0.95. Off by default:
+    # near-identical clinical queries ("over 60" vs "over 65") can need different answers
+    RESPONSE_CACHE_SIMILARITY = None
+    RESPONSE_CACHE_TTL_SECONDS = 24 * 3600
+    RESPONSE_CACHE_MAX_ENTRIES = 1000  # Least recently used responses are evicted beyond this
+    
+    # Memo of individual agent LLM calls, keyed by model and rendered prompt (template + inputs)
+    USE_LLM_MEMO = True
+    LLM_MEMO_PATH = "llm_memo.sqlite"
+    LLM_MEMO_MAX_ENTRIES = 100_000  # Least recently used outputs are evicted beyond this
+    LLM_MEMO_TTL_SECONDS = 7 * 24 * 3600
+    
+    # Prompt context packing: documents deduplicated by id, compactly serialized, best first
+    ANALYSIS_CONTEXT_TOKENS = 3000  # Document tokens in each analysis prompt
+    INTEGRATOR_CONTEXT_TOKENS = 5000  # Query analysis, analyses and documents in the integrator prompt
+    INTEGRATOR_ANALYSES_SHARE = 0.5  # Most of that budget the query analysis and analyses may take; documents get the rest
+    CONTEXT_MAX_DOCUMENT_TOKENS = 800  # Longer documents are truncated to this
+    
+    # Per-query traces (node times, LLM tokens, embedding calls, searches) are appended here as JSON lines
+    METRICS_LOG_PATH = None
+    
+    # Workflow checkpoints; every query runs on its own thread unless given a session thread_id
+    CHECKPOINT_DB_PATH = ":memory:"
+    CHECKPOINT_KEEP_PER_THREAD = 1  # Newest checkpoints kept per thread
+    CHECKPOINT_MAX_THREADS = 100  # Most recently used threads kept; older ones are pruned
+    
+    # Batch query runs (batch_runner.py)
+    BATCH_MAX_CONCURRENCY = 8  # LLM calls or graph runs in flight at once
+    BATCH_CHUNK_SIZE = 64  # Queries whose analyses and search-term embeddings are batched together
+    
+    # HTTP query service (server.py)
+    SERVER_HOST = "127.0.0.1"
+    SERVER_PORT = 8080
+    SERVER_WORKERS = 1  # Processes serving queries; they share the pages of the index snapshots
+    SERVER_MAX_ACTIVE_QUERIES = 8  # Queries each worker runs at once
+    SERVER_MAX_QUEUED_QUERIES = 32  # Queries waiting per worker; beyond this requests get a 503
+    SERVER_QUEUE_TIMEOUT_SECONDS = 30  # Longest wait for a query slot before a 503
+    SERVER_RELOAD_POLL_SECONDS = 30  # How often workers check for a new index version; 0 only reloads on SIGHUP
+    SERVER_SHUTDOWN_TIMEOUT_SECONDS = 60  # In-flight queries get this long to finish on shutdown
+    
+    # Embedding cache, keyed by EMBEDDING_MODEL and content hash
+    USE_EMBEDDING_CACHE = True
+    EMBEDDING_CACHE_PATH = "embedding_cache.sqlite"
+    EMBEDDING_CACHE_MAX_ENTRIES = 5_000_000  # Least recently used vectors are evicted beyond this
+    
+    # Embedding requests
+    EMBEDDING_BATCH_SIZE = 256  # Texts per embedding request
+    EMBEDDING_MAX_CONCURRENCY = 8  # Embedding requests in flight at once
+    EMBEDDING_REQUESTS_PER_SECOND = 20.0  # Token-bucket ceiling; halves on every 429
+    EMBEDDING_MAX_RETRIES = 6  # Retries per failed batch before the build fails
+    
+    # Ingestion
+    CSV_CHUNK_SIZE = 50000  # Rows read per pandas chunk; bounds parsing memory per file
+    INGEST_BATCH_SIZE = 1000  # Documents embedded and added to the index per batch
+    PARALLEL_INGEST = False  # Parse dataset files in a process pool
+    INGEST_WORKERS = None  # Pool size for parallel ingestion; None uses all CPUs
     
     # Data paths
     DATA_BASE_PATH = Path("Awesome-Medical-Dataset")
@@ -0,0 +1,80 @@
+import json
+from pathlib import Path
+from typing import Any, Dict, List
+
+import tiktoken
+
+from data_loader import json_default
+from vector_store import document_id
+
+def compact_json(value: Any) -> str:
+    """JSON without indentation or padding; numpy scalars in metadata become plain numbers"""
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False, default=json_default)
+
+class ContextPacker:
+    """Fits retrieved documents into a prompt under a token budget.
+
+    Documents are deduplicated by id (a hit can sit in search_results and
+    in one or two buckets), taken best-scoring first while they fit, and
+    serialized as one compact JSON object per line. Only the score, a
+    dataset/file#row reference and the content are kept; the content already
+    names the dataset, modality and body part.
+    """
+
+    # Characters per token when the tokenizer cannot be loaded
+    CHARS_PER_TOKEN = 4
+
+    def __init__(self, model: str, max_document_tokens: int = 800):
+        self.max_document_tokens = max_document_tokens
+        try:
+            self._encoding = tiktoken.encoding_for_model(model)
+        except Exception as e:
+            # Unknown model, or the encoding file cannot be downloaded
+            print(f"⚠ No tokenizer for {model} ({type(e).__name__}); estimating {self.CHARS_PER_TOKEN} characters per token")
+            self._encoding = None
+
+    def count_tokens(self, text: str) -> int:
+        if self._encoding is None:
+            return -(-len(text) // self.CHARS_PER_TOKEN)
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        if self._encoding is None:
+            limit = max_tokens * self.CHARS_PER_TOKEN
+            return text if len(text) <= limit else text[:limit] + "…"
+        tokens = self._encoding.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else self._encoding.decode(tokens[:max_tokens]) + "…"
+
+    def pack(self, *entry_lists: List[Dict], budget: int) -> str:
+        """Distinct entries of all lists, best first, serialized within budget tokens"""
+        entries = {}
+        for entry in (entry for entry_list in entry_lists for entry in entry_list):
+            entries.setdefault(document_id(entry.get("metadata", {})), entry)
+        ranked = sorted(entries.values(), key=lambda entry: entry.get("relevance_score", 0.0), reverse=True)
+
+        lines = []
+        used = 2  # Enclosing brackets
+        for entry in ranked:
+            line = compact_json(self._record(entry))
+            tokens = self.count_tokens(line) + 1
+            # Skip documents that do not fit; a shorter one further down may still
+            if used + tokens > budget:
+                continue
+            lines.append(line)
+            used += tokens
+        return "[\n" + ",\n".join(lines) + "\n]"
+
+    def _record(self, entry: Dict) -> Dict:
+        metadata = entry.get("metadata", {})
+        ref = f"{metadata.get('dataset', 'unknown')}/{Path(str(metadata.get('source_file', ''))).name}"
+        if metadata.get("row_index") is not None:
+            ref += f"#{metadata['row_index']}"
+        return {
+            "ref": ref,
+            "score": entry.get("relevance_score"),
+            "content": self.truncate(entry.get("content", ""), self.max_document_tokens)
+        }
+
+    def remaining(self, budget: int, *texts: str) -> int:
+        """Tokens of budget left after texts"""
+        return max(0, budget - sum(self.count_tokens(text) for text in texts))
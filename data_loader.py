@@ -1,14 +1,44 @@
 # data_loader.py
 import pandas as pd
 import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+from operator import itemgetter
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple
 import pydicom
 import numpy as np
 from tqdm import tqdm
 import re
+from langchain.schema import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from manifest import DatasetManifest
+
+# Elementwise str() over an array, yielding an object array of Python strings
+_to_str = np.frompyfunc(str, 1, 1)
 
 class ComprehensiveMedicalDataLoader:
+    # File patterns parsed by each data type's loader
+    FILE_PATTERNS = {
+        "imaging": ["*.csv", "*.json"],
+        "clinical": ["*.csv"],
+        "genomic": ["*.csv", "*.tsv"],
+        "pathology": ["*.csv"],
+        "cardiology": ["*.csv", "*.json"],
+        "ophthalmology": ["*.csv", "*.json"]
+    }
+    DEFAULT_FILE_PATTERNS = ["*.csv"]
+    
+    # Fields rendered first, in this order, for each data type
+    CLINICAL_PRIORITY_FIELDS = ['patient_id', 'age', 'gender', 'diagnosis', 'symptoms', 
+                                'lab_results', 'medications', 'treatment', 'outcome']
+    GENOMIC_PRIORITY_FIELDS = ['gene', 'mutation', 'expression', 'variant', 'chromosome', 
+                               'position', 'sample_id', 'cancer_type']
+    PATHOLOGY_PRIORITY_FIELDS = ['slide_id', 'tissue_type', 'diagnosis', 'malignancy', 
+                                 'grade', 'stage', 'patient_id']
+    
     def __init__(self, config):
         self.config = config
         self.datasets = {}
@@ -24,176 +54,274 @@ class ComprehensiveMedicalDataLoader:
         
         all_documents = {}
         
-        for dataset_name, config in self.config.DATASET_CONFIGS.items():
-            dataset_path = self.config.DATA_BASE_PATH / config["path"]
-            
-            if dataset_path.exists():
-                try:
-                    documents = self._load_dataset(dataset_name, dataset_path, config)
-                    all_documents[dataset_name] = documents
-                    print(f"✓ Loaded {dataset_name}: {len(documents)} documents")
-                except Exception as e:
-                    print(f"✗ Failed to load {dataset_name}: {e}")
-            else:
-                print(f"⚠ Dataset path not found: {dataset_path}")
+        for dataset_name, group in groupby(self._iter_all_file_batches(), key=itemgetter(0)):
+            documents = [doc for _, batch in group for doc in batch]
+            all_documents[dataset_name] = documents
+            print(f"✓ Loaded {dataset_name}: {len(documents)} documents")
         
         return all_documents
     
-    def _load_dataset(self, dataset_name: str, dataset_path: Path, config: Dict) -> List[Document]:
-        """Load specific dataset based on type"""
-        data_type = config["data_type"]
-        
-        if data_type == "imaging":
-            return self._load_imaging_data(dataset_name, dataset_path, config)
-        elif data_type == "clinical":
-            return self._load_clinical_data(dataset_name, dataset_path, config)
-        elif data_type == "genomic":
-            return self._load_genomic_data(dataset_name, dataset_path, config)
-        elif data_type == "pathology":
-            return self._load_pathology_data(dataset_name, dataset_path, config)
-        elif data_type == "cardiology":
-            return self._load_cardiology_data(dataset_name, dataset_path, config)
-        elif data_type == "ophthalmology":
-            return self._load_ophthalmology_data(dataset_name, dataset_path, config)
+    def iter_document_batches(self, batch_size: int = None,
+                              dataset_names: Optional[List[str]] = None) -> Iterator[List[Document]]:
+        """Stream all available datasets (or only dataset_names) as document batches of at most batch_size.
+        
+        Files are read in CSV_CHUNK_SIZE row chunks, so only one chunk and one
+        batch are held in memory at a time (plus in-flight files in parallel mode).
+        """
+        if dataset_names is None:
+            print("Streaming ALL medical datasets from Awesome-Medical-Dataset...")
         else:
-            return self._load_generic_dataset(dataset_name, dataset_path, config)
+            print(f"Streaming datasets: {', '.join(dataset_names)}")
+        
+        for dataset_name, group in groupby(self._iter_all_file_batches(dataset_names), key=itemgetter(0)):
+            count = 0
+            for documents in rebatch((batch for _, batch in group),
+                                     batch_size or self.config.INGEST_BATCH_SIZE):
+                count += len(documents)
+                yield documents
+            print(f"✓ Loaded {dataset_name}: {count} documents")
     
-    def _load_imaging_data(self, dataset_name: str, dataset_path: Path, config: Dict) -> List[Document]:
-        """Load imaging datasets"""
-        documents = []
-        
-        # Try to find CSV files with metadata
-        csv_files = list(dataset_path.rglob("*.csv"))
-        json_files = list(dataset_path.rglob("*.json"))
-        text_files = list(dataset_path.rglob("*.txt"))
+    def _dataset_configs(self, dataset_names: Optional[List[str]] = None) -> List[Tuple[str, Dict]]:
+        """DATASET_CONFIGS items, restricted to dataset_names if given"""
+        return [(name, config) for name, config in self.config.DATASET_CONFIGS.items()
+                if dataset_names is None or name in dataset_names]
+    
+    def _file_tasks(self, dataset_names: Optional[List[str]] = None) -> List[Tuple[str, Optional[Path], Dict]]:
+        """List (dataset, file, config) for every file to parse, in deterministic load order.
         
-        # Process CSV files
-        for csv_file in csv_files:
-            try:
-                df = pd.read_csv(csv_file)
-                for idx, row in df.iterrows():
-                    content = self._create_imaging_content(row, dataset_name, config)
-                    metadata = {
-                        "dataset": dataset_name,
-                        "data_type": "imaging",
-                        "modality": config["modality"],
-                        "body_part": config["body_part"],
-                        "source_file": str(csv_file),
-                        "row_index": idx
-                    }
-                    doc = Document(page_content=content, metadata=metadata)
-                    documents.append(doc)
-            except Exception as e:
-                print(f"Error processing {csv_file}: {e}")
+        Datasets without any files get a single task with file None so they
+        still show up in the results.
+        """
+        tasks = []
         
-        # Process JSON files
-        for json_file in json_files:
+        for dataset_name, config in self._dataset_configs(dataset_names):
+            dataset_path = self.config.DATA_BASE_PATH / config["path"]
+            
+            if not dataset_path.exists():
+                print(f"⚠ Dataset path not found: {dataset_path}")
+                continue
+            
             try:
-                with open(json_file, 'r') as f:
-                    data = json.load(f)
-                content = f"Imaging Data from {dataset_name}: {json.dumps(data, indent=2)}"
-                metadata = {
-                    "dataset": dataset_name,
-                    "data_type": "imaging",
-                    "modality": config["modality"],
-                    "body_part": config["body_part"],
-                    "source_file": str(json_file)
-                }
-                doc = Document(page_content=content, metadata=metadata)
-                documents.append(doc)
+                file_paths = self._dataset_files(dataset_path, config)
             except Exception as e:
-                print(f"Error processing {json_file}: {e}")
+                print(f"✗ Failed to load {dataset_name}: {e}")
+                continue
+            
+            tasks.extend((dataset_name, file_path, config) for file_path in file_paths)
+            if not file_paths:
+                tasks.append((dataset_name, None, config))
         
-        return documents
+        return tasks
     
-    def _load_clinical_data(self, dataset_name: str, dataset_path: Path, config: Dict) -> List[Document]:
-        """Load clinical/EHR datasets"""
-        documents = []
-        
-        # Look for clinical data files
-        csv_files = list(dataset_path.rglob("*.csv"))
-        json_files = list(dataset_path.rglob("*.json"))
+    def _iter_all_file_batches(self, dataset_names: Optional[List[str]] = None) -> Iterator[Tuple[str, List[Document]]]:
+        """Stream (dataset_name, documents) for all datasets, in dataset and file order"""
+        tasks = self._file_tasks(dataset_names)
+        
+        if self.config.PARALLEL_INGEST:
+            yield from self._iter_parallel_file_batches(tasks)
+            return
+        
+        for dataset_name, file_path, config in tasks:
+            if file_path is None:
+                yield dataset_name, []
+                continue
+            for documents in self.iter_file_batches(dataset_name, [file_path], config):
+                yield dataset_name, documents
+    
+    def _iter_parallel_file_batches(self, tasks) -> Iterator[Tuple[str, List[Document]]]:
+        """Parse files in a process pool, yielding results in task order.
+        
+        At most two files per worker are in flight, so finished files are
+        handed downstream instead of piling up in memory.
+        """
+        workers = self.config.INGEST_WORKERS or os.cpu_count() or 1
+        print(f"Parsing {len(tasks)} files with {workers} worker processes...")
+        
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(self.config,)) as executor:
+            pending = deque()
+            
+            def next_result():
+                dataset_name, file_path, future = pending.popleft()
+                try:
+                    return dataset_name, future.result()
+                except Exception as e:
+                    print(f"Error processing {file_path}: {e}")
+                    return dataset_name, []
+            
+            for dataset_name, file_path, config in tasks:
+                if file_path is None:
+                    future = executor.submit(list)
+                else:
+                    future = executor.submit(_load_file_in_worker, dataset_name, str(file_path), config)
+                pending.append((dataset_name, file_path, future))
+                if len(pending) >= 2 * workers:
+                    yield next_result()
+            
+            while pending:
+                yield next_result()
+    
+    def build_manifest(self, dataset_names: Optional[List[str]] = None) -> DatasetManifest:
+        """Fingerprint the dataset files on disk (of all datasets, or only dataset_names) without parsing them"""
+        manifest = DatasetManifest(
+            vector_store_type=self.config.VECTOR_STORE_TYPE,
+            embedding_model=self.config.EMBEDDING_MODEL,
+            index_type=self.config.FAISS_INDEX_TYPE
+        )
         
-        for csv_file in csv_files:
-            try:
-                df = pd.read_csv(csv_file)
-                for idx, row in df.iterrows():
-                    content = self._create_clinical_content(row, dataset_name)
-                    metadata = {
-                        "dataset": dataset_name,
-                        "data_type": "clinical",
-                        "modality": config["modality"],
-                        "body_part": config["body_part"],
-                        "source_file": str(csv_file),
-                        "row_index": idx
-                    }
-                    doc = Document(page_content=content, metadata=metadata)
-                    documents.append(doc)
-            except Exception as e:
-                print(f"Error processing {csv_file}: {e}")
+        for dataset_name, config in self._dataset_configs(dataset_names):
+            dataset_path = self.config.DATA_BASE_PATH / config["path"]
+            if not dataset_path.exists():
+                continue
+            for file_path in self._dataset_files(dataset_path, config):
+                manifest.add_file(dataset_name, file_path)
         
-        return documents
+        return manifest
+    
+    def _dataset_files(self, dataset_path: Path, config: Dict) -> List[Path]:
+        """List the files a dataset's loader would parse, in load order"""
+        patterns = self.FILE_PATTERNS.get(config["data_type"], self.DEFAULT_FILE_PATTERNS)
+        files = []
+        for pattern in patterns:
+            files.extend(dataset_path.rglob(pattern))
+        return files
     
-    def _load_genomic_data(self, dataset_name: str, dataset_path: Path, config: Dict) -> List[Document]:
-        """Load genomic datasets"""
+    def load_files(self, dataset_name: str, file_paths: List[Path], config: Dict = None) -> List[Document]:
+        """Load only the given files of a dataset"""
         documents = []
+        for batch in self.iter_file_batches(dataset_name, file_paths, config):
+            documents.extend(batch)
+        return documents
+    
+    def iter_file_batches(self, dataset_name: str, file_paths: List[Path],
+                          config: Dict = None) -> Iterator[List[Document]]:
+        """Stream documents of the given files, one read chunk at a time"""
+        config = config or self.config.DATASET_CONFIGS[dataset_name]
+        file_loader = self._file_loader(config["data_type"])
         
-        # Look for genomic data files
-        csv_files = list(dataset_path.rglob("*.csv"))
-        tsv_files = list(dataset_path.rglob("*.tsv"))
-        
-        for file_path in csv_files + tsv_files:
+        for file_path in file_paths:
             try:
-                df = pd.read_csv(file_path, sep='\t' if file_path.suffix == '.tsv' else ',')
-                for idx, row in df.iterrows():
-                    content = self._create_genomic_content(row, dataset_name)
-                    metadata = {
-                        "dataset": dataset_name,
-                        "data_type": "genomic",
-                        "modality": config["modality"],
-                        "body_part": config["body_part"],
-                        "source_file": str(file_path),
-                        "row_index": idx
-                    }
-                    doc = Document(page_content=content, metadata=metadata)
-                    documents.append(doc)
+                for documents in file_loader(dataset_name, Path(file_path), config):
+                    yield documents
             except Exception as e:
                 print(f"Error processing {file_path}: {e}")
+    
+    def _file_loader(self, data_type: str):
+        """Pick the per-file loader for a data type"""
+        if data_type == "imaging":
+            return self._load_imaging_file
+        elif data_type == "clinical":
+            return self._load_clinical_file
+        elif data_type == "genomic":
+            return self._load_genomic_file
+        elif data_type == "pathology":
+            return self._load_pathology_file
+        elif data_type == "cardiology":
+            return self._load_imaging_file  # Similar structure
+        elif data_type == "ophthalmology":
+            return self._load_imaging_file  # Similar structure
+        else:
+            return self._load_generic_file
+    
+    def _read_table(self, file_path: Path, sep: str = ',') -> Iterator[pd.DataFrame]:
+        """Read a CSV/TSV file in CSV_CHUNK_SIZE row chunks.
         
-        return documents
+        Row index continues across chunks, so row_index matches a full read.
+        Column dtypes are inferred per chunk.
+        """
+        return pd.read_csv(file_path, sep=sep, chunksize=self.config.CSV_CHUNK_SIZE)
+    
+    def _load_imaging_file(self, dataset_name: str, file_path: Path, config: Dict) -> Iterator[List[Document]]:
+        """Load an imaging metadata CSV or annotation JSON file"""
+        if file_path.suffix == '.json':
+            with open(file_path, 'r') as f:
+                data = json.load(f)
+            content = f"Imaging Data from {dataset_name}: {json.dumps(data, indent=2)}"
+            metadata = {
+                "dataset": dataset_name,
+                "data_type": "imaging",
+                "modality": config["modality"],
+                "body_part": config["body_part"],
+                "source_file": str(file_path)
+            }
+            yield [Document(page_content=content, metadata=metadata)]
+            return
+        
+        header = f"Dataset: {dataset_name}\nModality: {config['modality']}\nBody Part: {config['body_part']}"
+        for df in self._read_table(file_path):
+            contents = self._render_contents(df, header)
+            yield self._row_documents(df, contents, dataset_name, "imaging", file_path, config)
+    
+    def _load_clinical_file(self, dataset_name: str, file_path: Path, config: Dict) -> Iterator[List[Document]]:
+        """Load a clinical/EHR CSV file"""
+        for df in self._read_table(file_path):
+            contents = self._render_contents(df, f"Clinical Data from {dataset_name}", self.CLINICAL_PRIORITY_FIELDS)
+            yield self._row_documents(df, contents, dataset_name, "clinical", file_path, config)
+    
+    def _load_genomic_file(self, dataset_name: str, file_path: Path, config: Dict) -> Iterator[List[Document]]:
+        """Load a genomic CSV/TSV file"""
+        for df in self._read_table(file_path, sep='\t' if file_path.suffix == '.tsv' else ','):
+            contents = self._render_contents(df, f"Genomic Data from {dataset_name}", self.GENOMIC_PRIORITY_FIELDS)
+            yield self._row_documents(df, contents, dataset_name, "genomic", file_path, config)
+    
+    def _load_pathology_file(self, dataset_name: str, file_path: Path, config: Dict) -> Iterator[List[Document]]:
+        """Load a pathology CSV file"""
+        for df in self._read_table(file_path):
+            contents = self._render_contents(df, f"Pathology Data from {dataset_name}", self.PATHOLOGY_PRIORITY_FIELDS)
+            yield self._row_documents(df, contents, dataset_name, "pathology", file_path, config)
+    
+    def _load_generic_file(self, dataset_name: str, file_path: Path, config: Dict) -> Iterator[List[Document]]:
+        """Load any CSV file with generic approach"""
+        for df in self._read_table(file_path):
+            # Generic content keeps a newline after the header even when the row is empty
+            contents = [f"Data from {dataset_name}:\n" + cells[1:] for cells in self._render_cells(df)]
+            yield self._row_documents(df, contents, dataset_name, config["data_type"], file_path, config)
     
-    def _load_pathology_data(self, dataset_name: str, dataset_path: Path, config: Dict) -> List[Document]:
-        """Load pathology datasets"""
+    def _row_documents(self, df: pd.DataFrame, contents: List[str], dataset_name: str, data_type: str,
+                       file_path: Path, config: Dict) -> List[Document]:
+        """Wrap rendered row contents into Documents with row metadata"""
         documents = []
-        
-        csv_files = list(dataset_path.rglob("*.csv"))
-        for csv_file in csv_files:
-            try:
-                df = pd.read_csv(csv_file)
-                for idx, row in df.iterrows():
-                    content = self._create_pathology_content(row, dataset_name)
-                    metadata = {
-                        "dataset": dataset_name,
-                        "data_type": "pathology",
-                        "modality": config["modality"],
-                        "body_part": config["body_part"],
-                        "source_file": str(csv_file),
-                        "row_index": idx
-                    }
-                    doc = Document(page_content=content, metadata=metadata)
-                    documents.append(doc)
-            except Exception as e:
-                print(f"Error processing {csv_file}: {e}")
-        
+        for idx, content in zip(df.index, contents):
+            metadata = {
+                "dataset": dataset_name,
+                "data_type": data_type,
+                "modality": config["modality"],
+                "body_part": config["body_part"],
+                "source_file": str(file_path),
+                "row_index": idx
+            }
+            documents.append(Document(page_content=content, metadata=metadata))
         return documents
     
-    def _load_cardiology_data(self, dataset_name: str, dataset_path: Path, config: Dict) -> List[Document]:
-        """Load cardiology datasets"""
-        return self._load_imaging_data(dataset_name, dataset_path, config)  # Similar structure
+    def _render_contents(self, df: pd.DataFrame, header: str, priority_fields: List[str] = ()) -> List[str]:
+        """Render every row as header plus "col: value" lines, column by column"""
+        return [header + cells for cells in self._render_cells(df, priority_fields)]
+    
+    def _render_cells(self, df: pd.DataFrame, priority_fields: List[str] = ()) -> List[str]:
+        """Vectorized equivalent of the per-row _create_*_content loops.
+        
+        Returns, for each row, "\ncol: value" for every non-null cell, with
+        priority fields first. Values come from df.values so they are upcast
+        exactly as DataFrame.iterrows would upcast them.
+        """
+        columns = list(df.columns)
+        ordered = [columns.index(field) for field in priority_fields if field in columns]
+        ordered += [i for i, col in enumerate(columns) if col not in priority_fields]
+        
+        values = df.values
+        cells = np.full(len(df), "", dtype=object)
+        for i in ordered:
+            column = values[:, i]
+            present = pd.notna(column)
+            if not present.any():
+                continue
+            rendered = f"\n{columns[i]}: " + _to_str(column)
+            cells = cells + np.where(present, rendered, "")
+        
+        return cells.tolist()
     
-    def _load_ophthalmology_data(self, dataset_name: str, dataset_path: Path, config: Dict) -> List[Document]:
-        """Load ophthalmology datasets"""
-        return self._load_imaging_data(dataset_name, dataset_path, config)  # Similar structure
+    # Row-at-a-time reference implementations of _render_contents, kept for
+    # parity checks in benchmarks/bench_row_conversion.py
     
     def _create_imaging_content(self, row: pd.Series, dataset_name: str, config: Dict) -> str:
         """Create content for imaging data"""
@@ -210,8 +338,7 @@ class ComprehensiveMedicalDataLoader:
         content_parts = [f"Clinical Data from {dataset_name}"]
         
         # Prioritize important clinical fields
-        priority_fields = ['patient_id', 'age', 'gender', 'diagnosis', 'symptoms', 
-                          'lab_results', 'medications', 'treatment', 'outcome']
+        priority_fields = self.CLINICAL_PRIORITY_FIELDS
         
         for field in priority_fields:
             if field in row and pd.notna(row[field]):
@@ -229,8 +356,7 @@ class ComprehensiveMedicalDataLoader:
         content_parts = [f"Genomic Data from {dataset_name}"]
         
         # Genomic-specific fields
-        genomic_fields = ['gene', 'mutation', 'expression', 'variant', 'chromosome', 
-                         'position', 'sample_id', 'cancer_type']
+        genomic_fields = self.GENOMIC_PRIORITY_FIELDS
         
         for field in genomic_fields:
             if field in row and pd.notna(row[field]):
@@ -246,8 +372,7 @@ class ComprehensiveMedicalDataLoader:
         """Create content for pathology data"""
         content_parts = [f"Pathology Data from {dataset_name}"]
         
-        pathology_fields = ['slide_id', 'tissue_type', 'diagnosis', 'malignancy', 
-                           'grade', 'stage', 'patient_id']
+        pathology_fields = self.PATHOLOGY_PRIORITY_FIELDS
         
         for field in pathology_fields:
             if field in row and pd.notna(row[field]):
@@ -258,32 +383,32 @@ class ComprehensiveMedicalDataLoader:
                 content_parts.append(f"{col}: {row[col]}")
         
         return "\n".join(content_parts)
-    
-    def _load_generic_dataset(self, dataset_name: str, dataset_path: Path, config: Dict) -> List[Document]:
-        """Load any dataset with generic approach"""
-        documents = []
-        
-        # Try all common file types
-        csv_files = list(dataset_path.rglob("*.csv"))
-        json_files = list(dataset_path.rglob("*.json"))
-        text_files = list(dataset_path.rglob("*.txt"))
-        
-        for file_path in csv_files:
-            try:
-                df = pd.read_csv(file_path)
-                for idx, row in df.iterrows():
-                    content = f"Data from {dataset_name}:\n" + "\n".join([f"{col}: {val}" for col, val in row.items() if pd.notna(val)])
-                    metadata = {
-                        "dataset": dataset_name,
-                        "data_type": config["data_type"],
-                        "modality": config["modality"],
-                        "body_part": config["body_part"],
-                        "source_file": str(file_path),
-                        "row_index": idx
-                    }
-                    doc = Document(page_content=content, metadata=metadata)
-                    documents.append(doc)
-            except Exception as e:
-                print(f"Error processing {file_path}: {e}")
-        
-        return documents
+
+def json_default(value):
+    """json.dumps default for document metadata: numpy scalars (e.g. row indexes) become plain numbers,
+    anything else unserializable its str()"""
+    return value.item() if isinstance(value, np.generic) else str(value)
+
+def rebatch(batches: Iterable[List[Document]], batch_size: int) -> Iterator[List[Document]]:
+    """Regroup a stream of document lists into lists of exactly batch_size (last may be shorter)"""
+    pending = []
+    for batch in batches:
+        pending.extend(batch)
+        if len(pending) >= batch_size:
+            full = len(pending) - len(pending) % batch_size
+            for start in range(0, full, batch_size):
+                yield pending[start:start + batch_size]
+            pending = pending[full:]
+    if pending:
+        yield pending
+
+# Per-process loader used by the parallel ingestion pool
+_worker_loader = None
+
+def _init_worker(config):
+    global _worker_loader
+    _worker_loader = ComprehensiveMedicalDataLoader(config)
+
+def _load_file_in_worker(dataset_name: str, file_path: str, config: Dict) -> List[Document]:
+    """Parse one file inside a pool worker; errors are reported per file as in sequential mode"""
+    return _worker_loader.load_files(dataset_name, [Path(file_path)], config)
@@ -0,0 +1,152 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+class AdaptiveRateLimiter:
+    """Token bucket for embedding requests that backs off on 429s.
+
+    The refill rate halves on every throttled response and recovers
+    additively on successes, up to the configured requests per second.
+    Meant to be used from a single event loop.
+    """
+
+    def __init__(self, requests_per_second: float, burst: Optional[int] = None, min_rate: float = 0.1):
+        self.max_rate = requests_per_second
+        self.rate = requests_per_second
+        self.min_rate = min_rate
+        self.capacity = burst or max(1, int(requests_per_second))
+        self.tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self._refill(now)
+            if now >= self._paused_until and self.tokens >= 1:
+                self.tokens -= 1
+                return
+            wait = max(self._paused_until - now, (1 - self.tokens) / self.rate)
+            await asyncio.sleep(wait)
+
+    def on_success(self):
+        self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+    def on_throttle(self, retry_after: Optional[float] = None):
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.tokens = 0.0
+        if retry_after:
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+
+def _is_rate_limited(error: Exception) -> bool:
+    return getattr(error, "status_code", None) == 429 or type(error).__name__ == "RateLimitError"
+
+def _retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+class _BackgroundLoop:
+    """Event loop on a daemon thread, so async HTTP clients keep one loop for their lifetime"""
+
+    def __init__(self):
+        self._loop = None
+        self._lock = threading.Lock()
+
+    def submit(self, coro) -> Future:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, daemon=True).start()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+class BatchedEmbeddings(Embeddings):
+    """Embeddings wrapper that sends fixed-size batches concurrently under a rate limit.
+
+    Each batch is retried on its own, with the limiter backing off on 429s,
+    so one throttled request does not fail or stall the whole build. Works
+    with any Embeddings exposing aembed_documents, including an
+    AzureOpenAIEmbeddings pointed at a local fake server
+    (see benchmarks/fake_embedding_server.py).
+    """
+
+    def __init__(self, embeddings: Embeddings, batch_size: int = 256, max_concurrency: int = 8,
+                 requests_per_second: float = 20.0, max_retries: int = 6):
+        self.embeddings = embeddings
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.limiter = AdaptiveRateLimiter(requests_per_second)
+        self._loop = _BackgroundLoop()
+
+        self.documents = 0
+        self.requests = 0
+        self.retries = 0
+        self.throttled = 0
+        self.elapsed = 0.0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._loop.submit(self._embed_all(texts)).result()
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await asyncio.wrap_future(self._loop.submit(self._embed_all(texts)))
+
+    # Queries go through the same limiter, retries and background loop as documents
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+    async def _embed_all(self, texts: List[str]) -> List[List[float]]:
+        start = time.perf_counter()
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+
+        results = await asyncio.gather(*(self._embed_batch(batch, semaphore) for batch in batches))
+
+        self.documents += len(texts)
+        self.elapsed += time.perf_counter() - start
+        return [vector for batch_vectors in results for vector in batch_vectors]
+
+    async def _embed_batch(self, batch: List[str], semaphore: asyncio.Semaphore) -> List[List[float]]:
+        attempt = 0
+        async with semaphore:
+            while True:
+                await self.limiter.acquire()
+                self.requests += 1
+                try:
+                    vectors = await self.embeddings.aembed_documents(batch)
+                    self.limiter.on_success()
+                    return vectors
+                except Exception as e:
+                    attempt += 1
+                    if attempt > self.max_retries:
+                        raise
+                    self.retries += 1
+                    if _is_rate_limited(e):
+                        self.throttled += 1
+                        self.limiter.on_throttle(_retry_after(e))
+                    else:
+                        await asyncio.sleep(min(30.0, 0.5 * 2 ** attempt))
+
+    def stats(self) -> Dict:
+        return {
+            "documents": self.documents,
+            "requests": self.requests,
+            "retries": self.retries,
+            "throttled": self.throttled,
+            "current_rate": self.limiter.rate,
+            "docs_per_sec": self.documents / self.elapsed if self.elapsed else 0.0
+        }
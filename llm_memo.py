@@ -0,0 +1,213 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, Optional
+
+from langchain_core.exceptions import OutputParserException
+from langchain_core.language_models import LanguageModelInput
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, BaseMessageChunk, HumanMessage
+from langchain_core.output_parsers import JsonOutputParser
+from langchain_core.prompt_values import PromptValue
+from langchain_core.runnables import Runnable, RunnableConfig
+
+from metrics import record_memo_hit
+
+# Chat model settings that change its output for the same prompt
+SAMPLING_PARAMS = ("temperature", "top_p", "max_tokens", "n", "seed", "presence_penalty", "frequency_penalty")
+
+def sampling_params(llm) -> Dict:
+    """Sampling settings of the chat model under any wrappers (each wrapper keeps it in .llm)"""
+    while not hasattr(llm, "temperature") and hasattr(llm, "llm"):
+        llm = llm.llm
+    params = {name: getattr(llm, name) for name in SAMPLING_PARAMS if getattr(llm, name, None) is not None}
+    params.update(getattr(llm, "model_kwargs", None) or {})
+    return params
+
+def parses_as_json(output: str) -> bool:
+    """Whether JsonOutputParser, which the agent chains end with, accepts output"""
+    try:
+        JsonOutputParser().parse(output)
+        return True
+    except OutputParserException:
+        return False
+
+class LLMMemo:
+    """Persistent SQLite memo of LLM outputs keyed by model and prompt hash"""
+
+    def __init__(self, path: str, max_entries: int = 100_000, ttl_seconds: Optional[float] = None):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_outputs (
+                key TEXT PRIMARY KEY,
+                output TEXT NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_outputs_last_used ON llm_outputs(last_used)")
+        self._conn.commit()
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM llm_outputs").fetchone()[0]
+
+    @staticmethod
+    def key(model: str, messages: list, sampling: Optional[Dict] = None) -> str:
+        """Memo key for a rendered prompt (template text plus inputs) sent to model with sampling settings"""
+        payload = json.dumps([model, [(message.type, message.content) for message in messages], sampling or {}],
+                             sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT output, created FROM llm_outputs WHERE key = ?", (key,)).fetchone()
+            if row is None or (self.ttl_seconds is not None and now - row[1] > self.ttl_seconds):
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE llm_outputs SET last_used = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        return row[0]
+
+    def delete(self, key: str):
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM llm_outputs WHERE key = ?", (key,))
+            self._conn.commit()
+            self._entries -= cursor.rowcount
+
+    def put(self, key: str, output: str):
+        now = time.time()
+        with self._lock:
+            exists = self._conn.execute("SELECT 1 FROM llm_outputs WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_outputs (key, output, created, last_used) VALUES (?, ?, ?, ?)",
+                (key, output, now, now)
+            )
+            if exists is None:
+                self._entries += 1
+            overflow = self._entries - self.max_entries
+            if overflow > 0:
+                cursor = self._conn.execute(
+                    "DELETE FROM llm_outputs WHERE key IN "
+                    "(SELECT key FROM llm_outputs ORDER BY last_used ASC LIMIT ?)",
+                    (overflow,)
+                )
+                self._entries -= cursor.rowcount
+            self._conn.commit()
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": self._entries
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class MemoizedLLM(Runnable):
+    """Chat model wrapper that answers repeated prompts from an LLMMemo.
+
+    Drop-in for the llm in `prompt | llm | parser` chains: the rendered
+    prompt already carries the template and its inputs, so every agent
+    chain is memoized without changes to the agents. Outputs are only
+    stored (and served) if validate accepts them, so a chain whose parser
+    rejected a completion asks the model again next time; see
+    with_validator().
+    """
+
+    def __init__(self, llm, memo: LLMMemo, model: str, validate: Optional[Callable[[str], bool]] = None):
+        self.llm = llm
+        self.memo = memo
+        self.model = model
+        self.validate = validate
+        self.sampling = sampling_params(llm)
+
+    def with_validator(self, validate: Callable[[str], bool]) -> "MemoizedLLM":
+        """The same model and memo, memoizing only outputs validate accepts"""
+        return MemoizedLLM(self.llm, self.memo, self.model, validate)
+
+    def _key(self, input: LanguageModelInput, kwargs: Dict) -> str:
+        if isinstance(input, PromptValue):
+            messages = input.to_messages()
+        elif isinstance(input, str):
+            messages = [HumanMessage(content=input)]
+        else:
+            messages = list(input)
+        # Per-call arguments such as stop sequences or a bound temperature override the model's
+        return self.memo.key(self.model, messages, {**self.sampling, **kwargs})
+
+    def _get(self, key: str) -> Optional[str]:
+        output = self.memo.get(key)
+        if output is not None and self.validate is not None and not self.validate(output):
+            # Stored before this chain validated its outputs
+            self.memo.delete(key)
+            return None
+        return output
+
+    def _put(self, key: str, output: str):
+        if self.validate is None or self.validate(output):
+            self.memo.put(key, output)
+
+    def invoke(self, input: LanguageModelInput, config: Optional[RunnableConfig] = None, **kwargs: Any) -> BaseMessage:
+        key = self._key(input, kwargs)
+        output = self._get(key)
+        if output is not None:
+            record_memo_hit()
+            return AIMessage(content=output)
+        message = self.llm.invoke(input, config, **kwargs)
+        self._put(key, message.content)
+        return message
+
+    async def ainvoke(self, input: LanguageModelInput, config: Optional[RunnableConfig] = None,
+                      **kwargs: Any) -> BaseMessage:
+        key = self._key(input, kwargs)
+        output = self._get(key)
+        if output is not None:
+            record_memo_hit()
+            return AIMessage(content=output)
+        message = await self.llm.ainvoke(input, config, **kwargs)
+        self._put(key, message.content)
+        return message
+
+    def stream(self, input: LanguageModelInput, config: Optional[RunnableConfig] = None,
+               **kwargs: Any) -> Iterator[BaseMessageChunk]:
+        """Stream the completion, or the memoized output as one chunk; memoized once fully received"""
+        key = self._key(input, kwargs)
+        output = self._get(key)
+        if output is not None:
+            record_memo_hit()
+            yield AIMessageChunk(content=output)
+            return
+        parts = []
+        for chunk in self.llm.stream(input, config, **kwargs):
+            parts.append(chunk.content)
+            yield chunk
+        self._put(key, "".join(parts))
+
+    async def astream(self, input: LanguageModelInput, config: Optional[RunnableConfig] = None,
+                      **kwargs: Any) -> AsyncIterator[BaseMessageChunk]:
+        key = self._key(input, kwargs)
+        output = self._get(key)
+        if output is not None:
+            record_memo_hit()
+            yield AIMessageChunk(content=output)
+            return
+        parts = []
+        async for chunk in self.llm.astream(input, config, **kwargs):
+            parts.append(chunk.content)
+            yield chunk
+        self._put(key, "".join(parts))
@@ -0,0 +1,150 @@
+import hashlib
+import json
+from pathlib import Path
+from typing import Dict, List, Optional
+
+class ManifestDiff:
+    """Files added, modified or removed between two manifests"""
+
+    def __init__(self, added: List[str] = None, modified: List[str] = None, removed: List[str] = None):
+        self.added = added or []
+        self.modified = modified or []
+        self.removed = removed or []
+
+    @property
+    def is_empty(self) -> bool:
+        return not (self.added or self.modified or self.removed)
+
+    def __repr__(self) -> str:
+        return f"ManifestDiff(added={len(self.added)}, modified={len(self.modified)}, removed={len(self.removed)})"
+
+class DatasetManifest:
+    """Fingerprint of the dataset files a vector store was built from"""
+
+    VERSION = 2
+    HASH_CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, files: Optional[Dict[str, Dict]] = None, vector_store_type: str = None,
+                 embedding_model: str = None, index_type: str = None, version: int = VERSION):
+        self.files = files or {}
+        self.vector_store_type = vector_store_type
+        self.embedding_model = embedding_model
+        self.index_type = index_type
+        self.version = version
+
+    def add_file(self, dataset_name: str, file_path: Path):
+        """Record a dataset file by its size and modification time"""
+        stat = file_path.stat()
+        self.files[str(file_path)] = {
+            "dataset": dataset_name,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "sha256": None
+        }
+
+    @classmethod
+    def file_hash(cls, file_path: str) -> str:
+        """Content hash of a file, read in chunks"""
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(cls.HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def compute_hashes(self):
+        """Fill in content hashes that have not been computed yet"""
+        for file_path, entry in self.files.items():
+            if entry.get("sha256") is None:
+                entry["sha256"] = self.file_hash(file_path)
+
+    def is_compatible(self, other: "DatasetManifest") -> bool:
+        """Check whether an index built from other can be updated in place"""
+        return (
+            other.version >= 2
+            and self.vector_store_type == other.vector_store_type
+            and self.embedding_model == other.embedding_model
+            and self.index_type == other.index_type
+        )
+
+    def diff(self, previous: "DatasetManifest") -> ManifestDiff:
+        """Compare against the manifest of an existing index.
+
+        Files whose size and mtime are unchanged are trusted without hashing;
+        the others are hashed so a touched-but-identical file is not re-indexed.
+        Hashes of unchanged files are carried over from the previous manifest.
+        """
+        diff = ManifestDiff()
+
+        for file_path, entry in self.files.items():
+            old_entry = previous.files.get(file_path)
+            if old_entry is None:
+                diff.added.append(file_path)
+                continue
+
+            if entry["size"] == old_entry["size"] and entry["mtime"] == old_entry["mtime"]:
+                entry["sha256"] = entry.get("sha256") or old_entry.get("sha256")
+                continue
+
+            if entry.get("sha256") is None:
+                entry["sha256"] = self.file_hash(file_path)
+            if entry["sha256"] != old_entry.get("sha256"):
+                diff.modified.append(file_path)
+
+        diff.removed = [file_path for file_path in previous.files if file_path not in self.files]
+        return diff
+
+    def matches(self, other: "DatasetManifest") -> bool:
+        """Check whether two manifests describe the same index inputs"""
+        return (
+            self.vector_store_type == other.vector_store_type
+            and self.embedding_model == other.embedding_model
+            and self.index_type == other.index_type
+            and self.diff(other).is_empty
+        )
+
+    def fingerprint(self) -> str:
+        """Hash of the index inputs (file contents, store, model, index type), ignoring mtimes"""
+        inputs = {
+            "vector_store_type": self.vector_store_type,
+            "embedding_model": self.embedding_model,
+            "index_type": self.index_type,
+            "files": {file_path: entry.get("sha256") for file_path, entry in self.files.items()}
+        }
+        return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+    
+    def to_dict(self) -> Dict:
+        return {
+            "version": self.version,
+            "vector_store_type": self.vector_store_type,
+            "embedding_model": self.embedding_model,
+            "index_type": self.index_type,
+            "files": self.files
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "DatasetManifest":
+        return cls(
+            files=data.get("files", {}),
+            vector_store_type=data.get("vector_store_type"),
+            embedding_model=data.get("embedding_model"),
+            index_type=data.get("index_type", "flat"),
+            version=data.get("version", 1)
+        )
+
+    def save(self, path: Path):
+        """Persist manifest as JSON"""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    @classmethod
+    def load(cls, path: Path) -> Optional["DatasetManifest"]:
+        """Load a persisted manifest, or None if it is missing or unreadable"""
+        if not path.exists():
+            return None
+        try:
+            with open(path, 'r') as f:
+                return cls.from_dict(json.load(f))
+        except (OSError, ValueError) as e:
+            print(f"⚠ Could not read manifest {path}: {e}")
+            return None
@@ -0,0 +1,329 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import LanguageModelInput
+from langchain_core.messages import BaseMessage, BaseMessageChunk
+from langchain_core.prompt_values import PromptValue
+from langchain_core.runnables import Runnable, RunnableConfig
+
+class QueryTrace:
+    """Timings and counters of one workflow query.
+
+    Filled in by the graph nodes, the metered LLM and embeddings, and the
+    retriever while the trace is current (see tracing()). Parallel branches
+    record into the same trace, so updates are locked.
+    """
+
+    def __init__(self, query: str, thread_id: Optional[str] = None):
+        self.query = query
+        self.thread_id = thread_id
+        self.started = time.time()
+        self.seconds = 0.0
+        self.cached = False
+        self.nodes = {}  # node -> seconds
+        self.llm = {}  # agent node -> calls, memo hits, tokens, seconds
+        self.embeddings = {"calls": 0, "texts": 0, "seconds": 0.0}
+        self.searches = {}  # "vector"/"lexical" -> calls, hits, seconds
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+
+    def add_node(self, node: str, seconds: float):
+        with self._lock:
+            self.nodes[node] = self.nodes.get(node, 0.0) + seconds
+
+    def add_llm_call(self, agent: str, prompt_tokens: int, completion_tokens: int, seconds: float):
+        with self._lock:
+            stats = self._llm_stats(agent)
+            stats["calls"] += 1
+            stats["prompt_tokens"] += prompt_tokens
+            stats["completion_tokens"] += completion_tokens
+            stats["seconds"] += seconds
+
+    def add_memo_hit(self, agent: str):
+        with self._lock:
+            self._llm_stats(agent)["memo_hits"] += 1
+
+    def _llm_stats(self, agent: str) -> Dict:
+        return self.llm.setdefault(agent, {"calls": 0, "memo_hits": 0, "prompt_tokens": 0,
+                                           "completion_tokens": 0, "seconds": 0.0})
+
+    def add_embedding_call(self, texts: int, seconds: float):
+        with self._lock:
+            self.embeddings["calls"] += 1
+            self.embeddings["texts"] += texts
+            self.embeddings["seconds"] += seconds
+
+    def add_search(self, kind: str, hits: int, seconds: float):
+        with self._lock:
+            stats = self.searches.setdefault(kind, {"calls": 0, "hits": 0, "seconds": 0.0})
+            stats["calls"] += 1
+            stats["hits"] += hits
+            stats["seconds"] += seconds
+
+    def finish(self):
+        self.seconds = time.perf_counter() - self._start
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {
+                "query": self.query,
+                "thread_id": self.thread_id,
+                "started": self.started,
+                "seconds": round(self.seconds, 6),
+                "cached": self.cached,
+                "nodes": {node: round(seconds, 6) for node, seconds in self.nodes.items()},
+                "llm": {agent: dict(stats) for agent, stats in self.llm.items()},
+                "embeddings": dict(self.embeddings),
+                "searches": {kind: dict(stats) for kind, stats in self.searches.items()}
+            }
+
+_current_trace: ContextVar[Optional[QueryTrace]] = ContextVar("query_trace", default=None)
+_current_node: ContextVar[Optional[str]] = ContextVar("graph_node", default=None)
+
+def current_trace() -> Optional[QueryTrace]:
+    return _current_trace.get()
+
+@contextmanager
+def tracing(trace: QueryTrace, node: Optional[str] = None):
+    """Make trace (and optionally the agent node) current for the calls inside the block"""
+    trace_token = _current_trace.set(trace)
+    node_token = _current_node.set(node) if node is not None else None
+    try:
+        yield trace
+    finally:
+        if node_token is not None:
+            _current_node.reset(node_token)
+        _current_trace.reset(trace_token)
+
+@contextmanager
+def node_span(node: str):
+    """Time a graph node and attribute the LLM calls inside it to the node"""
+    token = _current_node.set(node)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _current_node.reset(token)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add_node(node, time.perf_counter() - start)
+
+def traced_iter(trace: QueryTrace, iterator: Iterator, node: Optional[str] = None) -> Iterator:
+    """Iterate with trace current while each item is produced, but not while the consumer runs"""
+    while True:
+        with tracing(trace, node):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+async def atraced_iter(trace: QueryTrace, iterator: AsyncIterator, node: Optional[str] = None) -> AsyncIterator:
+    while True:
+        with tracing(trace, node):
+            try:
+                item = await iterator.__anext__()
+            except StopAsyncIteration:
+                return
+        yield item
+
+def record_llm_call(prompt_tokens: int, completion_tokens: int, seconds: float):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_llm_call(_current_node.get() or "unknown", prompt_tokens, completion_tokens, seconds)
+
+def record_memo_hit():
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_memo_hit(_current_node.get() or "unknown")
+
+def record_embedding_call(texts: int, seconds: float):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_embedding_call(texts, seconds)
+
+def record_search(kind: str, hits: int, seconds: float):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_search(kind, hits, seconds)
+
+class MetricsRegistry:
+    """Running totals over finished query traces.
+
+    Rendered in the Prometheus text exposition format; each trace can also
+    be appended to log_path as one JSON line.
+    """
+
+    METRICS = {
+        "medical_queries_total": ("counter", "Queries answered, by whether the response cache answered them"),
+        "medical_query_seconds": ("summary", "Wall time per query"),
+        "medical_node_seconds": ("summary", "Wall time per graph node"),
+        "medical_llm_calls_total": ("counter", "LLM calls sent to the model, by agent"),
+        "medical_llm_memo_hits_total": ("counter", "LLM calls answered from the memo, by agent"),
+        "medical_llm_tokens_total": ("counter", "LLM tokens, by agent and prompt/completion"),
+        "medical_llm_seconds": ("summary", "LLM call time, by agent"),
+        "medical_embedding_calls_total": ("counter", "Embedding requests sent to the model"),
+        "medical_embedding_texts_total": ("counter", "Texts embedded"),
+        "medical_embedding_seconds": ("summary", "Embedding request time"),
+        "medical_search_calls_total": ("counter", "Index searches, by vector/lexical"),
+        "medical_search_hits_total": ("counter", "Hits returned by index searches"),
+        "medical_search_seconds": ("summary", "Index search time")
+    }
+
+    def __init__(self, log_path: Optional[str] = None):
+        self.log_path = Path(log_path) if log_path else None
+        self._values = {}  # (sample name, labels) -> value
+        self._lock = threading.Lock()
+        if self.log_path is not None:
+            self.log_path.parent.mkdir(parents=True, exist_ok=True)
+
+    def observe(self, trace: QueryTrace):
+        """Add a finished trace to the totals and the log"""
+        with self._lock:
+            self._inc("medical_queries_total", 1, cached=str(trace.cached).lower())
+            self._observe("medical_query_seconds", trace.seconds)
+            for node, seconds in trace.nodes.items():
+                self._observe("medical_node_seconds", seconds, node=node)
+            for agent, stats in trace.llm.items():
+                self._inc("medical_llm_calls_total", stats["calls"], agent=agent)
+                self._inc("medical_llm_memo_hits_total", stats["memo_hits"], agent=agent)
+                self._inc("medical_llm_tokens_total", stats["prompt_tokens"], agent=agent, kind="prompt")
+                self._inc("medical_llm_tokens_total", stats["completion_tokens"], agent=agent, kind="completion")
+                if stats["calls"]:
+                    self._observe("medical_llm_seconds", stats["seconds"], stats["calls"], agent=agent)
+            if trace.embeddings["calls"]:
+                self._inc("medical_embedding_calls_total", trace.embeddings["calls"])
+                self._inc("medical_embedding_texts_total", trace.embeddings["texts"])
+                self._observe("medical_embedding_seconds", trace.embeddings["seconds"], trace.embeddings["calls"])
+            for kind, stats in trace.searches.items():
+                self._inc("medical_search_calls_total", stats["calls"], kind=kind)
+                self._inc("medical_search_hits_total", stats["hits"], kind=kind)
+                self._observe("medical_search_seconds", stats["seconds"], stats["calls"], kind=kind)
+
+            if self.log_path is not None:
+                with open(self.log_path, "a") as f:
+                    f.write(json.dumps(trace.to_dict(), separators=(",", ":")) + "\n")
+
+    def _inc(self, name: str, value: float, **labels: str):
+        key = (name, tuple(sorted(labels.items())))
+        self._values[key] = self._values.get(key, 0) + value
+
+    def _observe(self, name: str, seconds: float, count: int = 1, **labels: str):
+        self._inc(f"{name}_sum", seconds, **labels)
+        self._inc(f"{name}_count", count, **labels)
+
+    def snapshot(self) -> Dict[Tuple[str, Tuple], float]:
+        with self._lock:
+            return dict(self._values)
+
+    def render_prometheus(self) -> str:
+        values = self.snapshot()
+        lines = []
+        for name, (kind, help_text) in self.METRICS.items():
+            samples = sorted((key, value) for key, value in values.items()
+                             if key[0] in (name, f"{name}_sum", f"{name}_count"))
+            if not samples:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (sample, labels), value in samples:
+                label_text = ",".join(f'{key}="{label}"' for key, label in labels)
+                lines.append(f"{sample}{{{label_text}}} {value:g}" if label_text else f"{sample} {value:g}")
+        return "\n".join(lines) + "\n"
+
+def _prompt_text(input: LanguageModelInput) -> str:
+    if isinstance(input, PromptValue):
+        return input.to_string()
+    if isinstance(input, str):
+        return input
+    return "\n".join(str(message.content) for message in input)
+
+def _usage(message: BaseMessage) -> Optional[Dict]:
+    usage = getattr(message, "response_metadata", {}).get("token_usage")
+    return usage if usage and "prompt_tokens" in usage else None
+
+class MeteredLLM(Runnable):
+    """Chat model wrapper that records each call's time and tokens in the current trace.
+
+    Token counts come from the response's token_usage when the client
+    reports it, otherwise from count_tokens over the prompt and completion
+    (streamed responses carry no usage).
+    """
+
+    def __init__(self, llm, count_tokens: Callable[[str], int]):
+        self.llm = llm
+        self.count_tokens = count_tokens
+
+    def _record(self, input: LanguageModelInput, content: str, usage: Optional[Dict], start: float):
+        seconds = time.perf_counter() - start
+        if usage is not None:
+            record_llm_call(usage["prompt_tokens"], usage.get("completion_tokens", 0), seconds)
+        else:
+            record_llm_call(self.count_tokens(_prompt_text(input)), self.count_tokens(content), seconds)
+
+    def invoke(self, input: LanguageModelInput, config: Optional[RunnableConfig] = None, **kwargs: Any) -> BaseMessage:
+        start = time.perf_counter()
+        message = self.llm.invoke(input, config, **kwargs)
+        self._record(input, message.content, _usage(message), start)
+        return message
+
+    async def ainvoke(self, input: LanguageModelInput, config: Optional[RunnableConfig] = None,
+                      **kwargs: Any) -> BaseMessage:
+        start = time.perf_counter()
+        message = await self.llm.ainvoke(input, config, **kwargs)
+        self._record(input, message.content, _usage(message), start)
+        return message
+
+    def stream(self, input: LanguageModelInput, config: Optional[RunnableConfig] = None,
+               **kwargs: Any) -> Iterator[BaseMessageChunk]:
+        start = time.perf_counter()
+        parts = []
+        for chunk in self.llm.stream(input, config, **kwargs):
+            parts.append(chunk.content)
+            yield chunk
+        self._record(input, "".join(parts), None, start)
+
+    async def astream(self, input: LanguageModelInput, config: Optional[RunnableConfig] = None,
+                      **kwargs: Any) -> AsyncIterator[BaseMessageChunk]:
+        start = time.perf_counter()
+        parts = []
+        async for chunk in self.llm.astream(input, config, **kwargs):
+            parts.append(chunk.content)
+            yield chunk
+        self._record(input, "".join(parts), None, start)
+
+class MeteredEmbeddings(Embeddings):
+    """Embeddings wrapper that records each request's time and text count in the current trace"""
+
+    def __init__(self, embeddings: Embeddings):
+        self.embeddings = embeddings
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        start = time.perf_counter()
+        vectors = self.embeddings.embed_documents(texts)
+        record_embedding_call(len(texts), time.perf_counter() - start)
+        return vectors
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        start = time.perf_counter()
+        vectors = await self.embeddings.aembed_documents(texts)
+        record_embedding_call(len(texts), time.perf_counter() - start)
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        start = time.perf_counter()
+        vector = self.embeddings.embed_query(text)
+        record_embedding_call(1, time.perf_counter() - start)
+        return vector
+
+    async def aembed_query(self, text: str) -> List[float]:
+        start = time.perf_counter()
+        vector = await self.embeddings.aembed_query(text)
+        record_embedding_call(1, time.perf_counter() - start)
+        return vector
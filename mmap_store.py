@@ -0,0 +1,190 @@
+import json
+import mmap
+import shutil
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Tuple, Union
+
+import faiss
+import numpy as np
+from langchain.schema import Document
+from langchain_community.docstore.base import Docstore
+from langchain_community.vectorstores import FAISS
+
+from data_loader import json_default
+
+# Rows scanned per block by MmapFlatIndex, bounding scratch memory per query batch
+SEARCH_BLOCK_ROWS = 262144
+
+# Index version (manifest fingerprint) the snapshot was exported from
+VERSION_FILE = "VERSION"
+
+class OffsetDocstore(Docstore):
+    """Read-only docstore backed by a JSON-lines file and an offsets array.
+
+    Documents are addressed by FAISS position; each lookup reads one record
+    through a shared read-only mmap instead of unpickling the whole docstore.
+    """
+
+    def __init__(self, path: Path):
+        data_path = path / "docstore.data"
+        self._file = open(data_path, "rb")
+        # An empty file cannot be mapped
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if data_path.stat().st_size else b""
+        self._offsets = np.load(path / "docstore.offsets.npy", mmap_mode="r")
+
+        self._dataset_path = path / "docstore.datasets.npz"
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def dataset_positions(self) -> Optional[Dict[str, np.ndarray]]:
+        """FAISS positions of each dataset's documents, or None for snapshots that predate them"""
+        if not self._dataset_path.exists():
+            return None
+        with np.load(self._dataset_path) as arrays:
+            return {name: arrays[name] for name in arrays.files}
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
+
+    def search(self, search: Union[int, str]) -> Union[str, Document]:
+        position = int(search)
+        if not 0 <= position < len(self):
+            return f"ID {search} not found."
+        start, end = int(self._offsets[position]), int(self._offsets[position + 1])
+        page_content, metadata = json.loads(self._data[start:end])
+        return Document(page_content=page_content, metadata=metadata)
+
+class PositionalIds(Mapping):
+    """index_to_docstore_id for OffsetDocstore: position i maps to itself, without a dict of n entries"""
+
+    def __init__(self, size: int):
+        self._size = size
+
+    def __getitem__(self, position: int) -> int:
+        position = int(position)
+        if not 0 <= position < self._size:
+            raise KeyError(position)
+        return position
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(range(self._size))
+
+    def __len__(self) -> int:
+        return self._size
+
+class MmapFlatIndex:
+    """Exact L2 search over a memory-mapped float32 matrix.
+
+    Stands in for faiss.IndexFlatL2, whose codes faiss 1.7 always copies onto
+    the heap; here every process on the host shares the page-cached file.
+    Returns squared L2 distances like IndexFlatL2.
+    """
+
+    def __init__(self, path: Path):
+        self.vectors = np.load(path / "vectors.npy", mmap_mode="r")
+        self.norms = np.load(path / "norms.npy", mmap_mode="r")
+        self.ntotal, self.d = self.vectors.shape
+
+    def search(self, queries: np.ndarray, k: int,
+               positions: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k over all rows, or only over the sorted row positions given"""
+        queries = np.asarray(queries, dtype=np.float32)
+        query_norms = (queries ** 2).sum(axis=1, keepdims=True)
+        best_distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        best_labels = np.full((len(queries), k), -1, dtype=np.int64)
+
+        total = self.ntotal if positions is None else len(positions)
+        for start in range(0, total, SEARCH_BLOCK_ROWS):
+            if positions is None:
+                rows = np.arange(start, min(start + SEARCH_BLOCK_ROWS, total))
+                block = self.vectors[start:start + len(rows)]
+            else:
+                rows = positions[start:start + SEARCH_BLOCK_ROWS]
+                block = self.vectors[rows]
+            distances = query_norms - 2 * queries @ block.T + self.norms[rows]
+            labels = np.broadcast_to(rows, distances.shape)
+
+            distances = np.concatenate([best_distances, distances], axis=1)
+            labels = np.concatenate([best_labels, labels], axis=1)
+            top = np.argpartition(distances, min(k, distances.shape[1] - 1), axis=1)[:, :k]
+            best_distances = np.take_along_axis(distances, top, axis=1)
+            best_labels = np.take_along_axis(labels, top, axis=1)
+
+        order = np.argsort(best_distances, axis=1)
+        best_distances = np.take_along_axis(best_distances, order, axis=1)
+        best_labels = np.take_along_axis(best_labels, order, axis=1)
+        best_labels[np.isinf(best_distances)] = -1
+        return best_distances, best_labels
+
+def export_mmap_store(vector_store: FAISS, path: Path, version: Optional[str] = None):
+    """Write a read-only snapshot of a FAISS store that load_mmap_store can map, tagged with
+    the index version it was taken from"""
+    tmp_path = path.with_name(path.name + ".tmp")
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    tmp_path.mkdir(parents=True)
+
+    index = vector_store.index
+    ntotal = index.ntotal
+    if isinstance(index, faiss.IndexFlat):
+        vectors = np.lib.format.open_memmap(tmp_path / "vectors.npy", mode="w+", dtype=np.float32,
+                                            shape=(ntotal, index.d))
+        norms = np.lib.format.open_memmap(tmp_path / "norms.npy", mode="w+", dtype=np.float32, shape=(ntotal,))
+        for start in range(0, ntotal, SEARCH_BLOCK_ROWS):
+            block = index.reconstruct_n(start, min(SEARCH_BLOCK_ROWS, ntotal - start))
+            vectors[start:start + len(block)] = block
+            norms[start:start + len(block)] = (block ** 2).sum(axis=1)
+        vectors.flush()
+        norms.flush()
+        del vectors, norms
+    else:
+        faiss.write_index(index, str(tmp_path / "index.faiss"))
+
+    offsets = np.zeros(ntotal + 1, dtype=np.int64)
+    dataset_positions = {}
+    with open(tmp_path / "docstore.data", "wb") as f:
+        for position in range(ntotal):
+            doc = vector_store.docstore.search(vector_store.index_to_docstore_id[position])
+            f.write(json.dumps([doc.page_content, doc.metadata], default=json_default).encode())
+            offsets[position + 1] = f.tell()
+            dataset_positions.setdefault(doc.metadata.get("dataset", "unknown"), []).append(position)
+    np.save(tmp_path / "docstore.offsets.npy", offsets)
+    np.savez(tmp_path / "docstore.datasets.npz",
+             **{name: np.asarray(positions, dtype=np.int64) for name, positions in dataset_positions.items()})
+
+    if version is not None:
+        (tmp_path / VERSION_FILE).write_text(version)
+
+    # Build in a temp dir and swap it in once complete
+    shutil.rmtree(path, ignore_errors=True)
+    tmp_path.rename(path)
+
+def snapshot_version(path: Path) -> Optional[str]:
+    """Index version a complete snapshot was exported from, or None if there is none (or it is untagged)"""
+    if not (path / "docstore.offsets.npy").exists() or not (path / VERSION_FILE).exists():
+        return None
+    return (path / VERSION_FILE).read_text().strip()
+
+def load_mmap_store(path: Path, embeddings) -> FAISS:
+    """Open a snapshot written by export_mmap_store without reading it into the heap"""
+    if (path / "vectors.npy").exists():
+        index = MmapFlatIndex(path)
+    else:
+        try:
+            index = faiss.read_index(str(path / "index.faiss"), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError:
+            # Only IVF inverted lists can be mapped; other index types are read into memory
+            print("⚠ Index type cannot be memory-mapped, loading it into memory")
+            index = faiss.read_index(str(path / "index.faiss"))
+
+    docstore = OffsetDocstore(path)
+    return FAISS(embeddings, index, docstore, PositionalIds(len(docstore)))
+
+def close_store(vector_store):
+    """Release the files held by a store opened with load_mmap_store; other stores hold none"""
+    docstore = getattr(vector_store, "docstore", None)
+    if isinstance(docstore, OffsetDocstore):
+        docstore.close()
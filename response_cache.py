@@ -0,0 +1,285 @@
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from embedding_cache import aembed_queries
+
+def normalize_query(query: str) -> str:
+    """Case-, whitespace- and trailing-punctuation-insensitive form of a query"""
+    return re.sub(r"\s+", " ", query.lower()).strip().rstrip("?.!").strip()
+
+def _unit_vector(embedding: List[float]) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+class ResponseCache:
+    """Two-level cache of final workflow responses.
+
+    The first level matches the normalized query exactly. The second, only
+    when a similarity_threshold is given, embeds the query and returns the
+    response of the most similar live cached query if their cosine
+    similarity reaches the threshold. Entries expire
+    after ttl_seconds, the least recently used are evicted beyond
+    max_entries, and entries from another version (index or model) are
+    dropped.
+    """
+
+    def __init__(self, path: str, embeddings: Optional[Embeddings], version: str,
+                 similarity_threshold: Optional[float] = None, ttl_seconds: float = 86400, max_entries: int = 1000):
+        self.path = Path(path)
+        # Without a threshold queries are never embedded
+        self.embeddings = embeddings if similarity_threshold is not None else None
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                query TEXT NOT NULL,
+                embedding BLOB,
+                response TEXT NOT NULL,
+                version TEXT NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._conn.commit()
+        self.set_version(version)
+
+    def set_version(self, version: str):
+        """Switch to a new index/model version, dropping every entry of other versions"""
+        with self._lock:
+            self.version = version
+            cursor = self._conn.execute("DELETE FROM responses WHERE version != ?", (version,))
+            self._conn.commit()
+            if cursor.rowcount:
+                print(f"Response cache: dropped {cursor.rowcount} entries from a previous index version")
+            self._load_vectors()
+
+    def _load_vectors(self):
+        # Query embeddings of live entries, kept in memory for the semantic lookup
+        self._vectors = {
+            key: np.frombuffer(blob, dtype=np.float32)
+            for key, blob in self._conn.execute("SELECT key, embedding FROM responses WHERE embedding IS NOT NULL")
+        }
+
+    @staticmethod
+    def key(query: str) -> str:
+        return hashlib.sha256(normalize_query(query).encode()).hexdigest()
+
+    def get_or_compute(self, query: str, compute: Callable[[], str]) -> str:
+        """Cached response for query, or compute() stored under it.
+
+        The query is embedded at most once, and only if there is no exact hit.
+        """
+        response = self._get_exact(query)
+        if response is not None:
+            return response
+
+        embedding = self._embed(query)
+        response = self._get_semantic(embedding)
+        if response is not None:
+            return response
+
+        with self._lock:
+            self.misses += 1
+        response = compute()
+        self._put(query, response, embedding)
+        return response
+
+    async def aget_or_compute(self, query: str, compute: Callable[[], Awaitable[str]]) -> str:
+        """Async get_or_compute(): awaits the query embedding and compute()"""
+        response = self._get_exact(query)
+        if response is not None:
+            return response
+
+        embedding = await self._aembed(query)
+        response = self._get_semantic(embedding)
+        if response is not None:
+            return response
+
+        with self._lock:
+            self.misses += 1
+        response = await compute()
+        self._put(query, response, embedding)
+        return response
+
+    def get(self, query: str) -> Tuple[Optional[str], Optional[np.ndarray]]:
+        """Cached response for query (None on a miss), and the query embedding if it was embedded, for put()"""
+        response = self._get_exact(query)
+        if response is not None:
+            return response, None
+        embedding = self._embed(query)
+        response = self._get_semantic(embedding)
+        if response is None:
+            with self._lock:
+                self.misses += 1
+        return response, embedding
+
+    def put(self, query: str, response: str, embedding: Optional[np.ndarray] = None):
+        """Store response under query, embedding it unless given the embedding get() returned"""
+        self._put(query, response, embedding if embedding is not None else self._embed(query))
+
+    async def aget(self, query: str) -> Tuple[Optional[str], Optional[np.ndarray]]:
+        """Async get()"""
+        response = self._get_exact(query)
+        if response is not None:
+            return response, None
+        embedding = await self._aembed(query)
+        response = self._get_semantic(embedding)
+        if response is None:
+            with self._lock:
+                self.misses += 1
+        return response, embedding
+
+    async def aget_many(self, queries: List[str]) -> Tuple[List[Optional[str]], List[Optional[np.ndarray]]]:
+        """aget() for many queries, embedding all exact misses in one call.
+
+        Returns the responses (None for misses) and the query embeddings of
+        the exact misses, to hand back to aput().
+        """
+        responses = [self._get_exact(query) for query in queries]
+        embeddings = [None] * len(queries)
+        missed = [index for index, response in enumerate(responses) if response is None]
+        if missed and self.embeddings is not None:
+            vectors = await aembed_queries(self.embeddings, [normalize_query(queries[index]) for index in missed])
+            for index, vector in zip(missed, vectors):
+                embeddings[index] = _unit_vector(vector)
+        for index in missed:
+            responses[index] = self._get_semantic(embeddings[index])
+            if responses[index] is None:
+                with self._lock:
+                    self.misses += 1
+        return responses, embeddings
+
+    async def aput(self, query: str, response: str, embedding: Optional[np.ndarray] = None):
+        """Store response under query, embedding it unless given the embedding aget() or aget_many() returned"""
+        self._put(query, response, embedding if embedding is not None else await self._aembed(query))
+
+    def _embed(self, query: str) -> Optional[np.ndarray]:
+        if self.embeddings is None:
+            return None
+        return _unit_vector(self.embeddings.embed_query(normalize_query(query)))
+
+    async def _aembed(self, query: str) -> Optional[np.ndarray]:
+        if self.embeddings is None:
+            return None
+        return _unit_vector(await self.embeddings.aembed_query(normalize_query(query)))
+
+    def _get_exact(self, query: str) -> Optional[str]:
+        response = self._lookup(self.key(query))
+        if response is not None:
+            with self._lock:
+                self.exact_hits += 1
+        return response
+
+    def _get_semantic(self, embedding: Optional[np.ndarray]) -> Optional[str]:
+        if embedding is None:
+            return None
+        with self._lock:
+            if not self._vectors:
+                return None
+            keys = list(self._vectors)
+            similarities = np.stack([self._vectors[key] for key in keys]) @ embedding
+
+        # An expired best match falls through to the next most similar candidate
+        for index in np.argsort(-similarities):
+            if similarities[index] < self.similarity_threshold:
+                break
+            response = self._lookup(keys[index])
+            if response is not None:
+                with self._lock:
+                    self.semantic_hits += 1
+                return response
+        return None
+
+    def _lookup(self, key: str) -> Optional[str]:
+        """Live response stored under key, refreshing its LRU position; expired entries are removed"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            response, created = row
+            if now - created > self.ttl_seconds:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                self._vectors.pop(key, None)
+                return None
+            self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return response
+
+    def _put(self, query: str, response: str, embedding: Optional[np.ndarray]):
+        key = self.key(query)
+        now = time.time()
+        blob = embedding.astype(np.float32).tobytes() if embedding is not None else None
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, query, embedding, response, version, created, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, normalize_query(query), blob, response, self.version, now, now)
+            )
+            if embedding is not None:
+                self._vectors[key] = embedding.astype(np.float32)
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float):
+        expired = [row[0] for row in self._conn.execute(
+            "SELECT key FROM responses WHERE created < ?", (now - self.ttl_seconds,)
+        )]
+        count = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        overflow = count - len(expired) - self.max_entries
+        if overflow > 0:
+            expired += [row[0] for row in self._conn.execute(
+                "SELECT key FROM responses WHERE created >= ? ORDER BY last_used ASC LIMIT ?",
+                (now - self.ttl_seconds, overflow)
+            )]
+        if expired:
+            self._conn.executemany("DELETE FROM responses WHERE key = ?", [(key,) for key in expired])
+            for key in expired:
+                self._vectors.pop(key, None)
+            self.evictions += len(expired)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+            self._vectors = {}
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def stats(self) -> Dict:
+        lookups = self.exact_hits + self.semantic_hits + self.misses
+        return {
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": (self.exact_hits + self.semantic_hits) / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": len(self)
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
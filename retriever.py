@@ -0,0 +1,415 @@
+import asyncio
+import heapq
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from itertools import chain
+from operator import itemgetter
+from typing import Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+from langchain.schema import Document
+from langchain_community.vectorstores import FAISS
+
+from bm25 import BM25Index, is_identifier_query, term_coverage
+from embedding_cache import aembed_queries, embed_queries
+from metrics import record_search
+from mmap_store import SEARCH_BLOCK_ROWS, MmapFlatIndex, close_store
+from sharded_store import ShardedVectorStore, merge_results
+from vector_store import document_id
+
+class MedicalRetriever:
+    """Similarity search restricted to the datasets of each requested data type.
+
+    Data types are resolved to dataset names through DATASET_CONFIGS rather
+    than the data_type stored on each document, since several datasets share
+    a file loader (cardiology and ophthalmology rows are tagged "imaging").
+    A sharded store only searches the selected datasets' shards, FAISS
+    searches only scan the selected datasets' positions, and Chroma
+    searches use a metadata filter.
+
+    In "hybrid" RETRIEVAL_MODE the vector hits are fused with BM25 hits by
+    reciprocal rank; queries made only of codes and identifiers skip the
+    query embedding and are answered from the BM25 index alone.
+
+    The async variants await the embedding calls and run the index lookups
+    on the search pool, so they never block the event loop. Pool tasks run
+    in a copy of the caller's context, so searches land in its query trace.
+
+    query_embeddings maps search queries to vectors computed ahead of time
+    (e.g. for a whole batch of queries at once); only the queries missing
+    from it are embedded.
+
+    Dataset positions and FAISS selectors are cached for the life of the
+    retriever; a changed index gets a new retriever (MedicalAgents.use_index).
+    """
+
+    def __init__(self, vector_store, config, lexical_index: Optional[BM25Index] = None):
+        self.vector_store = vector_store
+        self.config = config
+        self.lexical_index = lexical_index
+        self._executor = ThreadPoolExecutor(max_workers=config.MULTI_QUERY_WORKERS, thread_name_prefix="multi-query")
+        self._positions = None
+        self._selectors = {}
+
+    def datasets_for(self, data_type: str) -> List[str]:
+        """Dataset names configured with the given data type"""
+        return [name for name, dataset_config in self.config.DATASET_CONFIGS.items()
+                if dataset_config["data_type"] == data_type]
+
+    def data_types(self) -> List[str]:
+        """Every configured data type, in DATASET_CONFIGS order"""
+        return list(dict.fromkeys(c["data_type"] for c in self.config.DATASET_CONFIGS.values()))
+
+    def resolve_data_types(self, requested: Optional[List[str]]) -> List[str]:
+        """Known data types from requested, or every configured type if none are recognised"""
+        known = self.data_types()
+        data_types = [data_type for data_type in dict.fromkeys(requested or []) if data_type in known]
+        return data_types or known
+
+    @property
+    def has_lexical_index(self) -> bool:
+        if isinstance(self.vector_store, ShardedVectorStore):
+            return self.vector_store.has_lexical_index
+        return self.lexical_index is not None
+
+    def close(self):
+        """Stop the search threads and release the store's files and BM25 connection"""
+        self._executor.shutdown()
+        if isinstance(self.vector_store, ShardedVectorStore):
+            self.vector_store.close()
+        else:
+            close_store(self.vector_store)
+        if self.lexical_index is not None:
+            self.lexical_index.close()
+
+    def search(self, query: str, data_types: Optional[List[str]] = None, k_per_type: Optional[int] = None,
+               min_score: Optional[float] = None,
+               query_embeddings: Optional[Dict[str, List[float]]] = None) -> Dict[str, List[Tuple[Document, float]]]:
+        """Top-k documents for each requested data type with relevance scores in [0, 1], best first.
+
+        Hits scoring below min_score (default RETRIEVAL_MIN_SCORE) are dropped,
+        and at most RETRIEVAL_MAX_K hits are kept across all types.
+        """
+        k = k_per_type or self.config.RETRIEVAL_K_PER_TYPE
+        embedding = (query_embeddings or {}).get(query)
+        hits = self._scored_hits(query, self.resolve_data_types(data_types), k, embedding)
+        return self._apply_cutoffs(hits, min_score)
+
+    def multi_search(self, queries: List[str], data_types: Optional[List[str]] = None,
+                     k_per_type: Optional[int] = None, min_score: Optional[float] = None,
+                     query_embeddings: Optional[Dict[str, List[float]]] = None) -> Dict[str, List[Tuple[Document, float]]]:
+        """Search each query on its own and fuse the rankings per data type by document id.
+
+        The query embeddings come from one batched embedding call and the
+        per-query searches run concurrently. A document found by several
+        queries keeps its best score. Cutoffs are the same as in search().
+        """
+        queries = self._distinct_queries(queries)
+        if len(queries) <= 1:
+            return self.search(" ".join(queries), data_types, k_per_type, min_score, query_embeddings)
+
+        k = k_per_type or self.config.RETRIEVAL_K_PER_TYPE
+        data_types = self.resolve_data_types(data_types)
+        embeddings = self._embed_queries(queries, query_embeddings)
+        futures = [self._executor.submit(copy_context().run, self._scored_hits, query, data_types, k,
+                                         embeddings.get(query))
+                   for query in queries]
+        per_query = [future.result() for future in futures]
+        return self._apply_cutoffs(self._fuse(per_query, data_types, k), min_score)
+
+    async def asearch(self, query: str, data_types: Optional[List[str]] = None, k_per_type: Optional[int] = None,
+                      min_score: Optional[float] = None,
+                      query_embeddings: Optional[Dict[str, List[float]]] = None) -> Dict[str, List[Tuple[Document, float]]]:
+        """Async search()"""
+        k = k_per_type or self.config.RETRIEVAL_K_PER_TYPE
+        data_types = self.resolve_data_types(data_types)
+        embedding = (query_embeddings or {}).get(query)
+        if embedding is None and self._needs_embedding(query):
+            embedding = await self.vector_store.embeddings.aembed_query(query)
+        hits = await asyncio.get_running_loop().run_in_executor(
+            self._executor, copy_context().run, self._scored_hits, query, data_types, k, embedding
+        )
+        return self._apply_cutoffs(hits, min_score)
+
+    async def amulti_search(self, queries: List[str], data_types: Optional[List[str]] = None,
+                            k_per_type: Optional[int] = None, min_score: Optional[float] = None,
+                            query_embeddings: Optional[Dict[str, List[float]]] = None
+                            ) -> Dict[str, List[Tuple[Document, float]]]:
+        """Async multi_search()"""
+        queries = self._distinct_queries(queries)
+        if len(queries) <= 1:
+            return await self.asearch(" ".join(queries), data_types, k_per_type, min_score, query_embeddings)
+
+        k = k_per_type or self.config.RETRIEVAL_K_PER_TYPE
+        data_types = self.resolve_data_types(data_types)
+        embeddings = await self._aembed_queries(queries, query_embeddings)
+        loop = asyncio.get_running_loop()
+        per_query = await asyncio.gather(*(
+            loop.run_in_executor(self._executor, copy_context().run, self._scored_hits, query, data_types, k,
+                                 embeddings.get(query))
+            for query in queries
+        ))
+        return self._apply_cutoffs(self._fuse(per_query, data_types, k), min_score)
+
+    def _distinct_queries(self, queries: List[str]) -> List[str]:
+        queries = list(dict.fromkeys(query.strip() for query in queries if query and query.strip()))
+        return queries[:self.config.MULTI_QUERY_MAX_TERMS]
+
+    def _fuse(self, per_query: List[Dict[str, List[Tuple[Document, float]]]], data_types: List[str],
+              k: int) -> Dict[str, List[Tuple[Document, float]]]:
+        """Fuse per-query rankings of each data type by rank, keeping each document's best score"""
+        hits = {}
+        for data_type in data_types:
+            rankings = [query_hits[data_type] for query_hits in per_query]
+            best = {}
+            for ranking in rankings:
+                for doc, score in ranking:
+                    doc_id = document_id(doc.metadata)
+                    best[doc_id] = max(best.get(doc_id, 0.0), score)
+            fused = reciprocal_rank_fusion(rankings, k, self.config.RRF_K)
+            hits[data_type] = [(doc, best[document_id(doc.metadata)]) for doc, _ in fused]
+        return hits
+
+    def _needs_embedding(self, query: str) -> bool:
+        """False for identifier queries that hybrid mode answers from the BM25 index"""
+        return not (self.config.RETRIEVAL_MODE == "hybrid" and self.has_lexical_index and is_identifier_query(query))
+
+    def embedding_queries(self, queries: List[str]) -> List[str]:
+        """The texts a search for these queries would embed, i.e. those needing a vector search"""
+        return [query for query in self._distinct_queries(queries) if self._needs_embedding(query)]
+
+    def _embed_queries(self, queries: List[str],
+                       known: Optional[Dict[str, List[float]]] = None) -> Dict[str, List[float]]:
+        """Embed the queries that need a vector search and are not in known in a single uncached call"""
+        known = known or {}
+        embeddings = {query: known[query] for query in queries if query in known}
+        missing = [query for query in self.embedding_queries(queries) if query not in known]
+        if missing:
+            embeddings.update(zip(missing, embed_queries(self.vector_store.embeddings, missing)))
+        return embeddings
+
+    async def _aembed_queries(self, queries: List[str],
+                              known: Optional[Dict[str, List[float]]] = None) -> Dict[str, List[float]]:
+        known = known or {}
+        embeddings = {query: known[query] for query in queries if query in known}
+        missing = [query for query in self.embedding_queries(queries) if query not in known]
+        if missing:
+            embeddings.update(zip(missing, await aembed_queries(self.vector_store.embeddings, missing)))
+        return embeddings
+
+    def _apply_cutoffs(self, hits: Dict[str, List[Tuple[Document, float]]],
+                       min_score: Optional[float]) -> Dict[str, List[Tuple[Document, float]]]:
+        min_score = self.config.RETRIEVAL_MIN_SCORE if min_score is None else min_score
+        hits = {data_type: [(doc, score) for doc, score in type_hits if score >= min_score]
+                for data_type, type_hits in hits.items()}
+        return cap_hits(hits, self.config.RETRIEVAL_MAX_K)
+
+    def _scored_hits(self, query: str, data_types: List[str], k: int,
+                     embedding: Optional[List[float]] = None) -> Dict[str, List[Tuple[Document, float]]]:
+        """Ranked hits per data type, scored by vector similarity and/or query term coverage"""
+        if self.config.RETRIEVAL_MODE != "hybrid" or not self.has_lexical_index:
+            return {data_type: [(doc, vector_relevance(distance)) for doc, distance in type_hits]
+                    for data_type, type_hits in self.vector_search(query, data_types, k, embedding).items()}
+
+        if is_identifier_query(query):
+            lexical_hits = self.lexical_search(query, data_types, k)
+            if any(lexical_hits.values()):
+                return {data_type: sorted(((doc, term_coverage(query, doc.page_content)) for doc, _ in type_hits),
+                                          key=itemgetter(1), reverse=True)
+                        for data_type, type_hits in lexical_hits.items()}
+
+        candidates = max(k, self.config.RRF_CANDIDATES)
+        vector_hits = self.vector_search(query, data_types, candidates, embedding)
+        lexical_hits = self.lexical_search(query, data_types, candidates)
+
+        results = {}
+        for data_type in data_types:
+            # Fused by rank; each hit is scored by the stronger of its two signals
+            relevance = {document_id(doc.metadata): term_coverage(query, doc.page_content)
+                         for doc, _ in lexical_hits[data_type]}
+            for doc, distance in vector_hits[data_type]:
+                doc_id = document_id(doc.metadata)
+                relevance[doc_id] = max(relevance.get(doc_id, 0.0), vector_relevance(distance))
+            fused = reciprocal_rank_fusion([vector_hits[data_type], lexical_hits[data_type]], k, self.config.RRF_K)
+            results[data_type] = [(doc, relevance[document_id(doc.metadata)]) for doc, _ in fused]
+        return results
+
+    def lexical_search(self, query: str, data_types: List[str], k: int) -> Dict[str, List[Tuple[Document, float]]]:
+        """Top-k BM25 hits and scores for each data type; needs no embedding call"""
+        start = time.perf_counter()
+        hits = self._lexical_hits(query, data_types, k)
+        record_search("lexical", sum(len(type_hits) for type_hits in hits.values()), time.perf_counter() - start)
+        return hits
+
+    def _lexical_hits(self, query: str, data_types: List[str], k: int) -> Dict[str, List[Tuple[Document, float]]]:
+        if isinstance(self.vector_store, ShardedVectorStore):
+            datasets = [name for data_type in data_types for name in self.datasets_for(data_type)]
+            by_dataset = self.vector_store.lexical_search_by_dataset(query, k, datasets)
+            # Highest BM25 score first
+            return {
+                data_type: heapq.nlargest(k, chain.from_iterable(by_dataset.get(name, [])
+                                                                 for name in self.datasets_for(data_type)),
+                                          key=itemgetter(1))
+                for data_type in data_types
+            }
+        return {data_type: self.lexical_index.search(query, k, self.datasets_for(data_type))
+                for data_type in data_types}
+
+    def vector_search(self, query: str, data_types: List[str], k: int,
+                      embedding: Optional[List[float]] = None) -> Dict[str, List[Tuple[Document, float]]]:
+        """Top-k documents and distances for each data type, embedding the query once unless given its embedding"""
+        if embedding is None:
+            embedding = self.vector_store.embeddings.embed_query(query)
+
+        start = time.perf_counter()
+        hits = self._vector_hits(embedding, data_types, k)
+        record_search("vector", sum(len(type_hits) for type_hits in hits.values()), time.perf_counter() - start)
+        return hits
+
+    def _vector_hits(self, embedding: List[float], data_types: List[str],
+                     k: int) -> Dict[str, List[Tuple[Document, float]]]:
+        if isinstance(self.vector_store, ShardedVectorStore):
+            return self._search_shards(embedding, data_types, k)
+
+        if isinstance(self.vector_store, FAISS):
+            embedding = np.asarray([embedding], dtype=np.float32)
+            return {data_type: self._search_faiss(embedding, data_type, k) for data_type in data_types}
+
+        return {
+            data_type: self.vector_store.similarity_search_by_vector_with_relevance_scores(
+                embedding, k=k, filter={"dataset": {"$in": self.datasets_for(data_type)}}
+            )
+            for data_type in data_types
+        }
+
+    def _search_shards(self, embedding: List[float], data_types: List[str],
+                       k: int) -> Dict[str, List[Tuple[Document, float]]]:
+        """Search every shard any requested type needs in one fan-out, then merge per type"""
+        datasets = [name for data_type in data_types for name in self.datasets_for(data_type)]
+        by_dataset = self.vector_store.search_by_dataset(embedding, k, datasets)
+        return {
+            data_type: merge_results((by_dataset.get(name, []) for name in self.datasets_for(data_type)), k)
+            for data_type in data_types
+        }
+
+    def _search_faiss(self, embedding: np.ndarray, data_type: str, k: int) -> List[Tuple[Document, float]]:
+        positions = self._type_positions(data_type)
+        if len(positions) == 0:
+            return []
+
+        index = self.vector_store.index
+        k = min(k, len(positions))
+        if isinstance(index, MmapFlatIndex):
+            distances, labels = index.search(embedding, k, positions=positions)
+        elif isinstance(index, faiss.IndexHNSW):
+            distances, labels = self._search_hnsw(index, embedding, data_type, positions, k)
+        else:
+            distances, labels = index.search(embedding, k, params=self._search_params(data_type, positions))
+
+        results = []
+        for distance, position in zip(distances[0], labels[0]):
+            if position == -1:
+                continue
+            doc_id = self.vector_store.index_to_docstore_id[int(position)]
+            results.append((self.vector_store.docstore.search(doc_id), float(distance)))
+        return results
+
+    def _search_hnsw(self, index: faiss.IndexHNSW, embedding: np.ndarray, data_type: str,
+                     positions: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Filtered HNSW search, or exact search over positions where the graph would come up short.
+
+        Only about efSearch * selectivity of the nodes a filtered HNSW search
+        visits are selected, so efSearch is raised to k / selectivity. Past
+        len(positions) that is more work than scanning the positions, and a
+        search that still returns fewer than k hits is redone exactly.
+        """
+        ef_search = max(index.hnsw.efSearch, -(-k * index.ntotal // len(positions)))
+        if ef_search >= len(positions):
+            return self._exact_search(index, embedding, positions, k)
+
+        params = faiss.SearchParametersHNSW(sel=self._selector(data_type, positions), efSearch=ef_search)
+        distances, labels = index.search(embedding, k, params=params)
+        if (labels[0] != -1).sum() < k:
+            return self._exact_search(index, embedding, positions, k)
+        return distances, labels
+
+    @staticmethod
+    def _exact_search(index: faiss.Index, embedding: np.ndarray, positions: np.ndarray,
+                      k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Squared L2 top-k over the vectors at positions, reconstructed block by block"""
+        query = np.asarray(embedding, dtype=np.float32)[0]
+        distances = np.concatenate([
+            ((index.reconstruct_batch(positions[start:start + SEARCH_BLOCK_ROWS]) - query) ** 2).sum(axis=1)
+            for start in range(0, len(positions), SEARCH_BLOCK_ROWS)
+        ])
+        top = np.argpartition(distances, k - 1)[:k] if k < len(distances) else np.arange(len(distances))
+        top = top[np.argsort(distances[top])]
+        return distances[top][None, :], positions[top][None, :]
+
+    def _selector(self, data_type: str, positions: np.ndarray) -> faiss.IDSelector:
+        if data_type not in self._selectors:
+            self._selectors[data_type] = faiss.IDSelectorBatch(positions)
+        return self._selectors[data_type]
+
+    def _search_params(self, data_type: str, positions: np.ndarray) -> faiss.SearchParameters:
+        """Search parameters that restrict an IVF or flat index to positions, keeping its nprobe"""
+        selector = self._selector(data_type, positions)
+
+        index = self.vector_store.index
+        try:
+            nprobe = faiss.extract_index_ivf(index).nprobe
+        except RuntimeError:
+            return faiss.SearchParameters(sel=selector)
+        return faiss.SearchParametersIVF(sel=selector, nprobe=nprobe)
+
+    def _type_positions(self, data_type: str) -> np.ndarray:
+        positions = self._dataset_positions()
+        arrays = [positions[name] for name in self.datasets_for(data_type) if name in positions]
+        if not arrays:
+            return np.empty(0, dtype=np.int64)
+        return np.sort(np.concatenate(arrays))
+
+    def _dataset_positions(self) -> Dict[str, np.ndarray]:
+        """FAISS positions grouped by dataset, read from the snapshot or from a docstore scan"""
+        if self._positions is not None:
+            return self._positions
+
+        docstore = self.vector_store.docstore
+        positions = docstore.dataset_positions() if hasattr(docstore, "dataset_positions") else None
+        if positions is None:
+            grouped = {}
+            for position, doc_id in self.vector_store.index_to_docstore_id.items():
+                doc = docstore.search(doc_id)
+                grouped.setdefault(doc.metadata.get("dataset", "unknown"), []).append(position)
+            positions = {name: np.asarray(items, dtype=np.int64) for name, items in grouped.items()}
+
+        self._positions = positions
+        return positions
+
+def reciprocal_rank_fusion(rankings: List[List[Tuple[Document, float]]], k: int,
+                           rrf_k: int = 60) -> List[Tuple[Document, float]]:
+    """Fuse ranked hit lists by summing 1 / (rrf_k + rank) per document, highest first"""
+    scores = {}
+    documents = {}
+    for ranking in rankings:
+        for rank, (doc, _) in enumerate(ranking, start=1):
+            doc_id = document_id(doc.metadata)
+            documents.setdefault(doc_id, doc)
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (rrf_k + rank)
+    best = heapq.nlargest(k, scores.items(), key=itemgetter(1))
+    return [(documents[doc_id], score) for doc_id, score in best]
+
+def vector_relevance(distance: float) -> float:
+    """Cosine similarity from a squared L2 distance between unit-length embeddings, clamped to [0, 1]"""
+    return min(1.0, max(0.0, 1.0 - distance / 2))
+
+def cap_hits(hits: Dict[str, List[Tuple[Document, float]]], max_k: int) -> Dict[str, List[Tuple[Document, float]]]:
+    """Keep the max_k best-scoring hits over all data types, preserving each type's order"""
+    ranked = [(score, data_type, i) for data_type, type_hits in hits.items() for i, (_, score) in enumerate(type_hits)]
+    if len(ranked) <= max_k:
+        return hits
+    kept = {(data_type, i) for _, data_type, i in heapq.nlargest(max_k, ranked, key=itemgetter(0))}
+    return {data_type: [hit for i, hit in enumerate(type_hits) if (data_type, i) in kept]
+            for data_type, type_hits in hits.items()}
@@ -0,0 +1,355 @@
+# server.py
+"""HTTP query service: the system initialized once per worker, serving concurrent queries.
+
+    python server.py                         # SERVER_HOST:SERVER_PORT with SERVER_WORKERS processes
+    python server.py --port 9000 --workers 4
+    python server.py --prepare-index         # build or update the index for running workers, then exit
+
+Endpoints:
+    POST /query    {"query": ..., "thread_id": optional, "stream": false}
+                   -> {"response", "cached", "trace"}; with "stream": true the
+                   workflow.astream events as JSON lines
+    GET  /healthz  200 while the process is up
+    GET  /readyz   200 while the worker accepts queries, 503 when its queue is
+                   full or it is shutting down
+    GET  /metrics  Prometheus text of the worker that answers
+
+The index is built or updated, with its memory-mapped snapshots, once
+before the workers start (the server always runs with VECTOR_STORE_MMAP).
+Workers never build or write it: each opens the snapshots read-only,
+sharing their pages, and they accept connections on the same port
+(SO_REUSEPORT). Each worker runs at most SERVER_MAX_ACTIVE_QUERIES queries
+and queues up to SERVER_MAX_QUEUED_QUERIES more; beyond that, or after
+waiting SERVER_QUEUE_TIMEOUT_SECONDS, a query gets a 503 with Retry-After.
+
+When a new index version lands on disk (e.g. from --prepare-index; checked
+every SERVER_RELOAD_POLL_SECONDS, or on SIGHUP) a worker opens it in the
+background and switches retrieval over; everything else (caches, LLM,
+embedding client) is kept. If the new version's snapshots are missing or
+out of date the worker keeps serving the old one. The old index's threads,
+files and connections are released once the queries that started on it
+have finished.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+import signal
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from aiohttp import web
+
+from app import initialize_system, open_index, response_cache_version
+from config import MedicalConfig
+from sharded_store import ShardedVectorStoreManager
+from vector_store import VectorStoreManager
+
+class Overloaded(Exception):
+    """No query slot is free and the wait queue is full, or the wait timed out"""
+
+class AdmissionControl:
+    """At most max_active queries at once, and at most max_queued waiting for a slot"""
+
+    def __init__(self, max_active: int, max_queued: int, timeout: float):
+        self.max_active = max_active
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self.active = 0
+        self.queued = 0
+        self.rejected = 0
+        self._semaphore = asyncio.Semaphore(max_active)
+
+    @property
+    def full(self) -> bool:
+        # Waiters count as queued until their acquire completes
+        return self.active + self.queued >= self.max_active + self.max_queued
+
+    @asynccontextmanager
+    async def slot(self):
+        if self.full:
+            self.rejected += 1
+            raise Overloaded(f"{self.active} queries running and {self.queued} queued")
+        self.queued += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise Overloaded(f"No query slot within {self.timeout:g}s")
+        finally:
+            self.queued -= 1
+
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._semaphore.release()
+
+def index_version_on_disk(config) -> str:
+    """Fingerprint of the persisted index, read from its manifests without loading it"""
+    if config.VECTOR_STORE_SHARDED:
+        managers = ShardedVectorStoreManager(None, config).managers
+        versions = [f"{name}:{manager.index_version()}" for name, manager in sorted(managers.items())]
+        return hashlib.sha256("\n".join(versions).encode()).hexdigest()
+    return VectorStoreManager(None, config).index_version()
+
+def serving_config():
+    """MedicalConfig with VECTOR_STORE_MMAP on, so the index is served from read-only snapshots"""
+    config = MedicalConfig()
+    config.VECTOR_STORE_MMAP = True
+    return config
+
+class QueryService:
+    """One worker's workflow, admission control and index reloads, exposed as an aiohttp app"""
+
+    def __init__(self, config=None):
+        self.config = config or serving_config()
+        # Read before opening, so a version that lands meanwhile is picked up by the next reload check
+        self.index_version = index_version_on_disk(self.config)
+        self.workflow, _ = initialize_system(self.config, read_only=True)
+        self.admission = None  # Created on startup, inside the server's event loop
+        self.reloads = 0
+        self.generation = 0  # Bumped by each reload
+        self._running = Counter()  # Generation -> queries running since it was loaded
+        self.shutting_down = False
+        self._reload_lock = None
+        self._watcher = None
+
+    def build_app(self, supervised: bool = False) -> web.Application:
+        app = web.Application()
+        app.add_routes([
+            web.post("/query", self.query),
+            web.get("/healthz", self.healthz),
+            web.get("/readyz", self.readyz),
+            web.get("/metrics", self.metrics)
+        ])
+
+        async def on_startup(app: web.Application):
+            self.admission = AdmissionControl(self.config.SERVER_MAX_ACTIVE_QUERIES,
+                                              self.config.SERVER_MAX_QUEUED_QUERIES,
+                                              self.config.SERVER_QUEUE_TIMEOUT_SECONDS)
+            self._reload_lock = asyncio.Lock()
+            loop = asyncio.get_running_loop()
+            loop.add_signal_handler(signal.SIGHUP, lambda: asyncio.ensure_future(self.reload_if_changed()))
+            if supervised:
+                # Ctrl-C reaches the whole process group; the supervisor turns it into SIGTERM
+                loop.add_signal_handler(signal.SIGINT, lambda: None)
+            if self.config.SERVER_RELOAD_POLL_SECONDS:
+                self._watcher = asyncio.ensure_future(self._watch_index())
+
+        async def on_shutdown(app: web.Application):
+            self.shutting_down = True
+            if self._watcher is not None:
+                self._watcher.cancel()
+
+        app.on_startup.append(on_startup)
+        app.on_shutdown.append(on_shutdown)
+        return app
+
+    async def query(self, request: web.Request) -> web.StreamResponse:
+        try:
+            body = await request.json()
+        except json.JSONDecodeError:
+            return web.json_response({"error": "Body must be JSON"}, status=400)
+        query = (body.get("query") or "").strip() if isinstance(body, dict) else ""
+        if not query:
+            return web.json_response({"error": "Missing query"}, status=400)
+        if self.shutting_down:
+            return web.json_response({"error": "Shutting down"}, status=503)
+
+        workflow = self.workflow
+        # A replaced index stays open while queries that started before the reload run
+        generation = self.generation
+        self._running[generation] += 1
+        try:
+            async with self.admission.slot():
+                if body.get("stream"):
+                    return await self._stream(request, workflow, query, body.get("thread_id"))
+                response, trace = await workflow.arun_traced(query, body.get("thread_id"))
+                return web.json_response({"response": response, "cached": trace.cached, "trace": trace.to_dict()})
+        except Overloaded as e:
+            return web.json_response({"error": f"Overloaded: {e}"}, status=503, headers={"Retry-After": "1"})
+        except Exception as e:
+            print(f"✗ Query failed: {e}")
+            return web.json_response({"error": str(e)}, status=500)
+        finally:
+            self._running[generation] -= 1
+
+    async def _stream(self, request: web.Request, workflow, query: str,
+                      thread_id: Optional[str]) -> web.StreamResponse:
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await response.prepare(request)
+        try:
+            async for event in workflow.astream(query, thread_id):
+                await response.write((json.dumps(event) + "\n").encode())
+        except ConnectionResetError:
+            # Client went away; returning frees its query slot
+            return response
+        except Exception as e:
+            # Headers are already sent, so the failure is reported in-band
+            print(f"✗ Query failed: {e}")
+            await response.write((json.dumps({"type": "error", "error": str(e)}) + "\n").encode())
+        await response.write_eof()
+        return response
+
+    async def healthz(self, request: web.Request) -> web.Response:
+        return web.json_response({"status": "ok", "pid": os.getpid()})
+
+    async def readyz(self, request: web.Request) -> web.Response:
+        ready = not self.shutting_down and not self.admission.full
+        return web.json_response({
+            "ready": ready,
+            "index_version": self.index_version,
+            "active": self.admission.active,
+            "queued": self.admission.queued,
+            "reloads": self.reloads
+        }, status=200 if ready else 503)
+
+    async def metrics(self, request: web.Request) -> web.Response:
+        gauges = [
+            ("medical_server_active_queries", "gauge", "Queries running in this worker", self.admission.active),
+            ("medical_server_queued_queries", "gauge", "Queries waiting for a slot in this worker",
+             self.admission.queued),
+            ("medical_server_rejected_total", "counter", "Queries refused with a 503 by this worker",
+             self.admission.rejected),
+            ("medical_server_reloads_total", "counter", "Index reloads by this worker", self.reloads)
+        ]
+        lines = [f"# HELP {name} {help_text}\n# TYPE {name} {kind}\n{name} {value}"
+                 for name, kind, help_text, value in gauges]
+        return web.Response(text=self.workflow.metrics.render_prometheus() + "\n".join(lines) + "\n",
+                            content_type="text/plain")
+
+    async def reload_if_changed(self) -> bool:
+        """Load the index again if its version on disk changed, then switch retrieval over to it"""
+        loop = asyncio.get_running_loop()
+        async with self._reload_lock:
+            version = await loop.run_in_executor(None, index_version_on_disk, self.config)
+            if version == self.index_version:
+                return False
+
+            print(f"New index version {version[:12]}, reloading...")
+            start = time.perf_counter()
+            agents = self.workflow.agents
+            try:
+                vector_store, lexical_index, index_version = await loop.run_in_executor(
+                    None, open_index, agents.vector_store.embeddings, self.config
+                )
+            except Exception as e:
+                print(f"✗ Reload failed, still serving index {self.index_version[:12]}: {e}")
+                return False
+
+            retired = agents.use_index(vector_store, lexical_index)
+            if self.workflow.response_cache is not None:
+                self.workflow.response_cache.set_version(response_cache_version(self.config, index_version))
+            self.index_version = version
+            self.reloads += 1
+            self.generation += 1
+            asyncio.ensure_future(self._close_when_idle(retired, self.generation - 1))
+            print(f"✓ Reloaded index {version[:12]} in {time.perf_counter() - start:.1f}s")
+            return True
+
+    async def _close_when_idle(self, retriever, generation: int):
+        """Close a replaced retriever and its index once the queries started before the reload finish"""
+        while self._running[generation] > 0:
+            await asyncio.sleep(0.5)
+        self._running.pop(generation, None)
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, retriever.close)
+        except Exception as e:
+            print(f"⚠ Closing the previous index failed: {e}")
+
+    async def _watch_index(self):
+        while True:
+            await asyncio.sleep(self.config.SERVER_RELOAD_POLL_SECONDS)
+            try:
+                await self.reload_if_changed()
+            except Exception as e:
+                print(f"⚠ Index version check failed: {e}")
+
+def serve(host: str, port: int, supervised: bool = False):
+    """Run one worker until SIGTERM (or SIGINT when unsupervised), letting running queries finish"""
+    service = QueryService()
+    print(f"✓ Worker {os.getpid()} serving on http://{host}:{port} (index {service.index_version[:12]})")
+    web.run_app(service.build_app(supervised), host=host, port=port, reuse_port=supervised,
+                shutdown_timeout=service.config.SERVER_SHUTDOWN_TIMEOUT_SECONDS, print=None)
+
+def prepare_index():
+    """Build or update the index and write the memory-mapped snapshots the workers open"""
+    workflow, _ = initialize_system(serving_config())
+    workflow.agents.retriever.close()
+
+def supervise(host: str, port: int, workers: int):
+    """Prepare the index once, then run workers sharing the port, restarting any that die"""
+    # Fresh interpreters: forking after the index threads and connections exist is not safe
+    context = multiprocessing.get_context("spawn")
+
+    prepare = context.Process(target=prepare_index, name="prepare-index")
+    prepare.start()
+    prepare.join()
+    if prepare.exitcode != 0:
+        raise SystemExit("✗ Index preparation failed")
+
+    processes = {}
+
+    def start(number: int):
+        processes[number] = context.Process(target=serve, args=(host, port, True), name=f"worker-{number}")
+        processes[number].start()
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for process in processes.values():
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGTERM)
+
+    def forward_reload(signum, frame):
+        for process in processes.values():
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGHUP)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGHUP, forward_reload)
+
+    for number in range(workers):
+        start(number)
+    while not stopping:
+        time.sleep(1)
+        for number, process in list(processes.items()):
+            if not process.is_alive() and not stopping:
+                print(f"✗ Worker {number} exited with code {process.exitcode}, restarting")
+                start(number)
+    for process in processes.values():
+        process.join()
+    print("✓ All workers stopped")
+
+def main():
+    config = MedicalConfig()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default=config.SERVER_HOST)
+    parser.add_argument("--port", type=int, default=config.SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=config.SERVER_WORKERS)
+    parser.add_argument("--prepare-index", action="store_true",
+                        help="Build or update the index for the running workers, then exit")
+    args = parser.parse_args()
+
+    if args.prepare_index:
+        prepare_index()
+        return
+
+    if args.workers <= 1:
+        prepare_index()
+        serve(args.host, args.port)
+        return
+
+    supervise(args.host, args.port, args.workers)
+
+if __name__ == "__main__":
+    main()
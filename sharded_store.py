@@ -0,0 +1,189 @@
+import copy
+import hashlib
+import heapq
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from operator import itemgetter
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from langchain.schema import Document
+from langchain_community.vectorstores import FAISS
+
+from mmap_store import close_store
+from vector_store import IndexNotReady, VectorStoreManager
+
+class ShardedVectorStore:
+    """Per-dataset vector stores searched in parallel, with results merged by distance.
+
+    Shards are loaded on first use, unless their manager already holds the
+    store (e.g. just built). Each shard returns its own top-k, and
+    the global top-k is taken over their raw distances, so the result is
+    the same as searching one index holding every shard's documents.
+    """
+
+    def __init__(self, embeddings, managers: Dict[str, VectorStoreManager], max_workers: int = 8):
+        self.embeddings = embeddings
+        self.managers = managers
+        self._shards = {name: manager.vector_store for name, manager in managers.items()
+                        if manager.vector_store is not None}
+        self._locks = {name: threading.Lock() for name in managers}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="shard-search")
+
+    @property
+    def datasets(self) -> List[str]:
+        return list(self.managers)
+
+    def index_version(self) -> str:
+        """Combined fingerprint of every shard's index"""
+        versions = [f"{name}:{manager.index_version()}" for name, manager in sorted(self.managers.items())]
+        return hashlib.sha256("\n".join(versions).encode()).hexdigest()
+
+    def shard(self, dataset_name: str):
+        """Vector store of one dataset, loading it on first use"""
+        if dataset_name not in self._shards:
+            with self._locks[dataset_name]:
+                if dataset_name not in self._shards:
+                    print(f"Loading shard {dataset_name}...")
+                    self._shards[dataset_name] = self.managers[dataset_name].load_vector_store()
+        return self._shards[dataset_name]
+
+    def add_shard(self, dataset_name: str, manager: VectorStoreManager):
+        """Register (or replace) a shard; unless its manager holds the store, it is loaded on its next search"""
+        self._locks.setdefault(dataset_name, threading.Lock())
+        self.managers[dataset_name] = manager
+        if manager.vector_store is not None:
+            self._shards[dataset_name] = manager.vector_store
+        else:
+            self._shards.pop(dataset_name, None)
+
+    def close(self):
+        """Stop the search threads and release every shard's files and BM25 connection"""
+        self._executor.shutdown()
+        for manager in self.managers.values():
+            manager.close()
+        for store in self._shards.values():
+            close_store(store)
+
+    def search_by_dataset(self, embedding: List[float], k: int = 4,
+                          datasets: Optional[List[str]] = None) -> Dict[str, List[Tuple[Document, float]]]:
+        """Top-k documents and distances from each shard, searched concurrently"""
+        names = [name for name in (datasets or self.managers) if name in self.managers]
+        futures = {name: self._executor.submit(self._search_shard, name, embedding, k) for name in names}
+        return {name: future.result() for name, future in futures.items()}
+
+    @property
+    def has_lexical_index(self) -> bool:
+        return any(manager.lexical_index is not None for manager in self.managers.values())
+
+    def lexical_search_by_dataset(self, query: str, k: int = 4,
+                                  datasets: Optional[List[str]] = None) -> Dict[str, List[Tuple[Document, float]]]:
+        """Top-k BM25 hits from each shard's inverted index, searched concurrently"""
+        names = [name for name in (datasets or self.managers)
+                 if name in self.managers and self.managers[name].lexical_index is not None]
+        futures = {name: self._executor.submit(self.managers[name].lexical_index.search, query, k)
+                   for name in names}
+        return {name: future.result() for name, future in futures.items()}
+
+    def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4,
+                                               datasets: Optional[List[str]] = None) -> List[Tuple[Document, float]]:
+        results = self.search_by_dataset(embedding, k, datasets)
+        return merge_results(results.values(), k)
+
+    def similarity_search_with_score(self, query: str, k: int = 4,
+                                     datasets: Optional[List[str]] = None) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self.embeddings.embed_query(query), k, datasets)
+
+    def similarity_search(self, query: str, k: int = 4, datasets: Optional[List[str]] = None) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, datasets)]
+
+    def _search_shard(self, dataset_name: str, embedding: List[float], k: int) -> List[Tuple[Document, float]]:
+        store = self.shard(dataset_name)
+        if isinstance(store, FAISS):
+            return store.similarity_search_with_score_by_vector(embedding, k)
+        return store.similarity_search_by_vector_with_relevance_scores(embedding, k)
+
+def merge_results(results, k: int) -> List[Tuple[Document, float]]:
+    """Global top-k of several (document, distance) lists, smallest distance first"""
+    return heapq.nsmallest(k, chain.from_iterable(results), key=itemgetter(1))
+
+class ShardedVectorStoreManager:
+    """One VectorStoreManager per DATASET_CONFIGS key, persisted under VECTOR_STORE_PATH/SHARD_DIR/<dataset>.
+
+    Every shard has its own manifest, so a changed dataset is updated or
+    rebuilt without touching the others.
+    """
+
+    def __init__(self, embeddings, config):
+        self.embeddings = embeddings
+        self.config = config
+        self.managers = {
+            name: VectorStoreManager(embeddings, self._shard_config(name), dataset_names=[name])
+            for name in config.DATASET_CONFIGS
+        }
+
+    def _shard_config(self, dataset_name: str):
+        shard_config = copy.copy(self.config)
+        shard_config.VECTOR_STORE_PATH = str(Path(self.config.VECTOR_STORE_PATH) / self.config.SHARD_DIR / dataset_name)
+        return shard_config
+
+    def prepare(self, data_loader) -> ShardedVectorStore:
+        """Bring every shard up to date with its dataset files and return the store over them.
+
+        Current shards are left on disk until a search needs them; stale ones
+        are updated (or rebuilt) and kept in memory, rather than read back on
+        their first search.
+        """
+        ready = {}
+
+        for name, manager in self.managers.items():
+            manifest = data_loader.build_manifest([name])
+            if not manifest.files:
+                if manager.index_exists():
+                    print(f"⚠ Dataset {name} has no files, skipping its shard")
+                continue
+
+            try:
+                if manager.is_index_current(manifest):
+                    pass  # Loaded on its first search
+                elif manager.index_exists() and self.config.INDEX_UPDATE_MODE == "incremental":
+                    print(f"⚠ Shard {name} is stale, updating changed files...")
+                    manager.update_vector_store(data_loader, manifest)
+                else:
+                    print(f"Building shard {name}...")
+                    manager.build_vector_store(data_loader.iter_document_batches(dataset_names=[name]), manifest)
+                # Read-only loads (e.g. server workers) open what this writes
+                manager.prepare_read_only()
+            except Exception as e:
+                print(f"✗ Failed to prepare shard {name}: {e}")
+                continue
+
+            ready[name] = manager
+
+        print(f"✓ {len(ready)} vector store shards ready")
+        return ShardedVectorStore(self.embeddings, ready, self.config.SHARD_SEARCH_WORKERS)
+
+    def open(self) -> ShardedVectorStore:
+        """Every shard on disk opened read-only, as prepare() left it; nothing is built or written.
+
+        Raises IndexNotReady if there are no shards, or a shard's snapshot is
+        missing or older than its index.
+        """
+        ready = {}
+        for name, manager in self.managers.items():
+            if manager.index_exists():
+                manager.load_vector_store(read_only=True)
+                ready[name] = manager
+        if not ready:
+            raise IndexNotReady(f"No vector store shards under {Path(self.config.VECTOR_STORE_PATH) / self.config.SHARD_DIR}")
+        print(f"✓ {len(ready)} vector store shards opened")
+        return ShardedVectorStore(self.embeddings, ready, self.config.SHARD_SEARCH_WORKERS)
+
+    def rebuild_shard(self, data_loader, dataset_name: str, store: Optional[ShardedVectorStore] = None):
+        """Re-embed one dataset into its shard from scratch"""
+        manager = self.managers[dataset_name]
+        manager.build_vector_store(data_loader.iter_document_batches(dataset_names=[dataset_name]),
+                                   data_loader.build_manifest([dataset_name]))
+        if store is not None:
+            store.add_shard(dataset_name, manager)
@@ -1,18 +1,43 @@
 # state.py
-from typing import TypedDict, List, Dict, Annotated
-import operator
+from typing import TypedDict, List, Dict, Annotated, Optional
 
+def extend_or_reset(existing: Optional[List], new: Optional[List]) -> List:
+    """Concatenate list updates from parallel nodes; None resets the field for a new query"""
+    if new is None:
+        return []
+    return (existing or []) + new
+
+def merge_or_reset(existing: Optional[Dict], new: Optional[Dict]) -> Dict:
+    """Merge dict updates from parallel nodes; None resets the field for a new query"""
+    if new is None:
+        return {}
+    return {**(existing or {}), **new}
+
+# Accumulated fields use list/dict, which the graph can instantiate as empty initial values
 class MedicalState(TypedDict):
     query: str
     query_analysis: Dict
-    patient_data: Annotated[List[Dict], operator.add]
-    imaging_data: Annotated[List[Dict], operator.add]
-    lab_results: Annotated[List[Dict], operator.add]
-    clinical_notes: Annotated[List[Dict], operator.add]
-    genomic_data: Annotated[List[Dict], operator.add]
-    pathology_data: Annotated[List[Dict], operator.add]
-    cardiology_data: Annotated[List[Dict], operator.add]
-    structured_data: Annotated[Dict, operator.add]
+    query_embeddings: Dict  # Search query -> vector computed ahead of retrieval (batch runs)
+    patient_data: Annotated[list[Dict], extend_or_reset]
+    imaging_data: Annotated[list[Dict], extend_or_reset]
+    lab_results: Annotated[list[Dict], extend_or_reset]
+    clinical_notes: Annotated[list[Dict], extend_or_reset]
+    genomic_data: Annotated[list[Dict], extend_or_reset]
+    pathology_data: Annotated[list[Dict], extend_or_reset]
+    cardiology_data: Annotated[list[Dict], extend_or_reset]
+    structured_data: Annotated[dict, merge_or_reset]
     final_response: str
-    intermediate_results: Annotated[List[Dict], operator.add]
-    search_results: Annotated[List[Dict], operator.add]
+    intermediate_results: Annotated[list[Dict], extend_or_reset]
+    search_results: Annotated[list[Dict], extend_or_reset]
+
+# Fields that accumulate across nodes and must start empty for every query
+ACCUMULATED_FIELDS = [
+    name for name, hint in MedicalState.__annotations__.items()
+    if getattr(hint, "__metadata__", None) and hint.__metadata__[0] in (extend_or_reset, merge_or_reset)
+]
+
+def initial_state(query: str) -> Dict:
+    """Graph input for a new query, clearing anything a reused thread accumulated before"""
+    state = {"query": query, "query_analysis": {}, "query_embeddings": {}, "final_response": ""}
+    state.update({field: None for field in ACCUMULATED_FIELDS})
+    return state
@@ -0,0 +1,28 @@
+import json
+import re
+
+from langchain_community.chat_models.fake import FakeListChatModel
+
+from agents import MedicalAgents
+from config import MedicalConfig
+from workflow import MedicalWorkflow
+
+def offered_data_types(agents):
+    """data_types_needed values the query analyzer prompt lets the LLM choose from"""
+    chain, inputs = agents._query_analyzer_chain({"query": "diabetic retinopathy fundus images"})
+    prompt = chain.first.format(**inputs)
+    return json.loads(re.search(r'"data_types_needed": (\[.*?\])', prompt).group(1))
+
+def test_every_dataset_is_reachable_from_the_analyzer():
+    config = MedicalConfig()
+    agents = MedicalAgents(FakeListChatModel(responses=["{}"]), None, config)
+    offered = offered_data_types(agents)
+    data_types = agents.retriever.resolve_data_types(offered)
+    reachable = {name for data_type in data_types for name in agents.retriever.datasets_for(data_type)}
+    assert reachable == set(config.DATASET_CONFIGS)
+
+def test_every_data_type_routes_to_an_analysis():
+    config = MedicalConfig()
+    agents = MedicalAgents(FakeListChatModel(responses=["{}"]), None, config)
+    routed = {data_type for _, data_types in MedicalWorkflow.ANALYSIS_ROUTES.values() for data_type in data_types}
+    assert set(offered_data_types(agents)) <= routed
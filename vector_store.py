@@ -1,48 +1,466 @@
-# vector_store.py
 from langchain_community.vectorstores import FAISS, Chroma
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain.schema import Document
-from typing import List, Dict
+from typing import List, Dict, Optional, Iterable
+from pathlib import Path
+import hashlib
+import inspect
 import os
+import shutil
+import faiss
+import numpy as np
+from manifest import DatasetManifest
+from data_loader import rebatch
+from embedding_cache import CachedEmbeddings
+from embedding_driver import BatchedEmbeddings
+from mmap_store import close_store, export_mmap_store, load_mmap_store, snapshot_version
+from bm25 import BM25Index
+
+# Newer langchain-community refuses to unpickle index.pkl without this flag; the pinned 0.0.20
+# has no such parameter and passes unknown keywords on to FAISS.__init__, which rejects them
+FAISS_LOAD_KWARGS = (
+    {"allow_dangerous_deserialization": True}
+    if "allow_dangerous_deserialization" in inspect.signature(FAISS.load_local).parameters else {}
+)
+
+def document_id(metadata: Dict) -> str:
+    """Stable id for a row document, derived from its source file and row"""
+    key = f"{metadata.get('source_file')}:{metadata.get('row_index')}"
+    return hashlib.sha1(key.encode()).hexdigest()
+
+class IndexRebuildRequired(Exception):
+    """Raised when an incremental change cannot be applied to the existing index"""
+
+class IndexNotReady(Exception):
+    """Raised when a read-only load finds no index, or no snapshot of its current version"""
+
+def create_faiss_index(sample: np.ndarray, config) -> faiss.Index:
+    """Create the FAISS index selected by FAISS_INDEX_TYPE, trained on sample if needed"""
+    dim = sample.shape[1]
+    index_type = config.FAISS_INDEX_TYPE
+    
+    if index_type == "flat":
+        index = faiss.IndexFlatL2(dim)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, config.FAISS_HNSW_M)
+        index.hnsw.efConstruction = config.FAISS_EF_CONSTRUCTION
+    elif index_type in ("ivf_flat", "ivf_pq"):
+        # k-means wants ~39 training points per centroid
+        nlist = max(1, min(config.FAISS_NLIST, len(sample) // 39))
+        if index_type == "ivf_pq" and len(sample) >= 2 ** config.FAISS_PQ_NBITS:
+            index = faiss.index_factory(dim, f"IVF{nlist},PQ{config.FAISS_PQ_M}x{config.FAISS_PQ_NBITS}")
+        else:
+            if index_type == "ivf_pq":
+                print(f"⚠ {len(sample)} vectors are too few to train PQ codes, using IVF-Flat")
+            index = faiss.index_factory(dim, f"IVF{nlist},Flat")
+        print(f"Training {index_type} index ({nlist} lists) on {len(sample)} vectors...")
+        index.train(sample)
+    else:
+        raise ValueError(f"Unknown FAISS_INDEX_TYPE: {index_type}")
+    
+    tune_faiss_index(index, config)
+    return index
+
+def tune_faiss_index(index: faiss.Index, config):
+    """Apply search-time parameters (nprobe/efSearch), which are not persisted with the index.
+    
+    FAISS_EF_SEARCH only holds for unfiltered searches. An HNSW search restricted
+    to some datasets keeps just the selected nodes among those it visits, and on
+    faiss 1.7 it returned as few as 126 of k=300 hits for a quarter of the index
+    (none at all for some). MedicalRetriever raises efSearch to k / selectivity
+    for such searches, and scans the selected vectors exactly when that would
+    visit more nodes than were selected or still comes up short.
+    """
+    if not isinstance(index, faiss.Index):
+        return  # MmapFlatIndex, exact search
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = config.FAISS_EF_SEARCH
+        return
+    try:
+        faiss.extract_index_ivf(index).nprobe = config.FAISS_NPROBE
+    except RuntimeError:
+        pass  # Flat index, nothing to tune
 
 class VectorStoreManager:
-    def __init__(self, embeddings, config):
+    def __init__(self, embeddings, config, dataset_names: Optional[List[str]] = None):
         self.embeddings = embeddings
         self.config = config
+        self.dataset_names = dataset_names  # Datasets this store indexes; None for all
         self.vector_store = None
+        self._lexical_index = None
+    
+    @property
+    def manifest_path(self) -> Path:
+        return Path(self.config.VECTOR_STORE_PATH) / self.config.MANIFEST_FILE
+    
+    @property
+    def mmap_path(self) -> Path:
+        return Path(self.config.VECTOR_STORE_PATH) / self.config.MMAP_SNAPSHOT_DIR
+    
+    @property
+    def lexical_index(self) -> Optional[BM25Index]:
+        """BM25 index kept alongside the vector store, or None if USE_BM25_INDEX is off"""
+        if self._lexical_index is None and self.config.USE_BM25_INDEX:
+            self._lexical_index = BM25Index(Path(self.config.VECTOR_STORE_PATH) / self.config.BM25_INDEX_FILE)
+        return self._lexical_index
+    
+    def close(self):
+        """Release the loaded store's files and the BM25 connection"""
+        if self.vector_store is not None:
+            close_store(self.vector_store)
+        if self._lexical_index is not None:
+            self._lexical_index.close()
+    
+    def index_version(self) -> str:
+        """Fingerprint of the persisted index's inputs; changes whenever its contents do"""
+        manifest = DatasetManifest.load(self.manifest_path)
+        return manifest.fingerprint() if manifest is not None else "unversioned"
+    
+    def index_exists(self) -> bool:
+        """Check whether a persisted vector store is present on disk"""
+        store_path = Path(self.config.VECTOR_STORE_PATH)
+        if self.config.VECTOR_STORE_TYPE == "faiss":
+            return (store_path / "index.faiss").exists() and (store_path / "index.pkl").exists()
+        return store_path.exists() and any(store_path.iterdir())
+    
+    def is_index_current(self, manifest: DatasetManifest) -> bool:
+        """Check whether the persisted vector store was built from the given files"""
+        if not self.index_exists():
+            return False
+        
+        saved_manifest = DatasetManifest.load(self.manifest_path)
+        if saved_manifest is None:
+            # Index predates manifests; adopt it rather than forcing a full rebuild.
+            # Its documents have no stable ids, so mark it as not incrementally updatable.
+            print("⚠ Vector store has no manifest, assuming it matches current datasets")
+            manifest.version = 1
+            manifest.save(self.manifest_path)
+            return True
+        
+        if not manifest.matches(saved_manifest):
+            return False
+        
+        # Files that were only touched got re-hashed; record their new mtimes
+        if manifest.files != saved_manifest.files:
+            manifest.version = saved_manifest.version
+            manifest.save(self.manifest_path)
+        return True
     
-    def create_vector_store(self, all_documents: Dict[str, List[Document]]):
+    def create_vector_store(self, all_documents: Dict[str, List[Document]],
+                            manifest: Optional[DatasetManifest] = None):
         """Create vector store from all documents"""
-        # Combine all documents
-        all_docs = []
-        for dataset_name, documents in all_documents.items():
-            all_docs.extend(documents)
+        batch_size = self.config.INGEST_BATCH_SIZE
+        batches = (
+            documents[start:start + batch_size]
+            for documents in all_documents.values()
+            for start in range(0, len(documents), batch_size)
+        )
+        return self.build_vector_store(batches, manifest)
+    
+    def build_vector_store(self, document_batches: Iterable[List[Document]],
+                           manifest: Optional[DatasetManifest] = None):
+        """Create vector store by embedding and indexing one document batch at a time"""
+        print("Creating vector store...")
+        self.vector_store = None
+        total = 0
         
-        print(f"Creating vector store with {len(all_docs)} total documents...")
+        if self.lexical_index is not None:
+            self.lexical_index.clear()
+            document_batches = self._index_lexically(document_batches)
+        
+        if self.config.VECTOR_STORE_TYPE != "faiss":
+            self.vector_store = Chroma(
+                persist_directory=self.config.VECTOR_STORE_PATH,
+                embedding_function=self.embeddings
+            )
+            # Start from an empty collection rather than appending to a previous build
+            self.vector_store.delete_collection()
+            self.vector_store = Chroma(
+                persist_directory=self.config.VECTOR_STORE_PATH,
+                embedding_function=self.embeddings
+            )
         
         if self.config.VECTOR_STORE_TYPE == "faiss":
-            self.vector_store = FAISS.from_documents(all_docs, self.embeddings)
-            self.vector_store.save_local(self.config.VECTOR_STORE_PATH)
+            total = self._build_faiss_store(document_batches)
         else:
-            self.vector_store = Chroma.from_documents(
-                all_docs, 
-                self.embeddings, 
-                persist_directory=self.config.VECTOR_STORE_PATH
-            )
+            for documents in document_batches:
+                if not documents:
+                    continue
+                self.vector_store.add_documents(documents, ids=[document_id(doc.metadata) for doc in documents])
+                total += len(documents)
         
-        print("✓ Vector store created successfully!")
+        if self.vector_store is None:
+            raise ValueError("No documents found to build the vector store from")
+        
+        if manifest is not None:
+            manifest.compute_hashes()
+        self._persist(manifest)
+        if manifest is not None:
+            manifest.save(self.manifest_path)
+        
+        print(f"✓ Vector store created successfully with {total} documents!")
+        self._report_embedding_stats()
         return self.vector_store
     
-    def load_vector_store(self):
-        """Load existing vector store"""
-        if self.config.VECTOR_STORE_TYPE == "faiss":
+    def _index_lexically(self, document_batches: Iterable[List[Document]]) -> Iterable[List[Document]]:
+        """Pass batches through, adding each to the BM25 index on the way"""
+        for documents in document_batches:
+            if documents:
+                self.lexical_index.add(documents, [document_id(doc.metadata) for doc in documents])
+            yield documents
+    
+    def _build_faiss_store(self, document_batches: Iterable[List[Document]]) -> int:
+        """Embed batches into a FAISS index of FAISS_INDEX_TYPE.
+        
+        Index types that need training buffer the first FAISS_TRAIN_SAMPLE_SIZE
+        vectors, train on them, then add them and stream the rest.
+        """
+        needs_training = self.config.FAISS_INDEX_TYPE in ("ivf_flat", "ivf_pq")
+        pending = []
+        pending_count = 0
+        total = 0
+        
+        for documents in document_batches:
+            if not documents:
+                continue
+            vectors = np.asarray(self.embeddings.embed_documents([doc.page_content for doc in documents]),
+                                 dtype=np.float32)
+            total += len(documents)
+            
+            if self.vector_store is not None:
+                self._add_embedded(documents, vectors)
+                continue
+            
+            pending.append((documents, vectors))
+            pending_count += len(documents)
+            if needs_training and pending_count < self.config.FAISS_TRAIN_SAMPLE_SIZE:
+                continue
+            self._flush_pending(pending)
+            pending = []
+        
+        if pending:
+            self._flush_pending(pending)
+        return total
+    
+    def _flush_pending(self, pending):
+        """Create the FAISS store using the buffered vectors as training sample, then add them"""
+        sample = np.concatenate([vectors for _, vectors in pending])
+        index = create_faiss_index(sample[:self.config.FAISS_TRAIN_SAMPLE_SIZE], self.config)
+        self.vector_store = FAISS(self.embeddings, index, InMemoryDocstore(), {})
+        for documents, vectors in pending:
+            self._add_embedded(documents, vectors)
+    
+    def _add_embedded(self, documents: List[Document], vectors: np.ndarray):
+        self.vector_store.add_embeddings(
+            list(zip([doc.page_content for doc in documents], vectors)),
+            metadatas=[doc.metadata for doc in documents],
+            ids=[document_id(doc.metadata) for doc in documents]
+        )
+    
+    def _persist(self, manifest: Optional[DatasetManifest] = None):
+        """Save a FAISS store, plus its read-only snapshot (tagged with the index version) when
+        VECTOR_STORE_MMAP is on; with it off, an older snapshot is deleted rather than left stale"""
+        if self.config.VECTOR_STORE_TYPE != "faiss":
+            return  # Chroma persists on write
+        self.vector_store.save_local(self.config.VECTOR_STORE_PATH)
+        if self.config.VECTOR_STORE_MMAP:
+            version = manifest.fingerprint() if manifest is not None else "unversioned"
+            export_mmap_store(self.vector_store, self.mmap_path, version)
+        else:
+            shutil.rmtree(self.mmap_path, ignore_errors=True)
+    
+    def load_vector_store(self, read_only: Optional[bool] = None):
+        """Load existing vector store.
+        
+        With read_only (default VECTOR_STORE_MMAP) a FAISS store is opened from its
+        memory-mapped snapshot, so worker processes share pages and skip unpickling.
+        Such a store cannot be updated, and nothing is written: IndexNotReady is
+        raised if there is no index or its snapshot is missing or out of date
+        (prepare_read_only writes it).
+        """
+        if read_only is None:
+            read_only = self.config.VECTOR_STORE_MMAP
+        
+        if read_only and not self.index_exists():
+            raise IndexNotReady(f"No vector store at {self.config.VECTOR_STORE_PATH}")
+        
+        if self.config.VECTOR_STORE_TYPE == "faiss" and read_only:
+            version = self.index_version()
+            if snapshot_version(self.mmap_path) != version:
+                raise IndexNotReady(f"Memory-mapped snapshot at {self.mmap_path} is missing or "
+                                    f"not of index version {version[:12]}")
+            self.vector_store = load_mmap_store(self.mmap_path, self.embeddings)
+            tune_faiss_index(self.vector_store.index, self.config)
+        elif self.config.VECTOR_STORE_TYPE == "faiss":
             self.vector_store = FAISS.load_local(
                 self.config.VECTOR_STORE_PATH, 
                 self.embeddings, 
-                allow_dangerous_deserialization=True
+                **FAISS_LOAD_KWARGS
             )
+            tune_faiss_index(self.vector_store.index, self.config)
         else:
             self.vector_store = Chroma(
                 persist_directory=self.config.VECTOR_STORE_PATH,
                 embedding_function=self.embeddings
             )
+        
+        if not read_only and self.lexical_index is not None and len(self.lexical_index) == 0:
+            self._backfill_lexical_index()
+        return self.vector_store
+    
+    def prepare_read_only(self):
+        """Write what a read-only load opens but never writes: the BM25 index of a store that
+        predates it and, with VECTOR_STORE_MMAP, a snapshot of the current index version.
+        
+        Called by whoever builds or updates the index. The store loaded to write
+        them is dropped, so the next load_vector_store() opens the snapshot.
+        """
+        version = self.index_version()
+        snapshot_stale = (self.config.VECTOR_STORE_TYPE == "faiss" and self.config.VECTOR_STORE_MMAP
+                          and snapshot_version(self.mmap_path) != version)
+        if not snapshot_stale and not (self.lexical_index is not None and len(self.lexical_index) == 0):
+            return
+        self.load_vector_store(read_only=False)
+        if snapshot_stale:
+            print("Creating memory-mapped snapshot of vector store...")
+            export_mmap_store(self.vector_store, self.mmap_path, version)
+        self.vector_store = None
+    
+    def _backfill_lexical_index(self):
+        """Build the BM25 index from the documents of a store that predates it, without re-embedding"""
+        print("Building BM25 index from stored documents...")
+        batch_size = self.config.INGEST_BATCH_SIZE
+        if self.config.VECTOR_STORE_TYPE == "faiss":
+            docstore = self.vector_store.docstore
+            documents = (docstore.search(doc_id) for doc_id in self.vector_store.index_to_docstore_id.values())
+        else:
+            result = self.vector_store.get(include=["documents", "metadatas"])
+            documents = (Document(page_content=content, metadata=metadata)
+                         for content, metadata in zip(result["documents"], result["metadatas"]))
+        
+        total = 0
+        for batch in rebatch(([doc] for doc in documents), batch_size):
+            self.lexical_index.add(batch, [document_id(doc.metadata) for doc in batch])
+            total += len(batch)
+        print(f"✓ BM25 index built with {total} documents")
+    
+    def update_vector_store(self, data_loader, manifest: DatasetManifest):
+        """Re-index only the dataset files that changed since the last build"""
+        previous = DatasetManifest.load(self.manifest_path)
+        if not self.index_exists() or previous is None or not manifest.is_compatible(previous):
+            print("⚠ Existing vector store cannot be updated incrementally, rebuilding...")
+            return self.build_vector_store(data_loader.iter_document_batches(dataset_names=self.dataset_names), manifest)
+        
+        self.load_vector_store(read_only=False)
+        diff = manifest.diff(previous)
+        if diff.is_empty:
+            manifest.save(self.manifest_path)
+            return self.vector_store
+        
+        print(f"Updating vector store: {len(diff.added)} added, "
+              f"{len(diff.modified)} modified, {len(diff.removed)} removed files")
+        
+        try:
+            added, removed = self._apply_diff(data_loader, manifest, diff)
+        except IndexRebuildRequired as e:
+            print(f"⚠ {e}, rebuilding...")
+            return self.build_vector_store(data_loader.iter_document_batches(dataset_names=self.dataset_names), manifest)
+        
+        manifest.compute_hashes()
+        self._persist(manifest)
+        manifest.save(self.manifest_path)
+        
+        print(f"✓ Vector store updated: {added} documents embedded, {removed} removed")
+        self._report_embedding_stats()
         return self.vector_store
+    
+    def _apply_diff(self, data_loader, manifest: DatasetManifest, diff) -> tuple:
+        """Delete vectors of removed/changed rows and add new ones; returns (added, removed)"""
+        existing = self._documents_by_source(diff.modified + diff.removed)
+        added, removed = 0, 0
+        
+        for file_path in diff.removed:
+            removed += self._delete_documents(list(existing.get(file_path, {})))
+        
+        for file_path in diff.added + diff.modified:
+            dataset_name = manifest.files[file_path]["dataset"]
+            old_contents = existing.get(file_path, {})
+            seen_ids = set()
+            
+            for documents in self._stream_file(data_loader, dataset_name, file_path):
+                delete_ids = []
+                add_ids, add_docs = [], []
+                for doc in documents:
+                    doc_id = document_id(doc.metadata)
+                    seen_ids.add(doc_id)
+                    old_content = old_contents.get(doc_id)
+                    if old_content == doc.page_content:
+                        continue
+                    if old_content is not None:
+                        delete_ids.append(doc_id)
+                    add_ids.append(doc_id)
+                    add_docs.append(doc)
+                
+                # Changed rows keep their id, so drop the old vector before re-adding
+                removed += self._delete_documents(delete_ids)
+                if add_docs:
+                    self.vector_store.add_documents(add_docs, ids=add_ids)
+                    if self.lexical_index is not None:
+                        self.lexical_index.add(add_docs, add_ids)
+                    added += len(add_docs)
+            
+            # Rows that disappeared from a modified file
+            removed += self._delete_documents([doc_id for doc_id in old_contents if doc_id not in seen_ids])
+        
+        return added, removed
+    
+    def _report_embedding_stats(self):
+        """Print cache and throughput stats of any embedding wrappers in use"""
+        embeddings = self.embeddings
+        while embeddings is not None:
+            if isinstance(embeddings, CachedEmbeddings):
+                stats = embeddings.cache.stats()
+                print(f"Embedding cache: {stats['hits']} hits, {stats['misses']} misses "
+                      f"({stats['hit_rate']:.1%} hit rate), {stats['entries']} entries")
+            elif isinstance(embeddings, BatchedEmbeddings):
+                stats = embeddings.stats()
+                print(f"Embedding requests: {stats['documents']} documents at {stats['docs_per_sec']:.1f} docs/sec, "
+                      f"{stats['requests']} requests, {stats['retries']} retries ({stats['throttled']} throttled)")
+            embeddings = getattr(embeddings, "embeddings", None)
+    
+    def _stream_file(self, data_loader, dataset_name: str, file_path: str):
+        """Stream a single dataset file in INGEST_BATCH_SIZE document batches"""
+        return rebatch(data_loader.iter_file_batches(dataset_name, [Path(file_path)]),
+                       self.config.INGEST_BATCH_SIZE)
+    
+    def _delete_documents(self, ids: List[str]) -> int:
+        if not ids:
+            return 0
+        # LangChain's FAISS.delete assumes remove_ids compacts positions, which only
+        # holds for flat indexes; HNSW cannot remove at all
+        if self.config.VECTOR_STORE_TYPE == "faiss" and not isinstance(self.vector_store.index, faiss.IndexFlat):
+            raise IndexRebuildRequired(f"{self.config.FAISS_INDEX_TYPE} index does not support deleting documents")
+        self.vector_store.delete(ids)
+        if self.lexical_index is not None:
+            self.lexical_index.delete(ids)
+        return len(ids)
+    
+    def _documents_by_source(self, source_files: List[str]) -> Dict[str, Dict[str, str]]:
+        """Map each source file to the ids and contents of its indexed documents"""
+        wanted = set(source_files)
+        by_source = {source_file: {} for source_file in wanted}
+        if not wanted:
+            return by_source
+        
+        if self.config.VECTOR_STORE_TYPE == "faiss":
+            docstore = self.vector_store.docstore
+            for doc_id in self.vector_store.index_to_docstore_id.values():
+                doc = docstore.search(doc_id)
+                if isinstance(doc, Document) and doc.metadata.get("source_file") in wanted:
+                    by_source[doc.metadata["source_file"]][doc_id] = doc.page_content
+        else:
+            for source_file in wanted:
+                result = self.vector_store.get(where={"source_file": source_file}, include=["documents"])
+                by_source[source_file] = dict(zip(result["ids"], result["documents"]))
+        
+        return by_source
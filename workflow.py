@@ -1,45 +1,316 @@
 # workflow.py
+import asyncio
+import time
+import uuid
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple, Union
 from langgraph.graph import StateGraph, END
-from langgraph.checkpoint.sqlite import SqliteSaver
-from state import MedicalState
+from langgraph.utils import RunnableCallable
+from checkpoint_store import PruningSqliteSaver
+from config import MedicalConfig
+from embedding_cache import aembed_queries
+from metrics import MetricsRegistry, QueryTrace, atraced_iter, node_span, traced_iter, tracing
+from response_cache import ResponseCache
+from state import MedicalState, initial_state
 
 class MedicalWorkflow:
-    def __init__(self, agents):
+    # Analysis node -> (state buckets it analyzes, data types that call for it)
+    ANALYSIS_ROUTES = {
+        "clinical_analysis": (["patient_data", "clinical_notes"], ["clinical"]),
+        "imaging_analysis": (["imaging_data"], ["imaging", "ophthalmology"]),
+        "lab_analysis": (["lab_results"], ["clinical"]),
+        "genomic_analysis": (["genomic_data"], ["genomic"]),
+        "pathology_analysis": (["pathology_data"], ["pathology"]),
+        "cardiology_analysis": (["cardiology_data"], ["cardiology"])
+    }
+    
+    def __init__(self, agents, response_cache=None, config=None):
         self.agents = agents
+        self.response_cache = response_cache
+        self.config = config or MedicalConfig()
+        self.metrics = MetricsRegistry(self.config.METRICS_LOG_PATH)
         self.workflow = StateGraph(MedicalState)
         
         # Add all nodes
-        self.workflow.add_node("query_analyzer", self.agents.query_analyzer_agent)
-        self.workflow.add_node("data_retrieval", self.agents.data_retrieval_agent)
-        self.workflow.add_node("clinical_analysis", self.agents.clinical_analysis_agent)
-        self.workflow.add_node("imaging_analysis", self.agents.imaging_analysis_agent)
-        self.workflow.add_node("lab_analysis", self.agents.lab_analysis_agent)
-        self.workflow.add_node("data_integrator", self.agents.data_integrator_agent)
+        for node in ["query_analyzer", "data_retrieval", *self.ANALYSIS_ROUTES, "data_integrator"]:
+            self.workflow.add_node(node, self._node(node))
         
         # Define workflow
         self.workflow.set_entry_point("query_analyzer")
         
-        # Connect nodes
+        # Connect nodes; retrieval fans out only to the analyses that have data
         self.workflow.add_edge("query_analyzer", "data_retrieval")
-        self.workflow.add_edge("data_retrieval", "clinical_analysis")
-        self.workflow.add_edge("data_retrieval", "imaging_analysis")
-        self.workflow.add_edge("data_retrieval", "lab_analysis")
-        self.workflow.add_edge("clinical_analysis", "data_integrator")
-        self.workflow.add_edge("imaging_analysis", "data_integrator")
-        self.workflow.add_edge("lab_analysis", "data_integrator")
+        self.workflow.add_conditional_edges(
+            "data_retrieval",
+            self.route_analyses,
+            list(self.ANALYSIS_ROUTES) + ["data_integrator"]
+        )
+        for node in self.ANALYSIS_ROUTES:
+            self.workflow.add_edge(node, "data_integrator")
         self.workflow.add_edge("data_integrator", END)
         
-        # Compile with memory
-        memory = SqliteSaver.from_conn_string(":memory:")
-        self.app = self.workflow.compile(checkpointer=memory)
+        # Compile with memory, keeping only the latest checkpoints of recent threads
+        self.checkpointer = PruningSqliteSaver.from_path(
+            self.config.CHECKPOINT_DB_PATH,
+            keep_per_thread=self.config.CHECKPOINT_KEEP_PER_THREAD,
+            max_threads=self.config.CHECKPOINT_MAX_THREADS
+        )
+        self.app = self.workflow.compile(checkpointer=self.checkpointer)
     
-    def run(self, query: str) -> str:
-        """Execute the medical data exploration workflow"""
-        config = {"configurable": {"thread_id": "medical_thread_1"}}
+    def _node(self, name: str) -> RunnableCallable:
+        """Timed agent for a node; arun() uses its async variant, so the analysis branches overlap"""
+        func = getattr(self.agents, f"{name}_agent")
+        afunc = getattr(self.agents, f"a{name}_agent", None)
+        
+        def run_node(state: Dict) -> Dict:
+            with node_span(name):
+                return func(state)
+        
+        async def arun_node(state: Dict) -> Dict:
+            with node_span(name):
+                return await afunc(state)
+        
+        return RunnableCallable(run_node, arun_node if afunc else None, name=name, trace=False)
+    
+    def route_analyses(self, state: Dict) -> List[str]:
+        """Analysis nodes whose buckets were filled for a requested data type, or straight to the integrator"""
+        query_analysis = state.get("query_analysis", {})
+        data_types_needed = set(self.agents.retriever.resolve_data_types(query_analysis.get("data_types_needed", [])))
+        if query_analysis.get("lab_tests"):
+            data_types_needed.add("clinical")
+        
+        nodes = [
+            node for node, (buckets, data_types) in self.ANALYSIS_ROUTES.items()
+            if data_types_needed.intersection(data_types) and any(state.get(bucket) for bucket in buckets)
+        ]
+        return nodes or ["data_integrator"]
+    
+    def run(self, query: str, thread_id: Optional[str] = None) -> str:
+        """Execute the medical data exploration workflow, answering repeated queries from the response cache.
+        
+        Each call runs on its own checkpoint thread unless a thread_id (e.g. a
+        session id) is given; either way the query starts from empty state.
+        """
+        return self.run_traced(query, thread_id)[0]
+    
+    def run_traced(self, query: str, thread_id: Optional[str] = None) -> Tuple[str, QueryTrace]:
+        """run(), also returning the query's trace: node times, LLM tokens, embedding calls and searches"""
+        thread_id = thread_id or uuid.uuid4().hex
+        trace = QueryTrace(query, thread_id)
+        with tracing(trace):
+            if self.response_cache is not None:
+                response = self.response_cache.get_or_compute(query, lambda: self._run(query, thread_id))
+            else:
+                response = self._run(query, thread_id)
+        self._finish(trace)
+        return response, trace
+    
+    def _run(self, query: str, thread_id: Optional[str] = None) -> str:
+        config = {"configurable": {"thread_id": thread_id or uuid.uuid4().hex}}
         
         result = self.app.invoke(
-            {"query": query},
+            initial_state(query),
+            config=config
+        )
+        
+        return result["final_response"]
+    
+    async def arun(self, query: str, thread_id: Optional[str] = None) -> str:
+        """Async run(), so one process can serve many queries concurrently"""
+        return (await self.arun_traced(query, thread_id))[0]
+    
+    async def arun_traced(self, query: str, thread_id: Optional[str] = None) -> Tuple[str, QueryTrace]:
+        thread_id = thread_id or uuid.uuid4().hex
+        trace = QueryTrace(query, thread_id)
+        with tracing(trace):
+            if self.response_cache is not None:
+                response = await self.response_cache.aget_or_compute(query, lambda: self._arun(query, thread_id))
+            else:
+                response = await self._arun(query, thread_id)
+        self._finish(trace)
+        return response, trace
+    
+    async def _arun(self, query: str, thread_id: Optional[str] = None, prepared: Optional[Dict] = None) -> str:
+        """Run the graph; given a prepared query_analysis, it starts after the query analyzer"""
+        config = {"configurable": {"thread_id": thread_id or uuid.uuid4().hex}}
+        state = initial_state(query)
+        
+        if prepared and "query_analysis" in prepared:
+            await self.app.aupdate_state(config, {**state, **prepared}, as_node="query_analyzer")
+            state = None
+        
+        result = await self.app.ainvoke(
+            state,
             config=config
         )
         
         return result["final_response"]
+    
+    async def abatch(self, queries: List[str],
+                     max_concurrency: int = 8) -> AsyncIterator[Tuple[int, Union[str, Exception], QueryTrace]]:
+        """Run many queries, sharing work across them; yields (index, response, trace) as each finishes.
+        
+        The response cache is checked for all queries with one embedding call,
+        and cached queries are yielded first. Each other distinct query is
+        analyzed and run once; queries with the same response cache key
+        (normalize_query) share its response. All their search terms are
+        embedded together in one batched call before the rest of the graphs
+        run. These batch-wide embedding calls belong to no query's trace. At most max_concurrency LLM calls or graph runs are in
+        flight. A failed query yields its exception in place of the response.
+        """
+        traces = [QueryTrace(query, uuid.uuid4().hex) for query in queries]
+        responses, cache_embeddings = [None] * len(queries), [None] * len(queries)
+        if self.response_cache is not None:
+            responses, cache_embeddings = await self.response_cache.aget_many(queries)
+        
+        groups = {}  # response cache key of each distinct uncached query -> its indices
+        for index, (query, response) in enumerate(zip(queries, responses)):
+            if response is None:
+                groups.setdefault(ResponseCache.key(query), []).append(index)
+                continue
+            self._finish(traces[index], cached=True)
+            yield index, response, traces[index]
+        if not groups:
+            return
+        # Queries equal up to case, whitespace and trailing punctuation run once, as their first spelling
+        group_queries = {key: queries[indices[0]] for key, indices in groups.items()}
+        
+        semaphore = asyncio.Semaphore(max_concurrency)
+        
+        async def analyze(key: str) -> Dict:
+            async with semaphore:
+                with tracing(traces[groups[key][0]]), node_span("query_analyzer"):
+                    return (await self.agents.aquery_analyzer_agent({"query": group_queries[key]}))["query_analysis"]
+        
+        analyses = dict(zip(groups, await asyncio.gather(*map(analyze, groups), return_exceptions=True)))
+        
+        search_queries = {
+            key: self.agents.retriever.embedding_queries(
+                self.agents.search_queries({"query": group_queries[key], "query_analysis": analysis})
+            )
+            for key, analysis in analyses.items() if not isinstance(analysis, Exception)
+        }
+        texts = list(dict.fromkeys(text for texts in search_queries.values() for text in texts))
+        vectors = {}
+        if texts:
+            try:
+                vectors = dict(zip(texts, await aembed_queries(self.agents.vector_store.embeddings, texts)))
+            except Exception as e:
+                # Retrieval embeds each query's terms itself instead
+                print(f"⚠ Batched query embedding failed: {e}")
+        
+        async def run(key: str) -> List[Tuple[int, Union[str, Exception], QueryTrace]]:
+            first, query = groups[key][0], group_queries[key]
+            response = analyses[key]
+            if not isinstance(response, Exception):
+                prepared = {"query_analysis": response,
+                            "query_embeddings": {text: vectors[text] for text in search_queries[key]
+                                                 if text in vectors}}
+                try:
+                    async with semaphore:
+                        with tracing(traces[first]):
+                            response = await self._arun(query, traces[first].thread_id, prepared)
+                            if self.response_cache is not None:
+                                await self.response_cache.aput(query, response, cache_embeddings[first])
+                except Exception as e:
+                    response = e
+            for index in groups[key]:
+                self._finish(traces[index], cached=False)
+            return [(index, response, traces[index]) for index in groups[key]]
+        
+        for results in asyncio.as_completed([run(key) for key in groups]):
+            for result in await results:
+                yield result
+    
+    def _finish(self, trace: QueryTrace, cached: Optional[bool] = None):
+        """Close trace and record it; cached defaults to whether the graph never ran under it"""
+        if cached is None:
+            # get_or_compute() runs the graph inside the same trace only on a cache miss
+            cached = self.response_cache is not None and not trace.nodes
+        trace.cached = cached
+        trace.finish()
+        self.metrics.observe(trace)
+    
+    def stream(self, query: str, thread_id: Optional[str] = None) -> Iterator[Dict]:
+        """Run the workflow, yielding progress events as they happen.
+        
+        Yields {"type": "node", "node": name} as each node before the
+        integrator finishes, then {"type": "token", "content": text} for each
+        chunk of the final response as the LLM generates it, and finally
+        {"type": "done", "response": text, "cached": bool, "trace": dict}. A
+        cached response arrives as a single token event.
+        """
+        thread_id = thread_id or uuid.uuid4().hex
+        trace = QueryTrace(query, thread_id)
+        if self.response_cache is not None:
+            with tracing(trace):
+                cached, cache_embedding = self.response_cache.get(query)
+            if cached is not None:
+                self._finish(trace, cached=True)
+                yield {"type": "token", "content": cached}
+                yield {"type": "done", "response": cached, "cached": True, "trace": trace.to_dict()}
+                return
+        
+        config = {"configurable": {"thread_id": thread_id}}
+        
+        # Run every node up to the integrator, whose LLM call is streamed below
+        updates = self.app.stream(initial_state(query), config=config, stream_mode="updates",
+                                  interrupt_before=["data_integrator"])
+        for update in traced_iter(trace, updates):
+            for node in update:
+                yield {"type": "node", "node": node}
+        state = self.app.get_state(config).values
+        
+        start = time.perf_counter()
+        parts = []
+        for token in traced_iter(trace, self.agents.data_integrator_tokens(state), node="data_integrator"):
+            parts.append(token)
+            yield {"type": "token", "content": token}
+        response = "".join(parts)
+        trace.add_node("data_integrator", time.perf_counter() - start)
+        
+        # Complete the run as if the integrator node had produced the response
+        self.app.update_state(config, {"final_response": response}, as_node="data_integrator")
+        if self.response_cache is not None:
+            with tracing(trace):
+                self.response_cache.put(query, response, cache_embedding)
+        self._finish(trace, cached=False)
+        yield {"type": "node", "node": "data_integrator"}
+        yield {"type": "done", "response": response, "cached": False, "trace": trace.to_dict()}
+    
+    async def astream(self, query: str, thread_id: Optional[str] = None) -> AsyncIterator[Dict]:
+        """Async stream()"""
+        thread_id = thread_id or uuid.uuid4().hex
+        trace = QueryTrace(query, thread_id)
+        if self.response_cache is not None:
+            with tracing(trace):
+                cached, cache_embedding = await self.response_cache.aget(query)
+            if cached is not None:
+                self._finish(trace, cached=True)
+                yield {"type": "token", "content": cached}
+                yield {"type": "done", "response": cached, "cached": True, "trace": trace.to_dict()}
+                return
+        
+        config = {"configurable": {"thread_id": thread_id}}
+        
+        updates = self.app.astream(initial_state(query), config=config, stream_mode="updates",
+                                   interrupt_before=["data_integrator"])
+        async for update in atraced_iter(trace, updates):
+            for node in update:
+                yield {"type": "node", "node": node}
+        state = (await self.app.aget_state(config)).values
+        
+        start = time.perf_counter()
+        parts = []
+        async for token in atraced_iter(trace, self.agents.adata_integrator_tokens(state), node="data_integrator"):
+            parts.append(token)
+            yield {"type": "token", "content": token}
+        response = "".join(parts)
+        trace.add_node("data_integrator", time.perf_counter() - start)
+        
+        await self.app.aupdate_state(config, {"final_response": response}, as_node="data_integrator")
+        if self.response_cache is not None:
+            with tracing(trace):
+                await self.response_cache.aput(query, response, cache_embedding)
+        self._finish(trace, cached=False)
+        yield {"type": "node", "node": "data_integrator"}
+        yield {"type": "done", "response": response, "cached": False, "trace": trace.to_dict()}